@@ -0,0 +1,12 @@
+-- Add cached reports table
+-- The admin report is generated in the background and served from here
+
+CREATE TABLE IF NOT EXISTS cached_reports (
+    name VARCHAR(50) PRIMARY KEY,
+    payload TEXT NOT NULL,
+    generated_at DATETIME NOT NULL,
+    change_marker INT NOT NULL DEFAULT 0
+);
+
+-- Verify the changes
+DESCRIBE cached_reports;
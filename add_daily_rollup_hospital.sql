@@ -0,0 +1,15 @@
+-- Add a hospital dimension and requested units to daily rollups
+-- forecasting.py reads per-hospital demand and supply from the rollups instead of the raw tables
+
+ALTER TABLE daily_rollups ADD COLUMN hospital_id INT NOT NULL DEFAULT 0 AFTER district;
+ALTER TABLE daily_rollups ADD COLUMN units_requested INT NOT NULL DEFAULT 0 AFTER requests_created;
+ALTER TABLE daily_rollups DROP INDEX uq_daily_rollups_day;
+ALTER TABLE daily_rollups ADD UNIQUE KEY uq_daily_rollups_day (day, blood_group, district, hospital_id);
+
+-- Existing rows have no hospital split: drop them and let the next run of
+-- daily_rollups.py rebuild every day from the first request
+DELETE FROM daily_rollups;
+DELETE FROM watermarks WHERE name = 'daily_rollups';
+
+-- Verify the changes
+DESCRIBE daily_rollups;
@@ -0,0 +1,35 @@
+-- Add daily rollups table and the timestamp indexes its incremental job scans
+-- Rollups are filled by daily_rollups.py (python daily_rollups.py backfills from the first request)
+
+-- Fulfilment time, stamped when a request's status becomes 'fulfilled'
+ALTER TABLE requests ADD COLUMN fulfilled_at DATETIME NULL;
+
+-- Best available time for requests fulfilled before the column existed
+UPDATE requests r
+SET fulfilled_at = COALESCE(
+    (SELECT MAX(a.completed_at) FROM donor_acceptances a WHERE a.request_id = r.id AND a.status = 'completed'),
+    r.created_at
+)
+WHERE r.status = 'fulfilled' AND r.fulfilled_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    day DATE NOT NULL,
+    blood_group VARCHAR(25) NOT NULL,
+    district VARCHAR(100) NOT NULL,
+    requests_created INT NOT NULL DEFAULT 0,
+    requests_fulfilled INT NOT NULL DEFAULT 0,
+    units_donated INT NOT NULL DEFAULT 0,
+    alerts_sent INT NOT NULL DEFAULT 0,
+    acceptances INT NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_daily_rollups_day (day, blood_group, district)
+);
+
+CREATE INDEX idx_requests_created_at ON requests(created_at);
+CREATE INDEX idx_requests_fulfilled_at ON requests(fulfilled_at);
+CREATE INDEX idx_donor_acceptances_accepted_at ON donor_acceptances(accepted_at);
+CREATE INDEX idx_donor_acceptances_completed_at ON donor_acceptances(completed_at);
+CREATE INDEX idx_donor_alerts_created_at ON donor_alerts(created_at);
+
+-- Verify the changes
+DESCRIBE daily_rollups;
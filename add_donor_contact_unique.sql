@@ -0,0 +1,13 @@
+-- Make donor contact unique
+-- bulk_upload_donors.py --upsert merges partner donor lists keyed on contact (INSERT ... ON DUPLICATE KEY UPDATE)
+
+-- Duplicate contacts must be merged or removed first; this lists them
+SELECT contact, COUNT(*) AS donors, GROUP_CONCAT(id ORDER BY id) AS donor_ids
+FROM donors
+GROUP BY contact
+HAVING COUNT(*) > 1;
+
+ALTER TABLE donors ADD UNIQUE INDEX uq_donors_contact (contact);
+
+-- Verify the changes
+SHOW INDEX FROM donors WHERE Key_name = 'uq_donors_contact';
@@ -0,0 +1,18 @@
+-- Derive donor eligibility from next_eligible instead of a stored status
+-- A donor is eligible when next_eligible IS NULL OR next_eligible <= CURRENT_DATE (Donor.is_eligible),
+-- so the answer never goes stale; the ORM moves next_eligible whenever last_donated changes
+
+-- next_eligible from the last donation: 90 days for female donors, 120 for everyone else
+UPDATE donors
+SET next_eligible = DATE_ADD(last_donated, INTERVAL IF(LOWER(gender) = 'female', 90, 120) DAY)
+WHERE last_donated IS NOT NULL;
+
+-- Alert fan-out: one blood group, available, eligible-by-date range
+CREATE INDEX idx_donors_eligibility ON donors(blood_group, availability, next_eligible);
+
+-- The stored status string is no longer read or written
+DROP INDEX idx_donors_eligibility_status ON donors;
+ALTER TABLE donors DROP COLUMN eligibility_status;
+
+-- Verify the changes
+SHOW INDEX FROM donors WHERE Key_name = 'idx_donors_eligibility';
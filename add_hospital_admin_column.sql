@@ -0,0 +1,11 @@
+-- Add is_admin column to hospitals table
+-- Admin hospital accounts may force report refreshes, export donor contact data and bulk-import hospitals
+
+-- Add the new column
+ALTER TABLE hospitals ADD COLUMN is_admin BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Grant admin to an account by hand, e.g.
+-- UPDATE hospitals SET is_admin = TRUE WHERE username = 'city_hospital';
+
+-- Verify the changes
+DESCRIBE hospitals;
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Migration Script to Add Coordinates to Hospitals Table
+Adds: latitude, longitude (geocoded from location) and the stock search index on blood_lots
+"""
+
+import time
+from app import app, db
+from models import Hospital
+from routes import geocode_location
+from sqlalchemy import text
+
+def column_exists(table_name, column_name):
+    """Check if a column exists in a table"""
+    try:
+        result = db.session.execute(text(f"SHOW COLUMNS FROM {table_name} LIKE '{column_name}'"))
+        return result.fetchone() is not None
+    except:
+        return False
+
+def index_exists(table_name, index_name):
+    """Check if an index exists on a table"""
+    try:
+        result = db.session.execute(text(f"SHOW INDEX FROM {table_name} WHERE Key_name = '{index_name}'"))
+        return result.fetchone() is not None
+    except:
+        return False
+
+def run_migration():
+    with app.app_context():
+        print("Starting hospital coordinates migration...")
+        
+        try:
+            for column_name in ['latitude', 'longitude']:
+                if not column_exists('hospitals', column_name):
+                    print(f"Adding {column_name} column to hospitals table...")
+                    db.session.execute(text(f"ALTER TABLE hospitals ADD COLUMN {column_name} FLOAT NULL"))
+                else:
+                    print(f"Column {column_name} already exists in hospitals table")
+            
+            if not index_exists('blood_lots', 'idx_blood_lots_group_expiry'):
+                print("Adding stock search index to blood_lots table...")
+                db.session.execute(text(
+                    "CREATE INDEX idx_blood_lots_group_expiry ON blood_lots(blood_group, expires_at, hospital_id, units)"
+                ))
+            
+            db.session.commit()
+            
+            # Geocode hospitals that have no coordinates yet
+            hospitals = Hospital.query.filter(Hospital.latitude.is_(None)).all()
+            print(f"Geocoding {len(hospitals)} hospitals...")
+            for hospital in hospitals:
+                coords = geocode_location(hospital.location)
+                if coords:
+                    hospital.latitude = coords['lat']
+                    hospital.longitude = coords['lon']
+                    print(f"  - {hospital.name}: ({coords['lat']}, {coords['lon']})")
+                else:
+                    print(f"  - {hospital.name}: could not geocode '{hospital.location}'")
+                # Nominatim usage policy: at most one request per second
+                time.sleep(1)
+            
+            db.session.commit()
+            print("Migration completed successfully!")
+                
+        except Exception as e:
+            print(f"Migration failed: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    run_migration()
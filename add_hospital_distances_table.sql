@@ -0,0 +1,17 @@
+-- Add hospital distance matrix table
+-- Pairwise hospital distances, maintained incrementally by distance_matrix.py
+-- Backfill existing hospitals afterwards with: python distance_matrix.py
+
+CREATE TABLE IF NOT EXISTS hospital_distances (
+    from_hospital_id INT NOT NULL,
+    to_hospital_id INT NOT NULL,
+    straight_km FLOAT NOT NULL,
+    travel_minutes FLOAT NULL,
+    updated_at DATETIME,
+    PRIMARY KEY (from_hospital_id, to_hospital_id),
+    FOREIGN KEY (from_hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE,
+    FOREIGN KEY (to_hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
+);
+
+-- Verify the changes
+DESCRIBE hospital_distances;
@@ -0,0 +1,8 @@
+-- Add version column to hospitals table
+-- Inventory writes are compare-and-swapped against this column (optimistic concurrency)
+
+-- Add the new column
+ALTER TABLE hospitals ADD COLUMN version INT NOT NULL DEFAULT 1;
+
+-- Verify the changes
+DESCRIBE hospitals;
@@ -0,0 +1,13 @@
+-- Add import checkpoints table
+-- bulk_upload_donors.py records how far each CSV file got, so an interrupted import resumes
+
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    file_hash VARCHAR(64) PRIMARY KEY,
+    file_name VARCHAR(255) NOT NULL,
+    rows_committed INT NOT NULL DEFAULT 0,
+    completed_at DATETIME NULL,
+    updated_at DATETIME
+);
+
+-- Verify the changes
+DESCRIBE import_checkpoints;
@@ -0,0 +1,28 @@
+-- Add scheduler tables for periodic maintenance jobs
+-- worker.py keeps one scheduled_jobs row per job (next run and a lease, so only one
+-- app instance runs each job) and appends a job_runs row per run
+
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name VARCHAR(50) PRIMARY KEY,
+    schedule VARCHAR(100) NOT NULL,
+    next_run_at DATETIME NOT NULL,
+    locked_by VARCHAR(100) NULL,
+    locked_until DATETIME NULL,
+    last_run_at DATETIME NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_name VARCHAR(50) NOT NULL,
+    worker VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    started_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    duration_seconds FLOAT NULL,
+    error TEXT NULL,
+    INDEX idx_job_runs_job_started (job_name, started_at)
+);
+
+-- Verify the changes
+DESCRIBE scheduled_jobs;
+DESCRIBE job_runs;
@@ -1,23 +1,43 @@
 #!/usr/bin/env python3
 """
 Bulk Upload Script for Donors
-Handles CSV upload with 500 rows and proper password hashing
+Streams the CSV in chunks, inserting each chunk with bulk_insert_mappings
+and committing per chunk, with progress and throughput reporting. Each chunk
+is validated column-wise first and rejected rows go to an error report CSV.
+Passwords are hashed by a process pool; rows without one get a must-reset marker.
+Progress is checkpointed per file hash, so an interrupted import resumes.
+With --upsert, existing donors (same contact) are updated instead of skipped.
 """
 
+import os
+import numpy as np
 import pandas as pd
-import csv
-from datetime import datetime, date
-from werkzeug.security import generate_password_hash
+from datetime import datetime
 import requests
 import time
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from app import app, db
-from models import Donor
+from models import Donor, BLOOD_GROUPS, DONATION_GAP_DAYS, FEMALE_DONATION_GAP_DAYS
+from update_eligibility_for_all_donors import next_eligible_sql
+from import_pipeline import (
+    CHUNK_SIZE, RowErrors, read_chunks, clean_column, parse_dates, check_coordinates, check_counts,
+    default_error_report, append_error_report, load_checkpoint, hash_passwords, to_records
+)
+_location_cache = {}  # (lat, lon) rounded to ~100 m -> location name
 
 def reverse_geocode(lat, lon):
-    """Reverse geocode coordinates to get location name"""
+    """Reverse geocode coordinates to get location name (cached per ~100 m cell)"""
     if lat is None or lon is None:
         return "Unknown Location"
     
+    key = (round(lat, 3), round(lon, 3))
+    if key not in _location_cache:
+        _location_cache[key] = _lookup_location(lat, lon)
+    return _location_cache[key]
+
+def _lookup_location(lat, lon):
     try:
         # Using Nominatim (OpenStreetMap) - free and reliable
         url = f"https://nominatim.openstreetmap.org/reverse?lat={lat}&lon={lon}&format=json&addressdetails=1"
@@ -59,33 +79,7 @@ def reverse_geocode(lat, lon):
         print(f"Reverse geocoding failed for ({lat}, {lon}): {e}")
         return f"Lat: {lat:.4f}, Lon: {lon:.4f}"
 
-def parse_date(date_str):
-    """Parse date string to date object"""
-    if pd.isna(date_str) or date_str == '':
-        return None
-    
-    try:
-        # Try different date formats
-        for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']:
-            try:
-                return datetime.strptime(str(date_str), fmt).date()
-            except ValueError:
-                continue
-        return None
-    except:
-        return None
-
-def parse_coordinate(coord_str):
-    """Parse coordinate string to float"""
-    if pd.isna(coord_str) or coord_str == '':
-        return None
-    
-    try:
-        return float(coord_str)
-    except:
-        return None
-
-def show_field_mapping_summary(df):
+def show_field_mapping_summary(df, upsert=False):
     """Show how CSV fields map to database fields"""
     print("\n=== FIELD MAPPING SUMMARY ===")
     print("CSV Column -> Database Field -> Status")
@@ -116,8 +110,9 @@ def show_field_mapping_summary(df):
     # Fields that will use defaults
     default_fields = {
         'location': 'Auto-generated from coordinates',
-        'contact': 'Auto-generated (9999999XXXX)',
+        'contact': 'Required with --upsert' if upsert else 'Auto-generated (9999999XXXX)',
         'email': 'NULL',
+        'password (when empty)': 'Reset required before first login',
         'created_at': 'Auto-generated (current timestamp)',
         'user_type': 'donor'
     }
@@ -126,175 +121,236 @@ def show_field_mapping_summary(df):
     for field, default_value in default_fields.items():
         print(f"  {field}: {default_value}")
 
-def bulk_upload_donors(csv_file_path):
-    """Bulk upload donors from CSV file"""
+def validate_chunk(chunk, first_row, upsert=False):
+    """Parse and validate a CSV chunk column by column
+    Rows without a contact get a placeholder one, except when upserting: a placeholder
+    would match whichever donor got the same row number in an earlier import.
+    Returns (donor columns for valid rows, rejected CSV rows with their errors)"""
+    rows = pd.Series(np.arange(first_row, first_row + len(chunk)), index=chunk.index)
+    errors = RowErrors(chunk)
+    
+    name = clean_column(chunk, 'name')
+    blood_group = clean_column(chunk, 'blood_group')
+    errors.check(name.isna(), "name is empty")
+    errors.check(blood_group.isna(), "blood_group is empty")
+    errors.check(blood_group.notna() & ~blood_group.isin(BLOOD_GROUPS), "unknown blood_group")
+    
+    latitude, longitude = check_coordinates(chunk, errors)
+    donation_count = check_counts(chunk, 'donation_count', errors)
+    
+    dates = {}
+    for field in ('last_donated', 'next_eligible'):
+        raw = clean_column(chunk, field)
+        dates[field] = parse_dates(raw)
+        errors.check(raw.notna() & dates[field].isna(), f"{field} is not a date")
+    
+    # Eligibility is derived from next_eligible: last_donated + the gender's gap when known
+    gender = clean_column(chunk, 'Gender')
+    gap = np.where(gender.str.lower() == 'female', FEMALE_DONATION_GAP_DAYS, DONATION_GAP_DAYS)
+    next_eligible = (dates['last_donated'] + pd.to_timedelta(gap, unit='D')).fillna(dates['next_eligible'])
+    
+    availability = clean_column(chunk, 'availability')
+    contact = clean_column(chunk, 'contact')
+    if upsert:
+        errors.check(contact.isna(), "contact is empty (required with --upsert)")
+    donors = pd.DataFrame({
+        'row': rows,
+        'name': name,
+        'blood_group': blood_group,
+        'contact': contact.fillna('9999999' + (rows - 1).astype(str).str.zfill(4)),
+        'email': None,  # No email column in CSV
+        'password': clean_column(chunk, 'password'),  # plain text until hash_passwords runs
+        'availability': availability.isna() | (availability.str.lower() == 'active'),
+        'donations_count': donation_count,
+        'latitude': latitude,
+        'longitude': longitude,
+        'gender': gender,
+        'last_donated': dates['last_donated'].dt.date,
+        'next_eligible': next_eligible.dt.date,
+        'role': clean_column(chunk, 'role').fillna('volunteer')
+        # Note: created_at and user_type come from the column defaults
+    })
+    return donors[~errors.invalid], errors.rejected(chunk, rows)
+
+def to_mappings(donors):
+    """Insert mappings for validated donor rows, geocoding their locations"""
+    located = donors['latitude'].notna() & donors['longitude'].notna()
+    donors = donors.assign(location='Unknown Location')
+    donors.loc[located, 'location'] = [
+        reverse_geocode(lat, lon) for lat, lon in zip(donors.loc[located, 'latitude'], donors.loc[located, 'longitude'])
+    ]
+    return to_records(donors.drop(columns='row'))
+
+def load_existing_contacts():
+    """Every registered donor contact, loaded once so dedupe needs no per-row queries"""
+    return {contact for (contact,) in db.session.query(Donor.contact).yield_per(CHUNK_SIZE)}
+
+def insert_chunk(mappings, checkpoint, rows_committed):
+    """Insert one chunk and advance the checkpoint in the same transaction"""
+    if mappings:
+        db.session.bulk_insert_mappings(Donor, mappings)
+    checkpoint.rows_committed = rows_committed
+    db.session.commit()
+
+def upsert_statement(mappings):
+    """INSERT ... ON DUPLICATE KEY UPDATE keyed on contact, merging each column by its rule"""
+    if db.engine.dialect.name != 'mysql':
+        raise RuntimeError("Upsert mode needs MySQL (INSERT ... ON DUPLICATE KEY UPDATE)")
+    
+    donors = Donor.__table__.c
+    stmt = mysql_insert(Donor.__table__).values(mappings)
+    new = stmt.inserted
+    
+    def greatest(column):
+        # GREATEST() is NULL if either side is, so fall back to whichever value exists
+        return func.greatest(func.coalesce(column, new[column.name]), func.coalesce(new[column.name], column))
+    
+    def fill(column):
+        return func.coalesce(column, new[column.name])
+    
+    return stmt.on_duplicate_key_update(
+        donations_count=greatest(donors.donations_count),
+        last_donated=greatest(donors.last_donated),
+        next_eligible=greatest(donors.next_eligible),
+        availability=new.availability,
+        gender=fill(donors.gender),
+        latitude=fill(donors.latitude),
+        longitude=fill(donors.longitude)
+        # name, blood_group, location and password of existing donors are kept
+    )
+
+def donor_state(contacts):
+    """Merged columns of the donors with these contacts, to see which rows an upsert changed"""
+    if not contacts:
+        return {}
+    rows = db.session.query(
+        Donor.contact, Donor.donations_count, Donor.last_donated, Donor.next_eligible, Donor.availability,
+        Donor.gender, Donor.latitude, Donor.longitude
+    ).filter(Donor.contact.in_(contacts)).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def upsert_chunk(mappings, checkpoint, rows_committed):
+    """Merge one chunk into the donors table and advance the checkpoint in the same transaction
+    next_eligible is recomputed only for donors the merge inserted or changed; returns (inserted, updated)"""
+    contacts = [m['contact'] for m in mappings]
+    before = donor_state(contacts)
+    if mappings:
+        db.session.execute(upsert_statement(mappings))
+    after = donor_state(contacts)
+    
+    changed = [contact for contact in contacts if after.get(contact) != before.get(contact)]
+    if changed:
+        Donor.query.filter(Donor.contact.in_(changed), Donor.last_donated.isnot(None)).update(
+            {Donor.next_eligible: next_eligible_sql()}, synchronize_session=False
+        )
+    checkpoint.rows_committed = rows_committed
+    db.session.commit()
+    
+    inserted = sum(1 for contact in contacts if contact not in before)
+    return inserted, len(changed) - inserted
+
+def bulk_upload_donors(csv_file_path, chunk_size=CHUNK_SIZE, workers=None, error_report=None, restart=False, upsert=False):
+    """Bulk upload donors from CSV file, committing every `chunk_size` rows
+    Rows failing validation are written to `error_report` (default: <csv>.errors.csv).
+    An interrupted import of the same file resumes after its last committed chunk.
+    With upsert=True, rows for existing contacts are merged into those donors instead of skipped."""
+    error_report = error_report or default_error_report(csv_file_path)
     with app.app_context():
         print(f"Starting bulk upload from: {csv_file_path}")
+        pool = ProcessPoolExecutor(max_workers=workers)
         
         try:
-            # Read CSV file with headers
-            df = pd.read_csv(csv_file_path)
-            print(f"Loaded {len(df)} rows from CSV")
-            
-            # Display column names for verification
-            print(f"CSV columns: {list(df.columns)}")
+            checkpoint = load_checkpoint(csv_file_path, restart=restart)
+            if checkpoint.completed_at:
+                print(f"This file was already imported on {checkpoint.completed_at:%Y-%m-%d %H:%M} (use --restart to import it again)")
+                return
             
-            # Check for duplicate columns
-            if 'password' in df.columns and df.columns.tolist().count('password') > 1:
-                print(f"\n⚠️  WARNING: CSV contains duplicate 'password' columns. Using the first one.")
-                # Keep only the first password column
-                password_cols = [i for i, col in enumerate(df.columns) if col == 'password']
-                if len(password_cols) > 1:
-                    df = df.drop(columns=[df.columns[password_cols[-1]]])  # Drop the last duplicate
-                    print(f"   Removed duplicate password column.")
+            header = pd.read_csv(csv_file_path, nrows=0)
             
-            # Show actual column mapping
-            print("\n=== ACTUAL CSV COLUMN MAPPING ===")
-            for i, col in enumerate(df.columns):
-                print(f"Column {i}: {col}")
+            # Display column names for verification
+            print(f"CSV columns: {list(header.columns)}")
             
             # Check for problematic columns
-            if 'eligibility_status' in df.columns:
+            if 'eligibility_status' in header.columns:
                 print(f"\n⚠️  WARNING: CSV contains 'eligibility_status' column. This will be ignored.")
             
             # Show field mapping summary
-            show_field_mapping_summary(df)
+            show_field_mapping_summary(header, upsert)
+            
+            start_row = checkpoint.rows_committed
+            if start_row:
+                print(f"Resuming after row {start_row} (checkpoint {checkpoint.file_hash[:12]})")
             
-            # Process each row
             successful_inserts = 0
-            failed_inserts = 0
+            updated_donors = 0
+            skipped_existing = 0
+            skipped_duplicates = 0
+            rejected_rows = 0
+            append_report = bool(start_row) and os.path.exists(error_report)
+            rows_read = start_row
+            started = time.time()
+            
+            known_contacts = load_existing_contacts()
+            imported_contacts = set()
+            print(f"Loaded {len(known_contacts)} existing donor contacts")
             
-            for index, row in df.iterrows():
-                try:
-                    # Extract data by column names (using the actual CSV structure)
-                    name = str(row['name']).strip() if pd.notna(row['name']) and str(row['name']).strip() else ''
-                    blood_group = str(row['blood_group']).strip() if pd.notna(row['blood_group']) and str(row['blood_group']).strip() else ''
-                    latitude = parse_coordinate(row['latitude'])
-                    longitude = parse_coordinate(row['longitude'])
-                    availability = str(row['availability']).lower() == 'active' if pd.notna(row['availability']) and str(row['availability']).strip() else True
-                    # Parse donation_count safely
-                    try:
-                        if pd.notna(row['donation_count']) and str(row['donation_count']).strip():
-                            donation_count = int(row['donation_count'])
-                        else:
-                            donation_count = 0
-                    except (ValueError, TypeError):
-                        print(f"Row {index + 1}: Invalid donation_count '{row['donation_count']}', using 0")
-                        donation_count = 0
-                    gender = str(row['Gender']).strip() if pd.notna(row['Gender']) and str(row['Gender']).strip() else None
-                    last_donated = parse_date(row['last_donated'])
-                    next_eligible = parse_date(row['next_eligible'])
-                    role = str(row['role']).strip() if pd.notna(row['role']) and str(row['role']).strip() else 'volunteer'
-                    password = str(row['password']).strip() if pd.notna(row['password']) and str(row['password']).strip() else 'default123'
-                    contact = str(row['contact']).strip() if pd.notna(row['contact']) and str(row['contact']).strip() else f"9999999{index:04d}"
-                    
-                    # Validate required fields
-                    if not name:
-                        print(f"Row {index + 1}: Skipping - name is empty")
-                        failed_inserts += 1
-                        continue
-                         
-                    if not blood_group:
-                        print(f"Row {index + 1}: Skipping - blood_group is empty")
-                        failed_inserts += 1
-                        continue
-                     
-                    # Validate blood_group length
-                    if len(blood_group) > 25:
-                        print(f"Row {index + 1}: Skipping - blood_group '{blood_group}' is too long (max 25 chars)")
-                        failed_inserts += 1
-                        continue
-                     
-                    # Check if donor already exists (by contact number)
-                    existing_donor = Donor.query.filter_by(contact=contact).first()
-                    if existing_donor:
-                        print(f"Row {index + 1}: Donor with contact {contact} already exists, skipping...")
-                        continue
-                    
-                    # Auto-generate location from coordinates
-                    if latitude is not None and longitude is not None:
-                        location = reverse_geocode(latitude, longitude)
-                        print(f"Row {index + 1}: Generated location '{location}' from coordinates ({latitude}, {longitude})")
+            # Duplicate 'password' columns come back as password, password.1, ...; only the first is used
+            for chunk in read_chunks(csv_file_path, chunk_size, start_row):
+                donors, rejected = validate_chunk(chunk, rows_read + 1, upsert)
+                
+                keep = []
+                chunk_contacts = set()
+                for row_number, contact in zip(donors['row'], donors['contact']):
+                    if contact in known_contacts and not upsert:
+                        skipped_existing += 1
+                        keep.append(False)
+                    elif contact in chunk_contacts or contact in imported_contacts:
+                        print(f"Row {row_number}: Skipping - contact {contact} appears earlier in the file")
+                        skipped_duplicates += 1
+                        keep.append(False)
                     else:
-                        location = "Unknown Location"
-                    
-                    # Create new donor with proper field mapping
-                    donor_data = {
-                        'name': name,
-                        'blood_group': blood_group,
-                        'location': location,
-                        'contact': contact,
-                        'email': None,  # No email column in CSV
-                        'password': generate_password_hash(password),
-                        'availability': availability,
-                        'donations_count': donation_count,
-                        'latitude': latitude,
-                        'longitude': longitude,
-                        'gender': gender,
-                        'last_donated': last_donated,
-                        'next_eligible': next_eligible,
-                        'role': role
-                        # Note: created_at will be auto-generated, user_type will default to 'donor'
-                        # Note: eligibility_status will be calculated automatically by the model
-                    }
-                    
-                    # Debug: Show what fields are being processed
-                    if index < 3:  # Only show first 3 rows for debugging
-                        print(f"Row {index + 1} donor_data keys: {list(donor_data.keys())}")
-                        print(f"Row {index + 1} donor_data values: {list(donor_data.values())}")
-                    
-                    # Ensure only expected fields are included (filter out any unexpected ones)
-                    expected_fields = {
-                        'name', 'blood_group', 'location', 'contact', 'email', 'password',
-                        'availability', 'donations_count', 'latitude', 'longitude', 'gender',
-                        'last_donated', 'next_eligible', 'role'
-                    }
-                    
-                    # Filter donor_data to only include expected fields
-                    filtered_donor_data = {k: v for k, v in donor_data.items() if k in expected_fields}
-                    
-                    if filtered_donor_data != donor_data:
-                        print(f"Row {index + 1}: Filtered out unexpected fields: {set(donor_data.keys()) - expected_fields}")
-                    
-                    # Debug: Show final filtered data
-                    if index < 3:
-                        print(f"Row {index + 1} filtered_donor_data keys: {list(filtered_donor_data.keys())}")
-                        print(f"Row {index + 1} filtered_donor_data values: {list(filtered_donor_data.values())}")
-                    
-                    # Create donor object
-                    donor = Donor(**filtered_donor_data)
-                    
-                    # Debug: Check what fields the donor object actually has
-                    if index < 3:
-                        print(f"Row {index + 1} donor object attributes:")
-                        for attr in ['name', 'blood_group', 'location', 'contact', 'email', 'password', 
-                                   'availability', 'donations_count', 'latitude', 'longitude', 'gender',
-                                   'last_donated', 'next_eligible', 'role', 'created_at']:
-                            if hasattr(donor, attr):
-                                value = getattr(donor, attr)
-                                print(f"  {attr}: {value} (type: {type(value)})")
-                    
-                    db.session.add(donor)
-                    
-                    successful_inserts += 1
-                    
-                    # Progress indicator
-                    if (index + 1) % 50 == 0:
-                        print(f"Processed {index + 1}/{len(df)} rows...")
-                        
-                except Exception as e:
-                    print(f"Row {index + 1}: Error processing row - {e}")
-                    failed_inserts += 1
-                    continue
+                        chunk_contacts.add(contact)
+                        keep.append(True)
+                
+                mappings = to_mappings(donors[keep])
+                for mapping in mappings:
+                    if mapping['contact'] in known_contacts:
+                        mapping['password'] = None  # existing donors keep their password; don't hash it
+                hash_passwords(mappings, pool)
+                # A failed chunk stops the import; rerunning resumes at this chunk
+                if upsert:
+                    inserted, updated = upsert_chunk(mappings, checkpoint, rows_read + len(chunk))
+                    successful_inserts += inserted
+                    updated_donors += updated
+                else:
+                    insert_chunk(mappings, checkpoint, rows_read + len(chunk))
+                    successful_inserts += len(mappings)
+                imported_contacts |= chunk_contacts
+                rows_read += len(chunk)
+                
+                # Written after the commit so a resumed chunk does not report its rows twice
+                if len(rejected):
+                    append_error_report(rejected, error_report, append_report or rejected_rows > 0)
+                    rejected_rows += len(rejected)
+                
+                # Progress indicator
+                elapsed = time.time() - started
+                print(f"Processed {rows_read} rows: {successful_inserts} inserted, {updated_donors} updated, {skipped_existing} existing, "
+                      f"{skipped_duplicates} duplicates, {rejected_rows} invalid ({(rows_read - start_row) / elapsed:.0f} rows/s)")
             
-            # Commit all changes
-            print("Committing changes to database...")
+            checkpoint.completed_at = datetime.utcnow()
             db.session.commit()
             
-            print(f"\nBulk upload completed!")
+            elapsed = time.time() - started
+            print(f"\nBulk upload completed in {elapsed:.1f}s!")
             print(f"Successful inserts: {successful_inserts}")
-            print(f"Failed inserts: {failed_inserts}")
-            print(f"Total rows processed: {len(df)}")
+            if upsert:
+                print(f"Existing donors updated: {updated_donors}")
+            print(f"Skipped (contact already registered): {skipped_existing}")
+            print(f"Skipped (duplicate contact in file): {skipped_duplicates}")
+            print(f"Rejected by validation: {rejected_rows}" + (f" (see {error_report})" if rejected_rows else ''))
+            print(f"Total rows processed: {rows_read - start_row}" + (f" (after resuming at row {start_row + 1})" if start_row else ''))
+            print(f"Throughput: {(rows_read - start_row) / elapsed if elapsed else 0:.0f} rows/s")
             
             # Verify final count
             total_donors = Donor.query.count()
@@ -303,23 +359,30 @@ def bulk_upload_donors(csv_file_path):
         except Exception as e:
             print(f"Bulk upload failed: {e}")
             db.session.rollback()
+            print("Committed chunks are kept; run the same command again to resume")
             raise
+        finally:
+            pool.shutdown()
 
 def main():
     """Main function to run bulk upload"""
-    import sys
-    
-    if len(sys.argv) != 2:
-        print("Usage: python bulk_upload_donors.py <csv_file_path>")
-        print("Example: python bulk_upload_donors.py donors_data.csv")
-        sys.exit(1)
+    import argparse
     
-    csv_file_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Bulk upload donors from a CSV file')
+    parser.add_argument('csv_file_path', help='e.g. donors_data.csv')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f'Rows per transaction (default: {CHUNK_SIZE})')
+    parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: CPU count)')
+    parser.add_argument('--error-report', help='CSV of rejected rows (default: <csv>.errors.csv)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and read the file from the start')
+    parser.add_argument('--upsert', action='store_true', help='Merge rows into existing donors with the same contact (MySQL)')
+    args = parser.parse_args()
     
     try:
-        bulk_upload_donors(csv_file_path)
+        bulk_upload_donors(args.csv_file_path, chunk_size=args.chunk_size, workers=args.workers,
+                           error_report=args.error_report, restart=args.restart,
+                           upsert=args.upsert)
     except FileNotFoundError:
-        print(f"Error: CSV file '{csv_file_path}' not found!")
+        print(f"Error: CSV file '{args.csv_file_path}' not found!")
     except Exception as e:
         print(f"Error during bulk upload: {e}")
 
@@ -0,0 +1,201 @@
+"""
+Bulk hospital and inventory import for ClotSync
+Onboards many hospitals from one CSV: one row per hospital with its account
+details and, optionally, one column per blood group holding its opening stock.
+Uses the shared import pipeline (chunked, validated column by column with an
+error report, checkpointed per file so an interrupted import resumes). Locations
+without coordinates are geocoded once per distinct location, and each chunk's
+hospitals, blood lots and stock events are written with bulk inserts.
+
+CSV columns: name, location, contact, username, password (optional),
+latitude/longitude (optional), collected_at (optional), <blood group>... (units)
+
+Usage: python bulk_upload_hospitals.py <csv> [--chunk-size N] [--workers N]
+                                       [--error-report FILE] [--restart]
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from extensions import db
+from models import Hospital, BloodLot, StockEvent, BLOOD_GROUPS, BLOOD_SHELF_LIFE_DAYS
+from import_pipeline import (
+    CHUNK_SIZE, RowErrors, read_chunks, clean_column, parse_dates, check_coordinates, check_counts,
+    default_error_report, append_error_report, load_checkpoint, hash_passwords, geocode_cached, to_records
+)
+from stock_search import invalidate_stock_cache
+
+# Column limits from the hospitals table
+FIELD_LENGTHS = {'name': 100, 'location': 200, 'contact': 20, 'username': 50}
+OPTIONAL_COLUMNS = ('password', 'latitude', 'longitude', 'collected_at')
+
+def check_header(csv_path):
+    """Reject files with unexpected columns, e.g. a misspelt blood group whose stock would be lost"""
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    unknown = [c for c in columns if c not in FIELD_LENGTHS and c not in OPTIONAL_COLUMNS and c not in BLOOD_GROUPS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)} (blood group columns must be one of: {', '.join(BLOOD_GROUPS)})")
+
+def validate_hospital_chunk(chunk, first_row, now):
+    """Parse and validate a CSV chunk of hospitals
+    Returns (hospital columns and stock for valid rows, rejected CSV rows with their errors)"""
+    rows = pd.Series(np.arange(first_row, first_row + len(chunk)), index=chunk.index)
+    errors = RowErrors(chunk)
+
+    hospitals = pd.DataFrame({'row': rows}, index=chunk.index)
+    for field, length in FIELD_LENGTHS.items():
+        hospitals[field] = clean_column(chunk, field)
+        errors.check(hospitals[field].isna(), f"{field} is empty")
+        errors.check(hospitals[field].str.len() > length, f"{field} is longer than {length} characters")
+    hospitals['password'] = clean_column(chunk, 'password')  # plain text until hash_passwords runs
+    hospitals['latitude'], hospitals['longitude'] = check_coordinates(chunk, errors)
+
+    raw_collected = clean_column(chunk, 'collected_at')
+    collected_at = parse_dates(raw_collected)
+    errors.check(raw_collected.notna() & collected_at.isna(), "collected_at is not a date")
+    errors.check(collected_at > now, "collected_at is in the future")
+    errors.check(collected_at + timedelta(days=BLOOD_SHELF_LIFE_DAYS) <= now, "collected_at is past the shelf life")
+    hospitals['collected_at'] = collected_at.fillna(now)
+
+    for blood_group in BLOOD_GROUPS:
+        hospitals[blood_group] = check_counts(chunk, blood_group, errors)
+
+    return hospitals[~errors.invalid], errors.rejected(chunk, rows)
+
+def locate(hospitals):
+    """Fill missing coordinates from the location text (one lookup per distinct location)"""
+    missing = hospitals['latitude'].isna() | hospitals['longitude'].isna()
+    for index, location in hospitals.loc[missing, 'location'].items():
+        coords = geocode_cached(location)
+        if coords:
+            hospitals.loc[index, ['latitude', 'longitude']] = [coords['lat'], coords['lon']]
+    return hospitals
+
+def load_existing_usernames():
+    return {username for (username,) in db.session.query(Hospital.username).yield_per(CHUNK_SIZE)}
+
+def insert_hospital_chunk(hospitals, pool, checkpoint, rows_committed):
+    """Insert hospitals with their opening stock and distances, and advance the checkpoint, in one transaction
+    Returns the new hospital ids"""
+    from distance_matrix import update_distances_for
+
+    stock = hospitals[BLOOD_GROUPS]
+    mappings = to_records(hospitals[['name', 'location', 'contact', 'username', 'password', 'latitude', 'longitude']])
+    for mapping, units in zip(mappings, stock.to_dict('records')):
+        mapping['inventory'] = json.dumps({group: int(count) for group, count in units.items()})
+    hash_passwords(mappings, pool)
+
+    hospital_ids = []
+    if mappings:
+        db.session.bulk_insert_mappings(Hospital, mappings)
+        ids = dict(
+            db.session.query(Hospital.username, Hospital.id)
+            .filter(Hospital.username.in_(hospitals['username'].tolist()))
+            .all()
+        )
+        hospital_ids = [ids[username] for username in hospitals['username']]
+
+        # Opening stock: one lot and one 'received' event per hospital and group with units
+        stocked = stock.assign(hospital_id=hospital_ids, collected_at=list(hospitals['collected_at'].dt.to_pydatetime()))
+        stocked = stocked.melt(id_vars=['hospital_id', 'collected_at'], var_name='blood_group', value_name='units')
+        stocked = stocked[stocked['units'] > 0]
+        lots, events = [], []
+        for hospital_id, collected, blood_group, units in stocked.itertuples(index=False):
+            lots.append({
+                'hospital_id': hospital_id, 'blood_group': blood_group, 'units': int(units),
+                'collected_at': collected, 'expires_at': collected + timedelta(days=BLOOD_SHELF_LIFE_DAYS)
+            })
+            events.append({
+                'hospital_id': hospital_id, 'blood_group': blood_group, 'delta': int(units),
+                'balance': int(units), 'reason': 'received', 'created_at': datetime.utcnow()
+            })
+        db.session.bulk_insert_mappings(BloodLot, lots)
+        db.session.bulk_insert_mappings(StockEvent, events)
+        for blood_group in stocked['blood_group'].unique():
+            invalidate_stock_cache(blood_group)
+        update_distances_for(hospital_ids, commit=False)
+
+    checkpoint.rows_committed = rows_committed
+    db.session.commit()
+    return hospital_ids
+
+def import_hospitals(csv_path, pool, chunk_size=CHUNK_SIZE, error_report=None, restart=False, file_name=None):
+    """Import hospitals and their stock from a CSV file; returns a summary dict
+    An interrupted import of the same file resumes after its last committed chunk."""
+    check_header(csv_path)
+    error_report = error_report or default_error_report(csv_path)
+    checkpoint = load_checkpoint(csv_path, restart=restart, file_name=file_name)
+    summary = {'inserted': 0, 'existing': 0, 'duplicates': 0, 'rejected': 0, 'rows': 0,
+               'resumed_at': checkpoint.rows_committed, 'already_imported': bool(checkpoint.completed_at)}
+    if checkpoint.completed_at:
+        return summary
+
+    start_row = checkpoint.rows_committed
+    append_report = bool(start_row)
+    known_usernames = load_existing_usernames()
+    rows_read = start_row
+    started = time.time()
+
+    for chunk in read_chunks(csv_path, chunk_size, start_row):
+        now = datetime.utcnow()
+        hospitals, rejected = validate_hospital_chunk(chunk, rows_read + 1, now)
+
+        existing = hospitals['username'].isin(known_usernames)
+        duplicate = hospitals['username'].duplicated() & ~existing
+        summary['existing'] += int(existing.sum())
+        summary['duplicates'] += int(duplicate.sum())
+        hospitals = locate(hospitals[~existing & ~duplicate].copy())
+
+        # A failed chunk stops the import; rerunning resumes at this chunk
+        hospital_ids = insert_hospital_chunk(hospitals, pool, checkpoint, rows_read + len(chunk))
+        known_usernames.update(hospitals['username'])
+        summary['inserted'] += len(hospital_ids)
+        rows_read += len(chunk)
+
+        # Written after the commit so a resumed chunk does not report its rows twice
+        if len(rejected):
+            append_error_report(rejected, error_report, append_report or summary['rejected'] > 0)
+            summary['rejected'] += len(rejected)
+
+        elapsed = time.time() - started
+        print(f"Processed {rows_read} rows: {summary['inserted']} inserted, {summary['existing']} existing, "
+              f"{summary['duplicates']} duplicates, {summary['rejected']} invalid "
+              f"({(rows_read - start_row) / elapsed:.0f} rows/s)")
+
+    checkpoint.completed_at = datetime.utcnow()
+    db.session.commit()
+    summary['rows'] = rows_read - start_row
+    summary['error_report'] = error_report if summary['rejected'] else None
+    return summary
+
+def main():
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Bulk import hospitals and their opening stock from a CSV file')
+    parser.add_argument('csv_file_path', help='e.g. hospitals.csv')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help=f'Rows per transaction (default: {CHUNK_SIZE})')
+    parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: CPU count)')
+    parser.add_argument('--error-report', help='CSV of rejected rows (default: <csv>.errors.csv)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and read the file from the start')
+    args = parser.parse_args()
+
+    started = time.time()
+    with app.app_context(), ProcessPoolExecutor(max_workers=args.workers) as pool:
+        summary = import_hospitals(args.csv_file_path, pool, chunk_size=args.chunk_size,
+                                   error_report=args.error_report, restart=args.restart)
+    if summary['already_imported']:
+        print("This file was already imported (use --restart to import it again)")
+        return
+    print(f"Imported {summary['inserted']} hospitals from {summary['rows']} rows in {time.time() - started:.1f}s "
+          f"({summary['existing']} existing, {summary['duplicates']} duplicates, {summary['rejected']} invalid)")
+    if summary['error_report']:
+        print(f"Rejected rows: {summary['error_report']}")
+
+if __name__ == '__main__':
+    main()
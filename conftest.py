@@ -0,0 +1,53 @@
+"""
+Shared pytest fixtures for ClotSync
+The app is configured for the production MySQL server; tests swap in an in-memory
+SQLite engine and create the schema fresh for every test.
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+from werkzeug.security import generate_password_hash
+
+from app import app as flask_app
+from extensions import db
+from models import Hospital
+
+_engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db._app_engines[flask_app] = {None: _engine}
+        db.create_all()
+        try:
+            yield flask_app
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_hospital(app):
+    """Factory for hospitals that can log in with password 'pw'"""
+    def make(username, inventory=None, **fields):
+        hospital = Hospital(name=fields.pop('name', username.title()), location=fields.pop('location', 'Hyderabad'),
+                            contact=fields.pop('contact', '9000000000'), username=username,
+                            password=generate_password_hash('pw'), **fields)
+        hospital.set_inventory(inventory or {})
+        db.session.add(hospital)
+        db.session.commit()
+        return hospital
+    return make
+
+@pytest.fixture
+def login(client):
+    """Log the test client in as a hospital made by make_hospital"""
+    def log_in(username):
+        response = client.post('/login_hospital', json={'username': username, 'password': 'pw'})
+        assert response.status_code == 200, response.get_json()
+    return log_in
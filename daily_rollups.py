@@ -0,0 +1,170 @@
+"""
+Daily activity rollups for ClotSync
+One daily_rollups row per day x blood group x district x hospital with requests
+created (and units requested) and fulfilled, units donated, alerts sent and
+acceptances. rollup_daily() rebuilds the complete days after its watermark from a
+few GROUP BY queries over indexed timestamp ranges. /api/rollups/daily and the
+shortage forecasts read rollup rows instead of scanning the raw activity tables;
+donor reports and leaderboards are per-donor and read the donors table.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func
+
+from extensions import db
+from models import BloodRequest, DonorAcceptance, DonorAlert, Donor, Patient, DailyRollup, Watermark
+
+ROLLUP_WATERMARK = 'daily_rollups'  # last_id holds the ordinal of the last rolled-up day
+DAYS_PER_BATCH = 31
+UNKNOWN = 'Unknown'
+NO_HOSPITAL = 0
+COUNTERS = ('requests_created', 'units_requested', 'requests_fulfilled', 'units_donated', 'alerts_sent', 'acceptances')
+DIMENSIONS = ('day', 'blood_group', 'district', 'hospital_id')
+
+def _as_date(value):
+    """DATE() comes back as a date from MySQL and as a string from some drivers"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def _request_district():
+    return func.coalesce(BloodRequest.district, Patient.district, UNKNOWN)
+
+def _request_totals(timestamp, value, start, end):
+    district = _request_district()
+    hospital_id = func.coalesce(BloodRequest.hospital_id, NO_HOSPITAL)
+    return (
+        db.session.query(func.date(timestamp), BloodRequest.blood_group, district, hospital_id, value)
+        .outerjoin(Patient, BloodRequest.patient_id == Patient.id)
+        .filter(timestamp >= start, timestamp < end)
+        .group_by(func.date(timestamp), BloodRequest.blood_group, district, hospital_id)
+        .all()
+    )
+
+def _acceptance_totals(timestamp, value, start, end, *filters):
+    district = _request_district()
+    hospital_id = func.coalesce(BloodRequest.hospital_id, NO_HOSPITAL)
+    return (
+        db.session.query(func.date(timestamp), BloodRequest.blood_group, district, hospital_id, value)
+        .join(BloodRequest, DonorAcceptance.request_id == BloodRequest.id)
+        .outerjoin(Patient, BloodRequest.patient_id == Patient.id)
+        .filter(timestamp >= start, timestamp < end, *filters)
+        .group_by(func.date(timestamp), BloodRequest.blood_group, district, hospital_id)
+        .all()
+    )
+
+def _count_alerts(start, end):
+    # Alerts without a request fall back to the donor's blood group and the alert's hospital
+    blood_group = func.coalesce(BloodRequest.blood_group, Donor.blood_group, UNKNOWN)
+    district = _request_district()
+    hospital_id = func.coalesce(BloodRequest.hospital_id, DonorAlert.hospital_id, NO_HOSPITAL)
+    return (
+        db.session.query(func.date(DonorAlert.created_at), blood_group, district, hospital_id, func.count(DonorAlert.id))
+        .outerjoin(BloodRequest, DonorAlert.request_id == BloodRequest.id)
+        .outerjoin(Patient, BloodRequest.patient_id == Patient.id)
+        .outerjoin(Donor, DonorAlert.donor_id == Donor.id)
+        .filter(DonorAlert.created_at >= start, DonorAlert.created_at < end)
+        .group_by(func.date(DonorAlert.created_at), blood_group, district, hospital_id)
+        .all()
+    )
+
+def _rollup_range(first_day, last_day):
+    """Rollup rows for the days first_day..last_day inclusive"""
+    start = datetime.combine(first_day, time.min)
+    end = datetime.combine(last_day + timedelta(days=1), time.min)
+
+    sources = {
+        'requests_created': _request_totals(BloodRequest.created_at, func.count(BloodRequest.id), start, end),
+        'units_requested': _request_totals(
+            BloodRequest.created_at, func.sum(func.coalesce(BloodRequest.units_needed, 0)), start, end
+        ),
+        'requests_fulfilled': _request_totals(BloodRequest.fulfilled_at, func.count(BloodRequest.id), start, end),
+        'units_donated': _acceptance_totals(
+            DonorAcceptance.completed_at, func.sum(func.coalesce(DonorAcceptance.units_donated, 0)),
+            start, end, DonorAcceptance.status == 'completed'
+        ),
+        'acceptances': _acceptance_totals(DonorAcceptance.accepted_at, func.count(DonorAcceptance.id), start, end),
+        'alerts_sent': _count_alerts(start, end)
+    }
+
+    rows = {}
+    for counter, results in sources.items():
+        for day, blood_group, district, hospital_id, value in results:
+            key = (_as_date(day), blood_group or UNKNOWN, district or UNKNOWN, int(hospital_id or NO_HOSPITAL))
+            row = rows.setdefault(key, dict(
+                {name: 0 for name in COUNTERS}, day=key[0], blood_group=key[1], district=key[2], hospital_id=key[3]
+            ))
+            row[counter] += int(value or 0)
+    return list(rows.values())
+
+def rollup_daily(until=None):
+    """Rebuild rollups for every complete day after the watermark, up to the day before `until`"""
+    last_day = (until or date.today()) - timedelta(days=1)
+
+    watermark = Watermark.query.get(ROLLUP_WATERMARK)
+    if not watermark:
+        first = db.session.query(func.min(BloodRequest.created_at)).scalar()
+        if first is None:
+            print("No requests yet, nothing to roll up")
+            return 0
+        watermark = Watermark(name=ROLLUP_WATERMARK, last_id=_as_date(first).toordinal() - 1)
+        db.session.add(watermark)
+
+    day = date.fromordinal(watermark.last_id + 1)
+    written = 0
+    while day <= last_day:
+        batch_end = min(day + timedelta(days=DAYS_PER_BATCH - 1), last_day)
+        rows = _rollup_range(day, batch_end)
+
+        # Replace the batch and move the watermark in one transaction, so reruns are idempotent
+        DailyRollup.query.filter(DailyRollup.day >= day, DailyRollup.day <= batch_end).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(DailyRollup, rows)
+        watermark.last_id = batch_end.toordinal()
+        db.session.commit()
+
+        written += len(rows)
+        day = batch_end + timedelta(days=1)
+
+    print(f"Wrote {written} daily rollup rows up to {last_day.isoformat()}")
+    return written
+
+def rolled_up_until():
+    """Last day the rollups are complete for, or None before the first run"""
+    watermark = Watermark.query.get(ROLLUP_WATERMARK)
+    return date.fromordinal(watermark.last_id) if watermark and watermark.last_id > 0 else None
+
+def daily_totals(days=30, blood_group=None, district=None, group_by=('day',), today=None, hospital_id=None):
+    """Summed counters over the last `days` complete days, grouped by any of day/blood_group/district/hospital_id"""
+    group_by = [dim for dim in DIMENSIONS if dim in group_by]
+    today = today or date.today()
+    columns = [getattr(DailyRollup, dim) for dim in group_by]
+
+    query = db.session.query(*columns, *[func.sum(getattr(DailyRollup, c)) for c in COUNTERS]).filter(
+        DailyRollup.day >= today - timedelta(days=days),
+        DailyRollup.day < today
+    )
+    if blood_group:
+        query = query.filter(DailyRollup.blood_group == blood_group)
+    if district:
+        query = query.filter(DailyRollup.district == district)
+    if hospital_id is not None:
+        query = query.filter(DailyRollup.hospital_id == hospital_id)
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+
+    results = []
+    for row in query.all():
+        entry = dict(zip(group_by, row[:len(group_by)]))
+        if 'day' in entry:
+            entry['day'] = _as_date(entry['day']).isoformat()
+        entry.update({c: int(v or 0) for c, v in zip(COUNTERS, row[len(group_by):])})
+        results.append(entry)
+    return results
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        rollup_daily()
@@ -10,6 +10,10 @@ CREATE TABLE IF NOT EXISTS hospitals (
     username VARCHAR(50) UNIQUE NOT NULL,
     password VARCHAR(255) NOT NULL,
     inventory TEXT DEFAULT '{}',
+    version INT NOT NULL DEFAULT 1,
+    is_admin BOOLEAN NOT NULL DEFAULT FALSE,
+    latitude FLOAT NULL,
+    longitude FLOAT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -23,7 +27,13 @@ CREATE TABLE IF NOT EXISTS donors (
     availability BOOLEAN DEFAULT TRUE,
     donations_count INT DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    eligibility_status VARCHAR(20) DEFAULT 'eligible'
+    latitude FLOAT NULL,
+    longitude FLOAT NULL,
+    gender VARCHAR(10) NULL,
+    last_donated DATE NULL,
+    next_eligible DATE NULL,
+    role VARCHAR(20) DEFAULT 'volunteer',
+    UNIQUE KEY uq_donors_contact (contact)
 );
 
 -- Patients table
@@ -47,6 +57,7 @@ CREATE TABLE IF NOT EXISTS requests (
     status VARCHAR(20) DEFAULT 'pending',
     units_needed INT DEFAULT 1,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fulfilled_at DATETIME NULL,
     FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE
 );
 
@@ -54,7 +65,7 @@ CREATE TABLE IF NOT EXISTS requests (
 CREATE TABLE IF NOT EXISTS transfers (
     id INT AUTO_INCREMENT PRIMARY KEY,
     from_hospital_id INT NOT NULL,
-    to_hospital_id INT NOT NULL,
+    to_hospital_id INT NULL,
     blood_group VARCHAR(25) NOT NULL,
     units INT NOT NULL,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -63,6 +74,133 @@ CREATE TABLE IF NOT EXISTS transfers (
     FOREIGN KEY (to_hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
 );
 
+-- Blood lots table (per-lot stock ledger, allocated first-expiring-first-out)
+CREATE TABLE IF NOT EXISTS blood_lots (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    hospital_id INT NOT NULL,
+    blood_group VARCHAR(25) NOT NULL,
+    units INT NOT NULL,
+    collected_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    FOREIGN KEY (hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
+);
+
+-- Stock history: append-only change events, hourly/daily rollups and job watermarks
+CREATE TABLE IF NOT EXISTS stock_events (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    hospital_id INT NOT NULL,
+    blood_group VARCHAR(25) NOT NULL,
+    delta INT NOT NULL,
+    balance INT NOT NULL,
+    reason VARCHAR(20) NOT NULL,
+    created_at DATETIME NOT NULL,
+    FOREIGN KEY (hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS stock_rollups (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    hospital_id INT NOT NULL,
+    blood_group VARCHAR(25) NOT NULL,
+    granularity VARCHAR(5) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    opening_units INT NOT NULL,
+    closing_units INT NOT NULL,
+    min_units INT NOT NULL,
+    max_units INT NOT NULL,
+    units_in INT NOT NULL DEFAULT 0,
+    units_out INT NOT NULL DEFAULT 0,
+    events INT NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_stock_rollups_bucket (hospital_id, blood_group, granularity, bucket_start),
+    FOREIGN KEY (hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    last_id INT NOT NULL DEFAULT 0,
+    updated_at DATETIME
+);
+
+-- Daily rollups per day x blood group x district x hospital (maintained by daily_rollups.py)
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    day DATE NOT NULL,
+    blood_group VARCHAR(25) NOT NULL,
+    district VARCHAR(100) NOT NULL,
+    hospital_id INT NOT NULL DEFAULT 0,
+    requests_created INT NOT NULL DEFAULT 0,
+    units_requested INT NOT NULL DEFAULT 0,
+    requests_fulfilled INT NOT NULL DEFAULT 0,
+    units_donated INT NOT NULL DEFAULT 0,
+    alerts_sent INT NOT NULL DEFAULT 0,
+    acceptances INT NOT NULL DEFAULT 0,
+    UNIQUE KEY uq_daily_rollups_day (day, blood_group, district, hospital_id)
+);
+
+-- Shortage forecasts (precomputed by forecasting.py)
+CREATE TABLE IF NOT EXISTS shortage_forecasts (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    hospital_id INT NOT NULL,
+    blood_group VARCHAR(25) NOT NULL,
+    stock_units INT NOT NULL,
+    daily_demand FLOAT NOT NULL,
+    daily_supply FLOAT NOT NULL,
+    days_until_stockout FLOAT NULL,
+    computed_at DATETIME NOT NULL,
+    INDEX idx_shortage_forecasts_hospital (hospital_id),
+    FOREIGN KEY (hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
+);
+
+-- Cached reports (maintained by report_cache.py)
+CREATE TABLE IF NOT EXISTS cached_reports (
+    name VARCHAR(50) PRIMARY KEY,
+    payload TEXT NOT NULL,
+    generated_at DATETIME NOT NULL,
+    change_marker INT NOT NULL DEFAULT 0
+);
+
+-- Resumable CSV imports (bulk_upload_donors.py): progress per file hash
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    file_hash VARCHAR(64) PRIMARY KEY,
+    file_name VARCHAR(255) NOT NULL,
+    rows_committed INT NOT NULL DEFAULT 0,
+    completed_at DATETIME NULL,
+    updated_at DATETIME
+);
+
+-- Periodic job schedule, run leases and history (scheduler.py / worker.py)
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name VARCHAR(50) PRIMARY KEY,
+    schedule VARCHAR(100) NOT NULL,
+    next_run_at DATETIME NOT NULL,
+    locked_by VARCHAR(100) NULL,
+    locked_until DATETIME NULL,
+    last_run_at DATETIME NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_runs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_name VARCHAR(50) NOT NULL,
+    worker VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    started_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    duration_seconds FLOAT NULL,
+    error TEXT NULL,
+    INDEX idx_job_runs_job_started (job_name, started_at)
+);
+
+-- Hospital distance matrix (maintained by distance_matrix.py, one row per pair)
+CREATE TABLE IF NOT EXISTS hospital_distances (
+    from_hospital_id INT NOT NULL,
+    to_hospital_id INT NOT NULL,
+    straight_km FLOAT NOT NULL,
+    travel_minutes FLOAT NULL,
+    updated_at DATETIME,
+    PRIMARY KEY (from_hospital_id, to_hospital_id),
+    FOREIGN KEY (from_hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE,
+    FOREIGN KEY (to_hospital_id) REFERENCES hospitals(id) ON DELETE CASCADE
+);
+
 -- Donor alerts table
 CREATE TABLE IF NOT EXISTS donor_alerts (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -94,7 +232,13 @@ INSERT INTO patients (name, blood_group, location, contact, username, password)
 -- Create indexes for better performance
 CREATE INDEX idx_donors_blood_group ON donors(blood_group);
 CREATE INDEX idx_donors_availability ON donors(availability);
+CREATE INDEX idx_donors_eligibility ON donors(blood_group, availability, next_eligible);
 CREATE INDEX idx_requests_status ON requests(status);
 CREATE INDEX idx_requests_blood_group ON requests(blood_group);
 CREATE INDEX idx_transfers_timestamp ON transfers(timestamp);
+CREATE INDEX idx_blood_lots_fefo ON blood_lots(hospital_id, blood_group, expires_at);
+CREATE INDEX idx_blood_lots_group_expiry ON blood_lots(blood_group, expires_at, hospital_id, units);
+CREATE INDEX idx_requests_created_at ON requests(created_at);
+CREATE INDEX idx_requests_fulfilled_at ON requests(fulfilled_at);
+CREATE INDEX idx_donor_alerts_created_at ON donor_alerts(created_at);
 
@@ -0,0 +1,273 @@
+"""
+Hospital-to-hospital distance matrix for ClotSync
+Pairwise distances are stored in hospital_distances (one row per pair) and only
+recomputed for a hospital when it is added or moved. Each process keeps the
+matrix in memory as a NumPy array indexed by hospital id, so a lookup is an
+array read instead of two geocoding calls. A generation counter in watermarks
+tells other processes when their copy is out of date.
+
+Usage: python distance_matrix.py    recompute every pair (backfill after migrating)
+"""
+
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import or_
+
+from extensions import db
+from models import Hospital, HospitalDistance, Watermark
+from stock_search import haversine_km
+
+MATRIX_WATERMARK = 'hospital_distances'  # last_id is used as a generation counter
+MATRIX_CHECK_SECONDS = 60
+INSERT_BATCH_SIZE = 5000
+
+_matrix_lock = threading.Lock()
+_matrix = None
+_checked_at = 0.0
+
+class DistanceMatrix:
+    """Symmetric distances between located hospitals; NaN where no distance is stored"""
+
+    def __init__(self, hospital_ids, km, travel_minutes, generation):
+        self.hospital_ids = list(hospital_ids)
+        self.index = {hospital_id: i for i, hospital_id in enumerate(self.hospital_ids)}
+        self.km = km
+        self.travel_minutes = travel_minutes
+        self.generation = generation
+
+    def __contains__(self, hospital_id):
+        return hospital_id in self.index
+
+    def __len__(self):
+        return len(self.hospital_ids)
+
+    def indices(self, hospital_ids):
+        """Matrix positions of hospital ids (-1 for hospitals not in the matrix)"""
+        return np.array([self.index.get(h, -1) for h in hospital_ids], dtype=int)
+
+    def distance(self, from_id, to_id):
+        """Straight-line km between two hospitals, or None if unknown"""
+        i, j = self.index.get(from_id), self.index.get(to_id)
+        if i is None or j is None or np.isnan(self.km[i, j]):
+            return None
+        return float(self.km[i, j])
+
+    def distances_from(self, from_id, to_ids):
+        """km from one hospital to many, as an array (NaN for unknown pairs)"""
+        result = np.full(len(to_ids), np.nan)
+        i = self.index.get(from_id)
+        if i is None:
+            return result
+        cols = self.indices(to_ids)
+        known = cols >= 0
+        result[known] = self.km[i, cols[known]]
+        return result
+
+    def _set_row(self, hospital_id, other_ids, km):
+        """Place one hospital's fresh distances, growing the matrix for a new hospital"""
+        if hospital_id not in self.index:
+            n = len(self.hospital_ids)
+            self.km = np.pad(self.km, ((0, 1), (0, 1)), constant_values=np.nan)
+            self.travel_minutes = np.pad(self.travel_minutes, ((0, 1), (0, 1)), constant_values=np.nan)
+            self.km[n, n] = 0.0
+            self.hospital_ids.append(hospital_id)
+            self.index[hospital_id] = n
+
+        i = self.index[hospital_id]
+        self.km[i, :] = np.nan
+        self.km[:, i] = np.nan
+        self.travel_minutes[i, :] = np.nan
+        self.travel_minutes[:, i] = np.nan
+        self.km[i, i] = 0.0
+        cols = self.indices(other_ids)
+        known = cols >= 0
+        self.km[i, cols[known]] = km[known]
+        self.km[cols[known], i] = km[known]
+
+def _generation():
+    watermark = Watermark.query.get(MATRIX_WATERMARK)
+    return watermark.last_id if watermark else 0
+
+def _bump_generation():
+    updated = Watermark.query.filter_by(name=MATRIX_WATERMARK).update(
+        {Watermark.last_id: Watermark.last_id + 1, Watermark.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(Watermark(name=MATRIX_WATERMARK, last_id=1))
+
+def _load_matrix(generation):
+    """Build the in-memory matrix from the stored pairs"""
+    hospital_ids = [
+        hospital_id for (hospital_id,) in
+        db.session.query(Hospital.id)
+        .filter(Hospital.latitude.isnot(None), Hospital.longitude.isnot(None))
+        .order_by(Hospital.id)
+        .all()
+    ]
+    n = len(hospital_ids)
+    km = np.full((n, n), np.nan, dtype=np.float32)
+    travel_minutes = np.full((n, n), np.nan, dtype=np.float32)
+    np.fill_diagonal(km, 0.0)
+    matrix = DistanceMatrix(hospital_ids, km, travel_minutes, generation)
+
+    rows = db.session.query(
+        HospitalDistance.from_hospital_id, HospitalDistance.to_hospital_id,
+        HospitalDistance.straight_km, HospitalDistance.travel_minutes
+    ).yield_per(INSERT_BATCH_SIZE)
+    for from_id, to_id, straight_km, minutes in rows:
+        i, j = matrix.index.get(from_id), matrix.index.get(to_id)
+        if i is None or j is None:
+            continue
+        km[i, j] = km[j, i] = straight_km
+        if minutes is not None:
+            travel_minutes[i, j] = travel_minutes[j, i] = minutes
+    return matrix
+
+def get_distance_matrix():
+    """In-memory matrix; reloaded only when the stored distances changed in another process"""
+    global _matrix, _checked_at
+    now = time.monotonic()
+    with _matrix_lock:
+        if _matrix is not None and now - _checked_at < MATRIX_CHECK_SECONDS:
+            return _matrix
+
+    generation = _generation()
+    with _matrix_lock:
+        if _matrix is None or _matrix.generation != generation:
+            _matrix = _load_matrix(generation)
+        _checked_at = now
+        return _matrix
+
+def _pair_rows(hospital_id, other_ids, km, now):
+    return [
+        {
+            'from_hospital_id': min(hospital_id, other_id),
+            'to_hospital_id': max(hospital_id, other_id),
+            'straight_km': round(float(d), 2),
+            'travel_minutes': None,
+            'updated_at': now
+        }
+        for other_id, d in zip(other_ids, km)
+    ]
+
+def update_hospital_distances(hospital):
+    """Recompute one hospital's distances after it is added or moved (commits)"""
+    global _matrix
+    HospitalDistance.query.filter(or_(
+        HospitalDistance.from_hospital_id == hospital.id,
+        HospitalDistance.to_hospital_id == hospital.id
+    )).delete(synchronize_session=False)
+
+    located = hospital.latitude is not None and hospital.longitude is not None
+    other_ids, km = [], np.array([])
+    if located:
+        others = (
+            db.session.query(Hospital.id, Hospital.latitude, Hospital.longitude)
+            .filter(Hospital.latitude.isnot(None), Hospital.longitude.isnot(None), Hospital.id != hospital.id)
+            .all()
+        )
+        other_ids = [o[0] for o in others]
+        km = haversine_km(hospital.latitude, hospital.longitude, [o[1] for o in others], [o[2] for o in others])
+        rows = _pair_rows(hospital.id, other_ids, km, datetime.utcnow())
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.bulk_insert_mappings(HospitalDistance, rows[start:start + INSERT_BATCH_SIZE])
+
+    _bump_generation()
+    db.session.commit()
+
+    # Patch this process's copy in place instead of reloading it
+    generation = _generation()
+    with _matrix_lock:
+        if _matrix is not None and _matrix.generation == generation - 1 and (located or hospital.id not in _matrix):
+            if located:
+                _matrix._set_row(hospital.id, other_ids, km)
+            _matrix.generation = generation
+        else:
+            _matrix = None
+    return len(other_ids)
+
+def update_distances_for(hospital_ids, commit=True):
+    """Recompute the distances of many hospitals at once, e.g. after a bulk import
+    Same pairs as calling update_hospital_distances for each one, with a single
+    generation bump so other processes reload the matrix once. With commit=False the
+    caller commits, so the distances land in the same transaction as its own writes."""
+    global _matrix
+    hospital_ids = sorted(set(hospital_ids))
+    if not hospital_ids:
+        return 0
+    for start in range(0, len(hospital_ids), INSERT_BATCH_SIZE):
+        batch = hospital_ids[start:start + INSERT_BATCH_SIZE]
+        HospitalDistance.query.filter(or_(
+            HospitalDistance.from_hospital_id.in_(batch),
+            HospitalDistance.to_hospital_id.in_(batch)
+        )).delete(synchronize_session=False)
+
+    hospitals = (
+        db.session.query(Hospital.id, Hospital.latitude, Hospital.longitude)
+        .filter(Hospital.latitude.isnot(None), Hospital.longitude.isnot(None))
+        .order_by(Hospital.id)
+        .all()
+    )
+    ids = np.array([h[0] for h in hospitals], dtype=int)
+    lats = np.array([h[1] for h in hospitals], dtype=float)
+    lons = np.array([h[2] for h in hospitals], dtype=float)
+    changed = np.isin(ids, hospital_ids)
+    positions = np.arange(len(ids))
+
+    now = datetime.utcnow()
+    pairs = 0
+    for i in np.flatnonzero(changed):
+        # Pairs between two changed hospitals are written by the one with the lower id
+        others = (~changed | (positions > i)) & (positions != i)
+        km = haversine_km(lats[i], lons[i], lats[others], lons[others])
+        rows = _pair_rows(int(ids[i]), ids[others].tolist(), km, now)
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.bulk_insert_mappings(HospitalDistance, rows[start:start + INSERT_BATCH_SIZE])
+        pairs += len(rows)
+
+    _bump_generation()
+    if commit:
+        db.session.commit()
+    with _matrix_lock:
+        _matrix = None
+    return pairs
+
+def rebuild_distance_matrix():
+    """Recompute every stored distance (backfill after migrating)"""
+    global _matrix
+    hospitals = (
+        db.session.query(Hospital.id, Hospital.latitude, Hospital.longitude)
+        .filter(Hospital.latitude.isnot(None), Hospital.longitude.isnot(None))
+        .order_by(Hospital.id)
+        .all()
+    )
+    ids = [h[0] for h in hospitals]
+    lats = np.array([h[1] for h in hospitals], dtype=float)
+    lons = np.array([h[2] for h in hospitals], dtype=float)
+
+    HospitalDistance.query.delete()
+    now = datetime.utcnow()
+    pairs = 0
+    for i in range(len(ids) - 1):
+        # Pairs with later hospitals only, so each pair is written once
+        km = haversine_km(lats[i], lons[i], lats[i + 1:], lons[i + 1:])
+        rows = _pair_rows(ids[i], ids[i + 1:], km, now)
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.bulk_insert_mappings(HospitalDistance, rows[start:start + INSERT_BATCH_SIZE])
+        pairs += len(rows)
+
+    _bump_generation()
+    db.session.commit()
+    with _matrix_lock:
+        _matrix = None
+    print(f"Stored {pairs} distances between {len(ids)} hospitals")
+    return pairs
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        rebuild_distance_matrix()
@@ -0,0 +1,161 @@
+"""
+"Eligible again" notifications for ClotSync
+Donors are not alerted about requests while they are in their waiting period.
+notify_eligible_again() runs daily: for each blood group it range-scans the
+(blood_group, availability, next_eligible) index for donors whose next_eligible
+falls after the watermark day and on or before today, matches them to pending
+same-group requests near them, and sends each donor one alert (and one email)
+listing those requests.
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from extensions import db
+from models import Donor, BloodRequest, DonorAlert, Hospital, Watermark
+from stock_search import haversine_km
+
+ELIGIBLE_AGAIN_WATERMARK = 'eligible_again_alerts'  # last_id holds the ordinal of the last day notified
+NEARBY_RADIUS_KM = 50
+REQUEST_MAX_AGE_DAYS = 30  # older pending requests are assumed stale
+MAX_REQUESTS_PER_ALERT = 5
+MAX_CATCH_UP_DAYS = 3  # after a longer outage, donors who became eligible earlier are not notified late
+
+def _pending_requests(since):
+    """Recent pending requests per blood group, with the requesting hospital's coordinates"""
+    rows = (
+        db.session.query(
+            BloodRequest.id, BloodRequest.blood_group, BloodRequest.request_code, BloodRequest.units_needed,
+            BloodRequest.hospital_id, BloodRequest.district, BloodRequest.requested_date_text,
+            Hospital.name, Hospital.latitude, Hospital.longitude
+        )
+        .outerjoin(Hospital, BloodRequest.hospital_id == Hospital.id)
+        .filter(BloodRequest.status == 'pending', BloodRequest.created_at >= since)
+        .order_by(BloodRequest.created_at)
+        .all()
+    )
+    by_group = {}
+    for row in rows:
+        by_group.setdefault(row.blood_group, []).append(row)
+    return by_group
+
+def _nearby(donor, requests, lats, lons):
+    """(request, distance km or None) pairs near the donor, nearest first
+    Coordinates are compared when both sides have them, otherwise the request's
+    district has to appear in the donor's location text."""
+    if donor.latitude is not None and donor.longitude is not None:
+        distances = haversine_km(donor.latitude, donor.longitude, lats, lons)
+    else:
+        distances = np.full(len(requests), np.nan)
+
+    location = (donor.location or '').lower()
+    matches = []
+    for request, km in zip(requests, distances):
+        if not np.isnan(km):
+            if km <= NEARBY_RADIUS_KM:
+                matches.append((request, round(float(km), 1)))
+        elif request.district and request.district.lower() in location:
+            matches.append((request, None))
+    matches.sort(key=lambda match: float('inf') if match[1] is None else match[1])
+    return matches
+
+def _alert_message(donor, matches):
+    lines = [
+        f"🎉 You can donate again - {len(matches)} request{'s' if len(matches) != 1 else ''} near you need {donor.blood_group}:",
+        "",
+        f"Dear {donor.name},",
+        "Your waiting period is over. These patients near you are still waiting for donors:",
+        ""
+    ]
+    for request, km in matches:
+        place = request.name or request.district or 'N/A'
+        distance = f", {km} km away" if km is not None else ''
+        lines.append(
+            f"- {request.request_code}: {request.units_needed} unit(s) at {place}{distance}"
+            f" (required by {request.requested_date_text or 'ASAP'})"
+        )
+    lines += ["", "Open your alerts to accept a request.", "", "With gratitude,\nThe ClotSync Team ❤️"]
+    return '\n'.join(lines)
+
+def notify_eligible_again(today=None):
+    """Send one batched alert per donor who became eligible since the last run; returns alerts sent"""
+    from routes import send_email
+
+    today = today or date.today()
+    watermark = Watermark.query.get(ELIGIBLE_AGAIN_WATERMARK)
+    if not watermark:
+        watermark = Watermark(name=ELIGIBLE_AGAIN_WATERMARK, last_id=today.toordinal() - 1)
+        db.session.add(watermark)
+    if watermark.last_id >= today.toordinal():
+        return 0
+    after = max(date.fromordinal(watermark.last_id), today - timedelta(days=MAX_CATCH_UP_DAYS))
+
+    alerts, emails = [], []
+    now = datetime.utcnow()
+    for blood_group, requests in _pending_requests(now - timedelta(days=REQUEST_MAX_AGE_DAYS)).items():
+        donors = (
+            db.session.query(Donor.id, Donor.name, Donor.email, Donor.blood_group, Donor.location,
+                             Donor.latitude, Donor.longitude)
+            .filter(
+                Donor.blood_group == blood_group,
+                Donor.availability.is_(True),
+                Donor.next_eligible > after,
+                Donor.next_eligible <= today
+            )
+            .all()
+        )
+        if not donors:
+            continue
+
+        # Requests a donor was already alerted about are left out of their summary
+        already_alerted = set(
+            db.session.query(DonorAlert.donor_id, DonorAlert.request_id)
+            .filter(
+                DonorAlert.donor_id.in_([d.id for d in donors]),
+                DonorAlert.request_id.in_([r.id for r in requests])
+            )
+            .all()
+        )
+        lats = np.array([np.nan if r.latitude is None else r.latitude for r in requests], dtype=float)
+        lons = np.array([np.nan if r.longitude is None else r.longitude for r in requests], dtype=float)
+
+        for donor in donors:
+            matches = [
+                (request, km) for request, km in _nearby(donor, requests, lats, lons)
+                if (donor.id, request.id) not in already_alerted
+            ][:MAX_REQUESTS_PER_ALERT]
+            if not matches:
+                continue
+            message = _alert_message(donor, matches)
+            nearest = matches[0][0]
+            alerts.append({
+                'donor_id': donor.id,
+                'request_id': nearest.id,
+                'hospital_id': nearest.hospital_id,
+                'message': message,
+                'is_read': False,
+                'created_at': now
+            })
+            if donor.email:
+                emails.append((donor.email, message))
+
+    # Alerts and the watermark move together, so a rerun on the same day sends nothing twice
+    db.session.bulk_insert_mappings(DonorAlert, alerts)
+    watermark.last_id = today.toordinal()
+    db.session.commit()
+
+    for email, message in emails:
+        try:
+            send_email(to_email=email, subject="🎉 You can donate again - patients near you need your help", body=message)
+        except Exception as e:
+            print(f"Eligible-again email send failed to {email}: {e}")
+
+    print(f"Sent {len(alerts)} eligible-again alerts for donors eligible from {(after + timedelta(days=1)).isoformat()} "
+          f"to {today.isoformat()}")
+    return len(alerts)
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        notify_eligible_again()
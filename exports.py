@@ -0,0 +1,208 @@
+"""
+Data exports for ClotSync
+Streams donors, requests and transfers out of the database in chunks from a
+server-side cursor, as CSV (streamed over HTTP or to a file) or as Parquet (needs
+pyarrow; without it only CSV is offered). Memory use depends on the chunk size, not on the
+size of the table. Donor names, contact details and coordinates are left out
+unless the caller asks for private columns (the CLI and admin accounts only).
+
+Usage: python exports.py <donors|requests|transfers> [--format csv|parquet] [--out FILE]
+                         [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--blood-group G] [--status S]
+"""
+
+import csv
+import io
+from datetime import datetime, date
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer
+
+from extensions import db
+from models import Donor, BloodRequest, BloodTransfer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_CHUNK_SIZE = 5000
+
+# Exported columns per dataset (never the password hash), plus the columns filters apply to.
+# Private columns are personal data, included only when the export asks for them.
+EXPORTS = {
+    'donors': {
+        'model': Donor,
+        'columns': ['id', 'name', 'blood_group', 'location', 'contact', 'email', 'gender', 'availability',
+                    'donations_count', 'last_donated', 'next_eligible', 'role', 'eligibility_status',
+                    'latitude', 'longitude', 'created_at'],
+        'private_columns': ['name', 'contact', 'email', 'latitude', 'longitude'],
+        'date_column': 'created_at',
+        'status_column': 'eligibility_status'
+    },
+    'requests': {
+        'model': BloodRequest,
+        'columns': ['id', 'patient_id', 'hospital_id', 'blood_group', 'urgency', 'status', 'units_needed',
+                    'request_code', 'district', 'state', 'created_at', 'fulfilled_at'],
+        'date_column': 'created_at',
+        'status_column': 'status'
+    },
+    'transfers': {
+        'model': BloodTransfer,
+        'columns': ['id', 'from_hospital_id', 'to_hospital_id', 'blood_group', 'units', 'timestamp', 'status'],
+        'date_column': 'timestamp',
+        'status_column': 'status'
+    }
+}
+
+def _export_spec(name):
+    if name not in EXPORTS:
+        raise ValueError(f"Unknown export '{name}', expected one of: {', '.join(EXPORTS)}")
+    return EXPORTS[name]
+
+def export_columns(name, include_private=False):
+    spec = _export_spec(name)
+    private = set() if include_private else set(spec.get('private_columns', []))
+    return [c for c in spec['columns'] if c not in private]
+
+def export_query(name, start=None, end=None, blood_group=None, status=None, include_private=False):
+    """Filtered query over the export columns, streamed from a server-side cursor"""
+    spec = _export_spec(name)
+    model = spec['model']
+    query = db.session.query(*[getattr(model, c) for c in export_columns(name, include_private)])
+
+    date_column = getattr(model, spec['date_column'])
+    if start:
+        query = query.filter(date_column >= start)
+    if end:
+        query = query.filter(date_column < end)
+    if blood_group:
+        query = query.filter(model.blood_group == blood_group)
+    if status:
+        query = query.filter(getattr(model, spec['status_column']) == status)
+
+    return query.order_by(model.id).execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+
+def iter_chunks(name, **filters):
+    """Lists of up to EXPORT_CHUNK_SIZE row tuples"""
+    chunk = []
+    for row in export_query(name, **filters):
+        chunk.append(tuple(row))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return '' if value is None else value
+
+def stream_csv(name, **filters):
+    """CSV text, one piece for the header and one per chunk of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(name, filters.get('include_private', False)))
+    yield buffer.getvalue()
+
+    for chunk in iter_chunks(name, **filters):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(v) for v in row] for row in chunk)
+        yield buffer.getvalue()
+
+def _arrow_schema(name, include_private):
+    model = _export_spec(name)['model']
+    fields = []
+    for column_name in export_columns(name, include_private):
+        column_type = getattr(model, column_name).type
+        if isinstance(column_type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column_type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column_type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column_type, DateTime):
+            arrow_type = pa.timestamp('us')
+        elif isinstance(column_type, Date):
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column_name, arrow_type))
+    return pa.schema(fields)
+
+def write_parquet(name, path, **filters):
+    """Write an export to a Parquet file, one row group per chunk; returns the row count"""
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = _arrow_schema(name, filters.get('include_private', False))
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_chunks(name, **filters):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            rows += len(chunk)
+    return rows
+
+def write_csv(name, path, **filters):
+    """Write an export to a CSV file; returns the row count"""
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(export_columns(name, filters.get('include_private', False)))
+        for chunk in iter_chunks(name, **filters):
+            writer.writerows([_csv_value(v) for v in row] for row in chunk)
+            rows += len(chunk)
+    return rows
+
+def parse_export_filters(args):
+    """Filters from request/CLI style arguments; raises ValueError on bad dates"""
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+    return {
+        'start': parse_date(args.get('from')),
+        'end': parse_date(args.get('to')),
+        'blood_group': args.get('blood_group') or None,
+        'status': args.get('status') or None
+    }
+
+def main():
+    import argparse
+    import time
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Export ClotSync data')
+    parser.add_argument('dataset', choices=list(EXPORTS))
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--out', help='Output file (default: <dataset>.<format>)')
+    parser.add_argument('--from', dest='from_date', help='Start date (inclusive), YYYY-MM-DD')
+    parser.add_argument('--to', dest='to_date', help='End date (exclusive), YYYY-MM-DD')
+    parser.add_argument('--blood-group')
+    parser.add_argument('--status')
+    args = parser.parse_args()
+
+    filters = parse_export_filters({
+        'from': args.from_date,
+        'to': args.to_date,
+        'blood_group': args.blood_group,
+        'status': args.status
+    })
+    # Whoever runs the CLI already has database access, so it exports every column
+    filters['include_private'] = True
+    out = args.out or f"{args.dataset}.{args.format}"
+
+    started = time.time()
+    with app.app_context():
+        if args.format == 'parquet':
+            rows = write_parquet(args.dataset, out, **filters)
+        else:
+            rows = write_csv(args.dataset, out, **filters)
+    print(f"Exported {rows} {args.dataset} rows to {out} in {time.time() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+-- Fix transfers table so request fulfilment can record issues to patients
+-- Fulfilled requests are logged as transfers with no destination hospital,
+-- and blood groups are stored by full name (e.g. "O Positive")
+
+-- Allow transfers without a destination hospital
+ALTER TABLE transfers MODIFY COLUMN to_hospital_id INT NULL;
+
+-- Match the blood_group size used by the other tables
+ALTER TABLE transfers MODIFY COLUMN blood_group VARCHAR(25) NOT NULL;
+
+-- Verify the changes
+DESCRIBE transfers;
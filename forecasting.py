@@ -0,0 +1,174 @@
+"""
+Blood shortage forecasting for ClotSync
+Projects days-until-stockout for every (hospital, blood group) from request
+inflow, confirmed donations and current stock. Daily inflow and donations come
+from the daily_rollups rows for complete days, and from the raw request and
+acceptance tables only for the days not rolled up yet (normally just today).
+All series are fitted together as numpy matrices in one pass; results are
+stored in shortage_forecasts so /predict_shortage is a table lookup.
+"""
+
+import json
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+
+from extensions import db
+from models import Hospital, BloodRequest, DonorAcceptance, DailyRollup, ShortageForecast
+from daily_rollups import NO_HOSPITAL, rolled_up_until
+
+FORECAST_WINDOW_DAYS = 56      # history used for the fit
+SMOOTHING_HALF_LIFE_DAYS = 7   # recent days weigh more in the level estimate
+SHORTAGE_HORIZON_DAYS = 14     # stockouts further out than this are reported as adequate
+
+def _daily_frame(rows):
+    frame = pd.DataFrame(rows, columns=['hospital_id', 'blood_group', 'day', 'units'])
+    frame['day'] = pd.to_datetime(frame['day'])
+    frame['units'] = pd.to_numeric(frame['units']).fillna(0)
+    return frame
+
+def _rolled_up_inputs(start, until):
+    """Daily demand and supply rows from the rollups for the days start..until"""
+    rows = (
+        db.session.query(
+            DailyRollup.hospital_id, DailyRollup.blood_group, DailyRollup.day,
+            func.sum(DailyRollup.units_requested), func.sum(DailyRollup.units_donated)
+        )
+        .filter(DailyRollup.hospital_id != NO_HOSPITAL, DailyRollup.day >= start.date(), DailyRollup.day <= until)
+        .group_by(DailyRollup.hospital_id, DailyRollup.blood_group, DailyRollup.day)
+        .all()
+    )
+    demand = [(h, g, day, requested) for h, g, day, requested, _ in rows if requested]
+    supply = [(h, g, day, donated) for h, g, day, _, donated in rows if donated]
+    return demand, supply
+
+def _raw_inputs(start):
+    """Daily demand and supply rows from the request and acceptance tables since `start`"""
+    demand = (
+        db.session.query(
+            BloodRequest.hospital_id, BloodRequest.blood_group,
+            func.date(BloodRequest.created_at), func.sum(BloodRequest.units_needed)
+        )
+        .filter(BloodRequest.hospital_id.isnot(None), BloodRequest.created_at >= start)
+        .group_by(BloodRequest.hospital_id, BloodRequest.blood_group, func.date(BloodRequest.created_at))
+        .all()
+    )
+    supply = (
+        db.session.query(
+            BloodRequest.hospital_id, BloodRequest.blood_group,
+            func.date(DonorAcceptance.completed_at), func.sum(DonorAcceptance.units_donated)
+        )
+        .join(BloodRequest, DonorAcceptance.request_id == BloodRequest.id)
+        .filter(
+            BloodRequest.hospital_id.isnot(None),
+            DonorAcceptance.status == 'completed',
+            DonorAcceptance.completed_at >= start
+        )
+        .group_by(BloodRequest.hospital_id, BloodRequest.blood_group, func.date(DonorAcceptance.completed_at))
+        .all()
+    )
+    return demand, supply
+
+def _load_inputs(start):
+    """Daily demand and supply per (hospital, group) since `start`, plus current stock"""
+    demand, supply = [], []
+    until = rolled_up_until()
+    raw_start = start
+    if until and until >= start.date():
+        demand, supply = _rolled_up_inputs(start, until)
+        raw_start = datetime.combine(until + timedelta(days=1), datetime.min.time())
+    raw_demand, raw_supply = _raw_inputs(raw_start)
+    demand = _daily_frame(demand + list(raw_demand))
+    supply = _daily_frame(supply + list(raw_supply))
+
+    stock = {}
+    for hospital_id, inventory in db.session.query(Hospital.id, Hospital.inventory).all():
+        for blood_group, units in json.loads(inventory or '{}').items():
+            stock[(hospital_id, blood_group)] = float(units or 0)
+    return demand, supply, stock
+
+def _to_matrix(frame, keys, start, days):
+    """Scatter daily totals into a (series x day) matrix"""
+    matrix = np.zeros((len(keys), days))
+    if frame.empty:
+        return matrix
+    rows = [keys[k] for k in zip(frame['hospital_id'], frame['blood_group'])]
+    cols = ((frame['day'] - pd.Timestamp(start)).dt.days).clip(0, days - 1).to_numpy()
+    np.add.at(matrix, (np.asarray(rows), cols), frame['units'].to_numpy())
+    return matrix
+
+def _project_rates(matrix, horizon):
+    """Vectorized fit over all series: exponentially weighted level plus linear trend.
+
+    Returns the expected average daily rate over the next `horizon` days.
+    """
+    days = matrix.shape[1]
+    t = np.arange(days, dtype=float)
+    weights = 0.5 ** ((days - 1 - t) / SMOOTHING_HALF_LIFE_DAYS)
+    level = matrix @ weights / weights.sum()
+
+    t_centered = t - t.mean()
+    slope = (matrix - matrix.mean(axis=1, keepdims=True)) @ t_centered / (t_centered ** 2).sum()
+    return np.clip(level + slope * horizon / 2, 0, None)
+
+def compute_forecasts(now=None):
+    """Days-until-stockout for every (hospital, group) that has stock or recent activity"""
+    now = now or datetime.utcnow()
+    start = (now - timedelta(days=FORECAST_WINDOW_DAYS - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    demand, supply, stock = _load_inputs(start)
+
+    series = sorted(
+        set(stock)
+        | set(zip(demand['hospital_id'], demand['blood_group']))
+        | set(zip(supply['hospital_id'], supply['blood_group']))
+    )
+    if not series:
+        return []
+    keys = {key: i for i, key in enumerate(series)}
+
+    demand_rate = _project_rates(_to_matrix(demand, keys, start, FORECAST_WINDOW_DAYS), SHORTAGE_HORIZON_DAYS)
+    supply_rate = _project_rates(_to_matrix(supply, keys, start, FORECAST_WINDOW_DAYS), SHORTAGE_HORIZON_DAYS)
+    stock_units = np.array([stock.get(key, 0.0) for key in series])
+
+    net_burn = demand_rate - supply_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_left = np.where(net_burn > 0, np.clip(stock_units, 0, None) / net_burn, np.inf)
+
+    return [
+        {
+            'hospital_id': hospital_id,
+            'blood_group': blood_group,
+            'stock_units': int(stock_units[i]),
+            'daily_demand': round(float(demand_rate[i]), 3),
+            'daily_supply': round(float(supply_rate[i]), 3),
+            'days_until_stockout': None if np.isinf(days_left[i]) else round(float(days_left[i]), 1),
+            'computed_at': now
+        }
+        for i, (hospital_id, blood_group) in enumerate(series)
+    ]
+
+def refresh_forecasts():
+    """Recompute all forecasts and replace the stored results in one transaction"""
+    forecasts = compute_forecasts()
+    ShortageForecast.query.delete()
+    db.session.bulk_insert_mappings(ShortageForecast, forecasts)
+    db.session.commit()
+    print(f"Stored {len(forecasts)} shortage forecasts")
+    return len(forecasts)
+
+def describe_days_left(days_until_stockout):
+    """Dashboard wording for a forecast ("shortage in N days" / "adequate")"""
+    if days_until_stockout is None or days_until_stockout > SHORTAGE_HORIZON_DAYS:
+        return "adequate"
+    if days_until_stockout < 1:
+        return "shortage today"
+    days = math.floor(days_until_stockout)
+    return f"shortage in {days} day{'s' if days != 1 else ''}"
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        refresh_forecasts()
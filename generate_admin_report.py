@@ -1,18 +1,210 @@
+"""
+Static admin report generator for ClotSync
+Writes one HTML + JSON report for the whole network, one per donor district
+(donor location) and, when reading the database, one per hospital (donors who
+accepted that hospital's requests). The donor dataset is loaded once, placed in
+shared memory, and the reports are built in parallel by a process pool. Each
+section's inputs are hashed into manifest.json, so sections whose inputs have not
+changed since the last run are reused, and unchanged reports are not rewritten.
+
+Usage: python generate_admin_report.py [--csv FILE] [--out DIR] [--workers N] [--force]
+"""
+
+import argparse
+import hashlib
+import html
 import json
-from reports import generate_ai_report
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from reports import REPORT_SECTIONS, aggregate_donors, read_donor_csv, read_donor_db, render_section, section_inputs
+
+MANIFEST_FILE = 'manifest.json'
+CATEGORICAL_COLUMNS = ['blood_group', 'location', 'eligibility_status']
+
+# Worker-side state, attached once per process by _attach_dataset
+_dataset = None
+_segments = []
+_template = None
+
+def _share_array(array, segments):
+    """Copy an array into a new shared memory block; returns what a worker needs to attach it"""
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+    segments.append(segment)
+    return (segment.name, array.dtype.str, array.shape)
+
+def share_dataset(frame):
+    """Place the report columns of a donor frame in shared memory"""
+    segments = []
+    spec = {'categories': {}, 'arrays': {}}
+    for column in CATEGORICAL_COLUMNS:
+        values = frame[column].astype('category')
+        spec['categories'][column] = [str(c) for c in values.cat.categories]
+        spec['arrays'][column] = _share_array(values.cat.codes.to_numpy(), segments)
+    spec['arrays']['donation_count'] = _share_array(frame['donation_count'].to_numpy(dtype='int32'), segments)
+    spec['arrays']['last_donated'] = _share_array(
+        frame['last_donated'].to_numpy(dtype='datetime64[ns]').view('int64'), segments
+    )
+    return spec, segments
+
+def _attach_dataset(spec, template_dir):
+    """Pool initializer: rebuild the donor frame on top of the shared buffers"""
+    global _dataset, _template
+    arrays = {}
+    for column, (name, dtype, shape) in spec['arrays'].items():
+        segment = shared_memory.SharedMemory(name=name)
+        _segments.append(segment)
+        arrays[column] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+    columns = {
+        column: pd.Categorical.from_codes(arrays[column], categories=spec['categories'][column])
+        for column in CATEGORICAL_COLUMNS
+    }
+    columns['donation_count'] = arrays['donation_count']
+    columns['last_donated'] = arrays['last_donated'].view('datetime64[ns]')
+    _dataset = pd.DataFrame(columns, copy=False)
+
+    env = Environment(loader=FileSystemLoader(template_dir), autoescape=select_autoescape(['html']))
+    _template = env.get_template('report.html')
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def build_scope_report(slug, title, rows, previous_hashes, out_dir, today, force):
+    """Worker task: statistics for one scope, re-rendering only sections whose inputs changed"""
+    stats = aggregate_donors([_dataset.iloc[rows]], today=today)
+
+    json_path = os.path.join(out_dir, f"{slug}.json")
+    previous_report = {}
+    if not force and os.path.exists(json_path):
+        with open(json_path, encoding='utf-8') as f:
+            previous_report = json.load(f).get('report', {})
+
+    report, hashes, rendered = {}, {}, 0
+    for key in REPORT_SECTIONS:
+        hashes[key] = _hash(section_inputs(key, stats))
+        if not force and previous_hashes.get(key) == hashes[key] and key in previous_report:
+            report[key] = previous_report[key]
+        else:
+            report[key] = render_section(key, stats)
+            rendered += 1
+
+    if rendered:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'scope': title, 'donors': stats['total_donors'], 'report': report}, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(out_dir, f"{slug}.html"), 'w', encoding='utf-8') as f:
+            f.write(_template.render(report=report, title=f"ClotSync Report - {title}"))
+    return slug, title, hashes, rendered
+
+def _slug(prefix, name):
+    return f"{prefix}-{re.sub(r'[^a-z0-9]+', '-', str(name).lower()).strip('-') or 'unknown'}"
+
+def hospital_scopes(user_ids):
+    """Donor row positions per hospital, from the donors who accepted its requests"""
+    from extensions import db
+    from models import Hospital, BloodRequest, DonorAcceptance
+
+    position = pd.Series(np.arange(len(user_ids)), index=user_ids)
+    rows = (
+        db.session.query(Hospital.id, Hospital.name, DonorAcceptance.donor_id)
+        .join(BloodRequest, BloodRequest.hospital_id == Hospital.id)
+        .join(DonorAcceptance, DonorAcceptance.request_id == BloodRequest.id)
+        .distinct()
+        .all()
+    )
+    links = pd.DataFrame(rows, columns=['hospital_id', 'name', 'donor_id'])
+    links = links[links['donor_id'].isin(position.index)]
+
+    scopes = []
+    for (hospital_id, name), group in links.groupby(['hospital_id', 'name']):
+        scopes.append((f"hospital-{hospital_id}", name, position[group['donor_id']].to_numpy()))
+    return scopes
+
+def write_index(out_dir, scopes):
+    links = '\n'.join(
+        f'<li><a href="{slug}.html">{html.escape(title)}</a> (<a href="{slug}.json">json</a>)</li>' for slug, title in scopes
+    )
+    with open(os.path.join(out_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(
+            '<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="UTF-8"><title>ClotSync Reports</title></head>\n'
+            f'<body>\n<h1>ClotSync Reports</h1>\n<p>Generated {datetime.now().strftime("%d %b %Y, %H:%M")}</p>\n'
+            f'<ul>\n{links}\n</ul>\n</body>\n</html>\n'
+        )
+
+def generate_reports(frame, out_dir, workers=None, force=False, hospitals=None):
+    """Build every scope report in parallel; returns (reports written, sections rendered)"""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    scopes = [('network', 'All districts', np.arange(len(frame)))]
+    for location, rows in frame.groupby('location', observed=True).indices.items():
+        scopes.append((_slug('district', location), str(location), rows))
+    scopes.extend(hospitals or [])
+
+    spec, segments = share_dataset(frame)
+    today = datetime.now().date()
+    template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    written = rendered = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_dataset,
+                                 initargs=(spec, template_dir)) as pool:
+            futures = [
+                pool.submit(build_scope_report, slug, title, rows, manifest.get(slug, {}), out_dir, today, force)
+                for slug, title, rows in scopes
+            ]
+            manifest = {}
+            for future in futures:
+                slug, title, hashes, sections = future.result()
+                manifest[slug] = hashes
+                written += 1 if sections else 0
+                rendered += sections
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
 
-# Read the HTML template
-with open("templates/report.html", "r", encoding="utf-8") as f:
-    html = f.read()
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    write_index(out_dir, [(slug, title) for slug, title, _ in scopes])
+    return written, rendered, len(scopes)
 
-# Generate the report
-report = generate_ai_report("donors_data.csv")
+def main():
+    parser = argparse.ArgumentParser(description='Generate static ClotSync admin reports')
+    parser.add_argument('--csv', help='Donor CSV export (default: read the database)')
+    parser.add_argument('--out', default='admin_reports', help='Output directory')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='Re-render every section')
+    args = parser.parse_args()
 
-# Inject the JSON into the template
-html_out = html.replace("__REPORT_JSON__", json.dumps(report, ensure_ascii=False))
+    started = time.time()
+    if args.csv:
+        frame = pd.concat(read_donor_csv(args.csv), ignore_index=True)
+        hospitals = []
+    else:
+        from app import app
+        from extensions import db
+        with app.app_context():
+            frame = pd.concat(read_donor_db(), ignore_index=True)
+            hospitals = hospital_scopes(frame['user_id'].to_numpy())
+            # Workers never touch the database; don't hand them pooled connections
+            db.engine.dispose()
 
-# Write the output file
-with open("admin_report.html", "w", encoding="utf-8") as f:
-    f.write(html_out)
+    written, rendered, total = generate_reports(frame, args.out, workers=args.workers, force=args.force, hospitals=hospitals)
+    print(f"{total} reports ({len(frame)} donors): {written} updated, {rendered} sections rendered, "
+          f"{total - written} unchanged, in {time.time() - started:.1f}s -> {args.out}/index.html")
 
-print("admin_report.html generated. Open it in your browser.")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Shared CSV import pipeline for ClotSync
+Building blocks used by the donor and hospital importers: the file is read in
+chunks, each chunk is validated column by column (rejected rows go to an error
+report CSV), written in one transaction together with a checkpoint keyed by the
+file's SHA-256, so rerunning an interrupted import resumes after the last
+committed chunk. Passwords are hashed in parallel by an executor.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from werkzeug.security import generate_password_hash
+
+from extensions import db
+from models import ImportCheckpoint, PASSWORD_RESET_REQUIRED
+
+CHUNK_SIZE = 5000
+HASH_BATCH_SIZE = 50  # passwords sent to a worker at a time
+
+_coordinate_cache = {}  # normalized location text -> geocode_location() result
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, start_row=0):
+    """CSV chunks as strings, skipping the first `start_row` data rows"""
+    return pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=True,
+                       skiprows=range(1, start_row + 1))
+
+def clean_column(chunk, name):
+    """Stripped string column with empty values as NaN (all NaN if the CSV lacks it)"""
+    if name not in chunk.columns:
+        return pd.Series(np.nan, index=chunk.index, dtype=object)
+    values = chunk[name].str.strip()
+    return values.mask(values == '')
+
+def parse_dates(values):
+    """ISO dates first, then whatever day-first format pandas infers for the rest"""
+    parsed = pd.to_datetime(values, format='ISO8601', errors='coerce')
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], dayfirst=True, errors='coerce')
+    return parsed
+
+class RowErrors:
+    """Per-row validation messages for one chunk"""
+
+    def __init__(self, chunk):
+        self.messages = pd.Series('', index=chunk.index, dtype=object)
+
+    def check(self, mask, message):
+        self.messages = self.messages + np.where(mask, f"{message}; ", '')
+
+    @property
+    def invalid(self):
+        return self.messages != ''
+
+    def rejected(self, chunk, rows):
+        """Rejected CSV rows with their row numbers and errors (never their passwords)"""
+        invalid = self.invalid
+        rejected = chunk.loc[invalid, [c for c in chunk.columns if not c.startswith('password')]].copy()
+        rejected.insert(0, 'row', rows[invalid])
+        rejected.insert(1, 'errors', self.messages[invalid].str.rstrip('; '))
+        return rejected
+
+def check_coordinates(chunk, errors):
+    """Numeric latitude/longitude columns, flagging unparseable or out-of-range values"""
+    coordinates = {}
+    for field, limit in (('latitude', 90), ('longitude', 180)):
+        raw = clean_column(chunk, field)
+        coordinates[field] = pd.to_numeric(raw, errors='coerce')
+        errors.check(raw.notna() & coordinates[field].isna(), f"{field} is not a number")
+        errors.check(coordinates[field].abs() > limit, f"{field} is out of range")
+    return coordinates['latitude'], coordinates['longitude']
+
+def check_counts(chunk, field, errors):
+    """Whole non-negative numbers (0 where empty or invalid)"""
+    raw = clean_column(chunk, field)
+    values = pd.to_numeric(raw, errors='coerce')
+    valid = (values >= 0) & (values % 1 == 0)
+    errors.check(raw.notna() & ~valid, f"{field} is not a whole number")
+    return values.where(valid, 0).astype(int)
+
+def default_error_report(path):
+    return f"{os.path.splitext(path)[0]}.errors.csv"
+
+def append_error_report(rejected, path, append):
+    rejected.to_csv(path, mode='a' if append else 'w', header=not append, index=False)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_checkpoint(path, restart=False, file_name=None):
+    """Checkpoint for this file's contents, created on first import (restart=True starts it over)"""
+    file_hash = file_sha256(path)
+    checkpoint = ImportCheckpoint.query.get(file_hash)
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(file_hash=file_hash, file_name=file_name or os.path.basename(path), rows_committed=0)
+        db.session.add(checkpoint)
+    elif restart:
+        checkpoint.rows_committed = 0
+        checkpoint.completed_at = None
+    db.session.commit()
+    return checkpoint
+
+def _hash_password(password):
+    return generate_password_hash(password)
+
+def hash_passwords(mappings, pool):
+    """Replace plain passwords with hashes in place, computed in parallel (row order is kept)
+    Rows without a password get the must-reset marker instead of a hash."""
+    pending = [m for m in mappings if m['password']]
+    for mapping in mappings:
+        if not mapping['password']:
+            mapping['password'] = PASSWORD_RESET_REQUIRED
+    hashes = pool.map(_hash_password, [m['password'] for m in pending], chunksize=HASH_BATCH_SIZE)
+    for mapping, hashed in zip(pending, hashes):
+        mapping['password'] = hashed
+
+def geocode_cached(location):
+    """Coordinates for a location string, looked up once per distinct location"""
+    key = ' '.join(str(location).lower().split())
+    if key not in _coordinate_cache:
+        from routes import geocode_location
+        _coordinate_cache[key] = geocode_location(location)
+    return _coordinate_cache[key]
+
+def to_records(frame):
+    """Row dicts with missing values as None, ready for bulk_insert_mappings"""
+    frame = frame.astype(object)
+    return frame.where(frame.notna(), None).to_dict('records')
@@ -0,0 +1,147 @@
+"""
+Inventory concurrency helpers for ClotSync
+Hospital inventory is one JSON document per hospital, guarded by the `version`
+column. Routes that write inventory are wrapped in retry_on_inventory_conflict,
+which re-runs the whole request transaction when a compare-and-swap is lost.
+
+The JSON document is the cached per-group total of the hospital's unexpired
+blood_lots rows; expire_blood_lots() removes lots past their expiry date from it.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import jsonify
+from sqlalchemy.orm.exc import StaleDataError
+
+from extensions import db
+
+MAX_INVENTORY_ATTEMPTS = 3
+
+_stats_lock = threading.Lock()
+_contention_stats = {
+    'transactions': 0,  # inventory transactions started
+    'conflicts': 0,     # compare-and-swap writes that lost to a concurrent writer
+    'retries': 0,       # transactions re-run after a conflict
+    'exhausted': 0      # transactions that gave up after MAX_INVENTORY_ATTEMPTS
+}
+
+def _bump(counter):
+    with _stats_lock:
+        _contention_stats[counter] += 1
+
+def get_contention_stats():
+    """Snapshot of the inventory conflict/retry counters for this process"""
+    with _stats_lock:
+        return dict(_contention_stats)
+
+def retry_on_inventory_conflict(view):
+    """Re-run a view when its inventory write loses the version compare-and-swap.
+
+    The view must do all of its writes in the request transaction and commit at
+    the end, so a rollback leaves nothing behind and the next attempt re-reads
+    the hospital rows (and their new versions) from scratch.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        _bump('transactions')
+        for attempt in range(1, MAX_INVENTORY_ATTEMPTS + 1):
+            try:
+                return view(*args, **kwargs)
+            except StaleDataError as e:
+                db.session.rollback()
+                _bump('conflicts')
+                if attempt == MAX_INVENTORY_ATTEMPTS:
+                    _bump('exhausted')
+                    print(f"Inventory write gave up after {attempt} attempts: {e}")
+                    return jsonify({'error': 'Inventory was modified concurrently, please retry'}), 409
+                _bump('retries')
+                # Short jittered backoff so competing writers do not collide again immediately
+                time.sleep(random.uniform(0, 0.01 * attempt))
+    return wrapper
+
+def lock_stock_snapshot(hospital, blood_groups):
+    """Lock a hospital row and its unexpired lots for the given groups in two queries.
+    
+    Returns {blood_group: [lots ordered by expiry]}; batch endpoints validate
+    and allocate against this snapshot instead of querying per item.
+    """
+    from models import Hospital, BloodLot
+    
+    db.session.query(Hospital).filter_by(id=hospital.id).with_for_update().one()
+    db.session.refresh(hospital)
+    
+    snapshot = {blood_group: [] for blood_group in blood_groups}
+    if not snapshot:
+        return snapshot
+    lots = (
+        BloodLot.query
+        .filter(
+            BloodLot.hospital_id == hospital.id,
+            BloodLot.blood_group.in_(list(snapshot)),
+            BloodLot.expires_at > datetime.utcnow(),
+            BloodLot.units > 0
+        )
+        .order_by(BloodLot.blood_group, BloodLot.expires_at.asc())
+        .with_for_update()
+        .all()
+    )
+    for lot in lots:
+        snapshot[lot.blood_group].append(lot)
+    return snapshot
+
+def expire_blood_lots(now=None):
+    """Write off lots past their expiry date and subtract them from the cached totals.
+    
+    Each hospital is committed separately so one contended hospital does not hold
+    back the rest; conflicts are retried like inventory routes are.
+    """
+    from models import Hospital, BloodLot
+    
+    now = now or datetime.utcnow()
+    hospital_ids = [
+        row[0] for row in
+        db.session.query(BloodLot.hospital_id)
+        .filter(BloodLot.expires_at <= now, BloodLot.units > 0)
+        .distinct()
+        .all()
+    ]
+    
+    expired_units = 0
+    for hospital_id in hospital_ids:
+        for attempt in range(1, MAX_INVENTORY_ATTEMPTS + 1):
+            try:
+                hospital = Hospital.query.get(hospital_id)
+                lots = (
+                    BloodLot.query
+                    .filter(BloodLot.hospital_id == hospital_id, BloodLot.expires_at <= now, BloodLot.units > 0)
+                    .with_for_update()
+                    .all()
+                )
+                hospital_expired = 0
+                for lot in lots:
+                    hospital._adjust_inventory_total(lot.blood_group, -lot.units, 'expired')
+                    hospital_expired += lot.units
+                    lot.units = 0
+                db.session.commit()
+                expired_units += hospital_expired
+                break
+            except StaleDataError:
+                db.session.rollback()
+                _bump('conflicts')
+                if attempt == MAX_INVENTORY_ATTEMPTS:
+                    _bump('exhausted')
+                    print(f"Expiry sweep skipped hospital {hospital_id} after {attempt} conflicting attempts")
+                else:
+                    _bump('retries')
+    
+    print(f"Expired {expired_units} units across {len(hospital_ids)} hospitals")
+    return expired_units
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        expire_blood_lots()
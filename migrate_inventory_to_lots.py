@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Migration Script to Create the Blood Lot Ledger
+Creates the blood_lots table and backfills one lot per (hospital, blood group)
+from the existing inventory totals, so FEFO allocation has stock to draw from
+"""
+
+from datetime import datetime, timedelta
+from app import app, db
+from models import Hospital, BloodLot, BLOOD_SHELF_LIFE_DAYS
+
+def run_migration():
+    with app.app_context():
+        print("Starting blood lot migration...")
+        
+        try:
+            # Creates blood_lots (and its FEFO index) if missing; existing tables are untouched
+            db.create_all()
+            
+            now = datetime.utcnow()
+            created_lots = 0
+            for hospital in Hospital.query.all():
+                if BloodLot.query.filter_by(hospital_id=hospital.id).first():
+                    print(f"Hospital {hospital.name} already has lots, skipping...")
+                    continue
+                
+                inventory = hospital.get_inventory()
+                for blood_group, units in inventory.items():
+                    units = int(units or 0)
+                    if units <= 0:
+                        # Negative/zero totals cannot be backed by lots
+                        inventory[blood_group] = 0
+                        continue
+                    # Collection dates of legacy stock are unknown; assume it was collected today
+                    db.session.add(BloodLot(
+                        hospital_id=hospital.id,
+                        blood_group=blood_group,
+                        units=units,
+                        collected_at=now,
+                        expires_at=now + timedelta(days=BLOOD_SHELF_LIFE_DAYS)
+                    ))
+                    created_lots += 1
+                hospital.set_inventory(inventory)
+            
+            db.session.commit()
+            print(f"Migration completed successfully! Created {created_lots} lots.")
+            
+        except Exception as e:
+            print(f"Migration failed: {e}")
+            db.session.rollback()
+            raise
+
+if __name__ == '__main__':
+    run_migration()
@@ -1,9 +1,25 @@
 from extensions import db
 from flask_login import UserMixin
-from datetime import datetime
-from sqlalchemy import func
+from datetime import datetime, timedelta, date
+from sqlalchemy import func, or_, case
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import validates
+from stock_search import invalidate_stock_cache
 import json
 
+BLOOD_SHELF_LIFE_DAYS = 42  # Red cell units stored in SAGM/CPDA expire after 35-42 days
+BLOOD_GROUPS = [
+    'A Negative', 'A Positive', 'B Positive', 'A1 Positive', 'A1B Positive', 'A2 Negative', 'A2B Negative',
+    'A2B Positive', 'AB Positive', 'B Negative', 'Bombay Blood Group', 'O Negative', 'O Positive'
+]
+DONATION_GAP_DAYS = 120  # Minimum days between donations for male and other donors
+FEMALE_DONATION_GAP_DAYS = 90
+
+def donation_gap_days(gender):
+    """Minimum days between donations (female donors 3 months, everyone else 4)"""
+    return FEMALE_DONATION_GAP_DAYS if gender and gender.lower() == 'female' else DONATION_GAP_DAYS
+PASSWORD_RESET_REQUIRED = '!reset'  # Stored instead of a hash for imported donors without a password
+
 class Hospital(UserMixin, db.Model):
     __tablename__ = 'hospitals'
     
@@ -15,20 +31,102 @@ class Hospital(UserMixin, db.Model):
     username = db.Column(db.String(50), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     inventory = db.Column(db.Text, default='{}')  # JSON string
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Optimistic-concurrency counter for inventory writes
+    is_admin = db.Column(db.Boolean, nullable=False, default=False)  # Network admin (reports, exports, bulk imports); set in the database
+    
+    # Every UPDATE is issued as "... WHERE id = :id AND version = :version" and bumps the version.
+    # A lost compare-and-swap raises StaleDataError (retried by inventory.retry_on_inventory_conflict).
+    __mapper_args__ = {'version_id_col': version}
     
     def get_id(self):
         return f"hospital_{self.id}"  # Unique identifier across all user types
     
     def get_inventory(self):
+        """Per-group unit totals (cached aggregate of the unexpired blood_lots rows)"""
         return json.loads(self.inventory)
     
     def set_inventory(self, inventory_dict):
+        """Replace the inventory document (compare-and-swapped against `version` on flush)"""
         self.inventory = json.dumps(inventory_dict)
     
-    def update_blood_stock(self, blood_group, units):
+    def _adjust_inventory_total(self, blood_group, units, reason):
         inventory = self.get_inventory()
         inventory[blood_group] = inventory.get(blood_group, 0) + units
         self.set_inventory(inventory)
+        if units:
+            # Append-only history of every change, rolled up by stock_history.py
+            db.session.add(StockEvent(
+                hospital_id=self.id,
+                blood_group=blood_group,
+                delta=units,
+                balance=inventory[blood_group],
+                reason=reason
+            ))
+            # add_blood_lot, allocate_blood_lots and the expiry sweep all come through here
+            invalidate_stock_cache(blood_group)
+    
+    def add_blood_lot(self, blood_group, units, collected_at=None, expires_at=None, reason='received'):
+        """Receive a lot of blood units and add it to the cached per-group total"""
+        collected_at = collected_at or datetime.utcnow()
+        lot = BloodLot(
+            hospital_id=self.id,
+            blood_group=blood_group,
+            units=units,
+            collected_at=collected_at,
+            expires_at=expires_at or collected_at + timedelta(days=BLOOD_SHELF_LIFE_DAYS)
+        )
+        db.session.add(lot)
+        self._adjust_inventory_total(blood_group, units, reason)
+        return lot
+    
+    def allocate_blood_lots(self, blood_group, units, reason='issued', lots=None):
+        """Take up to `units` from the earliest-expiring unexpired lots (FEFO).
+        
+        Returns a list of (lot, units_taken) pairs; callers compare the total
+        against what they asked for. Expired lots are never allocated. Batch
+        callers pass `lots` already locked and ordered by expiry to skip the query.
+        """
+        if lots is None:
+            lots = (
+                BloodLot.query
+                .filter(
+                    BloodLot.hospital_id == self.id,
+                    BloodLot.blood_group == blood_group,
+                    BloodLot.expires_at > datetime.utcnow(),
+                    BloodLot.units > 0
+                )
+                .order_by(BloodLot.expires_at.asc())
+                .with_for_update()
+                .all()
+            )
+        allocations = []
+        remaining = units
+        for lot in lots:
+            if remaining <= 0:
+                break
+            if lot.units <= 0:
+                continue
+            taken = min(lot.units, remaining)
+            lot.units -= taken
+            remaining -= taken
+            allocations.append((lot, taken))
+        self._adjust_inventory_total(blood_group, -(units - remaining), reason)
+        return allocations
+    
+    def update_blood_stock(self, blood_group, units, reason=None):
+        """Add a new lot (positive units) or remove units FEFO (negative units).
+        
+        Returns the number of units actually added or removed.
+        """
+        if units > 0:
+            self.add_blood_lot(blood_group, units, reason=reason or 'received')
+            return units
+        if units < 0:
+            allocations = self.allocate_blood_lots(blood_group, -units, reason=reason or 'issued')
+            return sum(taken for _, taken in allocations)
+        return 0
 
 class Donor(UserMixin, db.Model):
     __tablename__ = 'donors'
@@ -50,46 +148,47 @@ class Donor(UserMixin, db.Model):
     longitude = db.Column(db.Float, nullable=True)
     gender = db.Column(db.String(10), nullable=True)  # Male, Female, Other
     last_donated = db.Column(db.Date, nullable=True)
-    next_eligible = db.Column(db.Date, nullable=True)
+    next_eligible = db.Column(db.Date, nullable=True)  # Set from last_donated; NULL means never donated
     role = db.Column(db.String(20), default='volunteer')  # Emergency donor, bridge donor, volunteer, guest donor
-    eligibility_status = db.Column(db.String(20), default='eligible')  # eligible, not eligible
+    
+    __table_args__ = (
+        db.Index('uq_donors_contact', 'contact', unique=True),  # Key for import upserts
+        db.Index('idx_donors_eligibility', 'blood_group', 'availability', 'next_eligible'),  # Alert fan-out
+    )
     
     def get_id(self):
         return f"donor_{self.id}"  # Unique identifier across all user types
     
-    def calculate_eligibility_status(self):
-        """Calculate eligibility status based on gender and donation intervals"""
-        from datetime import date
-        
-        if not self.gender or not self.last_donated:
-            # If no gender or last donation date, default to eligible
-            self.eligibility_status = 'eligible'
-            return
-        
-        today = date.today()
-        
-        # Calculate required gap based on gender
-        if self.gender.lower() == 'male':
-            required_gap_days = 120  # 4 months for males
-        elif self.gender.lower() == 'female':
-            required_gap_days = 90   # 3 months for females
-        else:
-            # For 'Other' gender, use 4 months as default
-            required_gap_days = 120
-        
-        # Calculate days since last donation
-        days_since_last_donation = (today - self.last_donated).days
-        
-        # Update eligibility status
-        if days_since_last_donation >= required_gap_days:
-            self.eligibility_status = 'eligible'
-        else:
-            self.eligibility_status = 'not eligible'
-        
-        # Update next_eligible date if needed
-        if self.eligibility_status == 'not eligible':
-            from datetime import timedelta
-            self.next_eligible = self.last_donated + timedelta(days=required_gap_days)
+    @property
+    def password_reset_required(self):
+        return self.password == PASSWORD_RESET_REQUIRED
+    
+    @hybrid_property
+    def is_eligible(self):
+        """Eligible once next_eligible has passed, so it never goes stale"""
+        return self.next_eligible is None or self.next_eligible <= date.today()
+    
+    @is_eligible.expression
+    def is_eligible(cls):
+        return or_(cls.next_eligible.is_(None), cls.next_eligible <= func.current_date())
+    
+    @hybrid_property
+    def eligibility_status(self):
+        return 'eligible' if self.is_eligible else 'not eligible'
+    
+    @eligibility_status.expression
+    def eligibility_status(cls):
+        return case((cls.is_eligible, 'eligible'), else_='not eligible').label('eligibility_status')
+    
+    @validates('last_donated', 'gender')
+    def _track_next_eligible(self, key, value):
+        last_donated = value if key == 'last_donated' else self.last_donated
+        gender = value if key == 'gender' else self.gender
+        if last_donated:
+            self.next_eligible = last_donated + timedelta(days=donation_gap_days(gender))
+        elif key == 'last_donated':
+            self.next_eligible = None  # donation cleared, so nothing left to wait for
+        return value
 
 class Patient(UserMixin, db.Model):
     __tablename__ = 'patients'
@@ -132,10 +231,17 @@ class BloodRequest(db.Model):
     district = db.Column(db.String(100), nullable=True)
     state = db.Column(db.String(100), nullable=True)
     requested_date_text = db.Column(db.String(100), nullable=True)
-    created_at = db.Column(db.DateTime, default=func.now())  # Fixed: Use func.now() instead of datetime.utcnow
+    created_at = db.Column(db.DateTime, default=func.now(), index=True)  # Fixed: Use func.now() instead of datetime.utcnow
+    fulfilled_at = db.Column(db.DateTime, nullable=True, index=True)  # Set when status becomes 'fulfilled'
     
     patient = db.relationship('Patient', backref='requests')
     hospital = db.relationship('Hospital', backref='requests')
+    
+    @validates('status')
+    def _stamp_fulfilled(self, key, status):
+        if status == 'fulfilled' and self.fulfilled_at is None:
+            self.fulfilled_at = datetime.utcnow()
+        return status
 
 class DonorAcceptance(db.Model):
     __tablename__ = 'donor_acceptances'
@@ -143,22 +249,164 @@ class DonorAcceptance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     donor_id = db.Column(db.Integer, db.ForeignKey('donors.id'), nullable=False)
     request_id = db.Column(db.Integer, db.ForeignKey('requests.id'), nullable=False)
-    accepted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    accepted_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     status = db.Column(db.String(20), default='accepted')  # accepted, completed, cancelled
     note = db.Column(db.Text, nullable=True)
     units_donated = db.Column(db.Integer, nullable=True)  # How many units this donor actually donated
-    completed_at = db.Column(db.DateTime, nullable=True)  # When hospital marked as completed
+    completed_at = db.Column(db.DateTime, nullable=True, index=True)  # When hospital marked as completed
 
     donor = db.relationship('Donor', backref='acceptances')
     request = db.relationship('BloodRequest', backref='acceptances')
 
+class BloodLot(db.Model):
+    __tablename__ = 'blood_lots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    blood_group = db.Column(db.String(25), nullable=False)
+    units = db.Column(db.Integer, nullable=False)  # Units still in stock from this lot
+    collected_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    # FEFO allocation reads one (hospital, group) range ordered by expiry;
+    # cross-hospital stock search reads one (group) range of unexpired lots
+    __table_args__ = (
+        db.Index('idx_blood_lots_fefo', 'hospital_id', 'blood_group', 'expires_at'),
+        db.Index('idx_blood_lots_group_expiry', 'blood_group', 'expires_at', 'hospital_id', 'units'),
+    )
+    
+    hospital = db.relationship('Hospital', backref='lots')
+
+class StockEvent(db.Model):
+    __tablename__ = 'stock_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    blood_group = db.Column(db.String(25), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)  # Units added (+) or removed (-); 0 for snapshots
+    balance = db.Column(db.Integer, nullable=False)  # Group total after this event
+    reason = db.Column(db.String(20), nullable=False)  # received, issued, transfer_in, transfer_out, adjustment, expired, snapshot
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class StockRollup(db.Model):
+    __tablename__ = 'stock_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
+    blood_group = db.Column(db.String(25), nullable=False)
+    granularity = db.Column(db.String(5), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    opening_units = db.Column(db.Integer, nullable=False)
+    closing_units = db.Column(db.Integer, nullable=False)
+    min_units = db.Column(db.Integer, nullable=False)
+    max_units = db.Column(db.Integer, nullable=False)
+    units_in = db.Column(db.Integer, nullable=False, default=0)
+    units_out = db.Column(db.Integer, nullable=False, default=0)
+    events = db.Column(db.Integer, nullable=False, default=0)
+    
+    # "Group G at hospital H over the last N days" is one range read on this index
+    __table_args__ = (
+        db.UniqueConstraint('hospital_id', 'blood_group', 'granularity', 'bucket_start', name='uq_stock_rollups_bucket'),
+    )
+
+class Watermark(db.Model):
+    __tablename__ = 'watermarks'
+    
+    name = db.Column(db.String(50), primary_key=True)  # Which incremental job this watermark belongs to
+    last_id = db.Column(db.Integer, nullable=False, default=0)  # Highest source row id already processed
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DailyRollup(db.Model):
+    __tablename__ = 'daily_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    blood_group = db.Column(db.String(25), nullable=False)
+    district = db.Column(db.String(100), nullable=False)  # 'Unknown' when the source row has none
+    hospital_id = db.Column(db.Integer, nullable=False, default=0)  # 0 when the request has no hospital
+    requests_created = db.Column(db.Integer, nullable=False, default=0)
+    units_requested = db.Column(db.Integer, nullable=False, default=0)  # units_needed of the requests created
+    requests_fulfilled = db.Column(db.Integer, nullable=False, default=0)
+    units_donated = db.Column(db.Integer, nullable=False, default=0)
+    alerts_sent = db.Column(db.Integer, nullable=False, default=0)
+    acceptances = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('day', 'blood_group', 'district', 'hospital_id', name='uq_daily_rollups_day'),
+    )
+
+class ShortageForecast(db.Model):
+    __tablename__ = 'shortage_forecasts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False, index=True)
+    blood_group = db.Column(db.String(25), nullable=False)
+    stock_units = db.Column(db.Integer, nullable=False)
+    daily_demand = db.Column(db.Float, nullable=False)  # Projected units requested per day
+    daily_supply = db.Column(db.Float, nullable=False)  # Projected units donated per day
+    days_until_stockout = db.Column(db.Float, nullable=True)  # Null when stock is not being depleted
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+class CachedReport(db.Model):
+    __tablename__ = 'cached_reports'
+    
+    name = db.Column(db.String(50), primary_key=True)  # e.g. 'admin'
+    payload = db.Column(db.Text, nullable=False)  # JSON report sections
+    generated_at = db.Column(db.DateTime, nullable=False)
+    change_marker = db.Column(db.Integer, nullable=False, default=0)  # Source data position the report was built from
+
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+    
+    file_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the imported CSV
+    file_name = db.Column(db.String(255), nullable=False)
+    rows_committed = db.Column(db.Integer, nullable=False, default=0)  # CSV data rows already handled
+    completed_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ScheduledJob(db.Model):
+    __tablename__ = 'scheduled_jobs'
+    
+    name = db.Column(db.String(50), primary_key=True)  # Key in scheduler.JOBS
+    schedule = db.Column(db.String(100), nullable=False)  # Cron expression the next run was computed from
+    next_run_at = db.Column(db.DateTime, nullable=False)  # Local time
+    locked_by = db.Column(db.String(100), nullable=True)  # Worker running the job, if any
+    locked_until = db.Column(db.DateTime, nullable=True)  # Lease end; an expired lease can be taken over
+    last_run_at = db.Column(db.DateTime, nullable=True)
+
+class JobRun(db.Model):
+    __tablename__ = 'job_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(50), nullable=False)
+    worker = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, succeeded, failed
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_seconds = db.Column(db.Float, nullable=True)
+    error = db.Column(db.Text, nullable=True)  # Traceback of a failed run
+    
+    __table_args__ = (
+        db.Index('idx_job_runs_job_started', 'job_name', 'started_at'),
+    )
+
+class HospitalDistance(db.Model):
+    __tablename__ = 'hospital_distances'
+    
+    # One row per unordered pair, stored with from_hospital_id < to_hospital_id
+    from_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), primary_key=True)
+    to_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), primary_key=True)
+    straight_km = db.Column(db.Float, nullable=False)  # Great-circle distance
+    travel_minutes = db.Column(db.Float, nullable=True)  # Road travel estimate, when a routing source provides one
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class BloodTransfer(db.Model):
     __tablename__ = 'transfers'
     
     id = db.Column(db.Integer, primary_key=True)
     from_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
-    to_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=False)
-    blood_group = db.Column(db.String(3), nullable=False)
+    to_hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=True)  # Null when issued directly to a patient
+    blood_group = db.Column(db.String(25), nullable=False)
     units = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='pending')  # pending, completed, cancelled
@@ -175,7 +423,7 @@ class DonorAlert(db.Model):
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospitals.id'), nullable=True)  # For hospital requests
     message = db.Column(db.Text, nullable=False)
     is_read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     donor = db.relationship('Donor', backref='alerts')
     request = db.relationship('BloodRequest', backref='alerts')
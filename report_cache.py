@@ -0,0 +1,137 @@
+"""
+Cached admin report for ClotSync
+The admin report is generated by a background job and stored in cached_reports
+with its generation time. Page views are served from the cached copy
+(stale-while-revalidate): once the copy is older than REPORT_MAX_AGE_SECONDS or
+enough new donors/requests/acceptances have arrived, the stale copy is still
+returned while a single background thread regenerates it.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func
+
+from extensions import db
+from models import CachedReport, Donor, BloodRequest, DonorAcceptance
+
+ADMIN_REPORT = 'admin'
+REPORT_MAX_AGE_SECONDS = 3600
+REFRESH_CHANGE_THRESHOLD = 50  # new source rows that make the report stale early
+CHANGE_CHECK_SECONDS = 60
+
+_report_lock = threading.Lock()
+_cached = {}  # name -> {'report', 'generated_at', 'change_marker', 'checked_at', 'stale'}
+_refreshing = set()
+
+def _change_marker():
+    """Cheap position in the source data: highest donor, request and acceptance ids"""
+    return int(
+        (db.session.query(func.max(Donor.id)).scalar() or 0)
+        + (db.session.query(func.max(BloodRequest.id)).scalar() or 0)
+        + (db.session.query(func.max(DonorAcceptance.id)).scalar() or 0)
+    )
+
+def _remember(name, report, generated_at, change_marker):
+    entry = {
+        'report': report,
+        'generated_at': generated_at,
+        'change_marker': change_marker,
+        'checked_at': time.monotonic(),
+        'stale': False
+    }
+    with _report_lock:
+        _cached[name] = entry
+    return entry
+
+def refresh_admin_report():
+    """Regenerate the admin report and store it (used by the schedule and forced refreshes)"""
+    from reports import generate_ai_report_from_db
+
+    change_marker = _change_marker()
+    report = generate_ai_report_from_db()
+    generated_at = datetime.utcnow()
+
+    row = CachedReport.query.get(ADMIN_REPORT)
+    if not row:
+        row = CachedReport(name=ADMIN_REPORT)
+        db.session.add(row)
+    row.payload = json.dumps(report)
+    row.generated_at = generated_at
+    row.change_marker = change_marker
+    db.session.commit()
+
+    print(f"Admin report regenerated at {generated_at.isoformat()}")
+    return _remember(ADMIN_REPORT, report, generated_at, change_marker)
+
+def _refresh_in_background(app):
+    with _report_lock:
+        if ADMIN_REPORT in _refreshing:
+            return
+        _refreshing.add(ADMIN_REPORT)
+
+    def run():
+        try:
+            with app.app_context():
+                refresh_admin_report()
+        except Exception as e:
+            print(f"Background report refresh error: {e}")
+        finally:
+            with _report_lock:
+                _refreshing.discard(ADMIN_REPORT)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def _load_stored(newer_than=None):
+    """Stored copy from the database, if there is one newer than `newer_than`"""
+    row = CachedReport.query.get(ADMIN_REPORT)
+    if not row or (newer_than and row.generated_at <= newer_than):
+        return None
+    return _remember(ADMIN_REPORT, json.loads(row.payload), row.generated_at, row.change_marker)
+
+def _is_stale(entry):
+    if (datetime.utcnow() - entry['generated_at']).total_seconds() > REPORT_MAX_AGE_SECONDS:
+        return True
+    if entry['stale']:
+        return True
+    if time.monotonic() - entry['checked_at'] < CHANGE_CHECK_SECONDS:
+        return False
+
+    entry['checked_at'] = time.monotonic()
+    entry['stale'] = _change_marker() - entry['change_marker'] >= REFRESH_CHANGE_THRESHOLD
+    return entry['stale']
+
+def get_admin_report(force_refresh=False):
+    """Cached report plus generated_at/stale; regenerates synchronously only when forced or missing"""
+    entry = None
+    if not force_refresh:
+        with _report_lock:
+            entry = _cached.get(ADMIN_REPORT)
+        entry = entry or _load_stored()
+
+    if entry is None:
+        entry = refresh_admin_report()
+        stale = False
+    else:
+        stale = _is_stale(entry)
+        # Another worker process may already have stored a fresher copy
+        fresher = _load_stored(newer_than=entry['generated_at']) if stale else None
+        if fresher:
+            entry = fresher
+            stale = _is_stale(entry)
+        if stale:
+            _refresh_in_background(current_app._get_current_object())
+
+    return {
+        'report': entry['report'],
+        'generated_at': entry['generated_at'],
+        'stale': stale
+    }
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        refresh_admin_report()
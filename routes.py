@@ -1,16 +1,28 @@
-from flask import render_template, request, jsonify, redirect, url_for, flash, session, make_response
+from flask import render_template, request, jsonify, redirect, url_for, flash, session, make_response, Response, stream_with_context, send_file
 from flask_login import login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import app
 from extensions import db
-from models import Hospital, Donor, Patient, BloodRequest, BloodTransfer, DonorAlert, DonorAcceptance
+from models import Hospital, Donor, Patient, BloodRequest, BloodTransfer, DonorAlert, DonorAcceptance, ShortageForecast, BLOOD_GROUPS, PASSWORD_RESET_REQUIRED
+from inventory import retry_on_inventory_conflict, get_contention_stats, lock_stock_snapshot
+from distance_matrix import update_hospital_distances
+from stock_search import search_stock
 import smtplib
 from email.message import EmailMessage
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from datetime import datetime, timedelta, date
+import hashlib
 import json
 import time
 import traceback
 
+PASSWORD_RESET_MAX_AGE_SECONDS = 24 * 3600
+PASSWORD_RESET_ACCOUNTS = {'donor': Donor, 'hospital': Hospital}
+
+def current_user_is_admin():
+    """Admins are hospital accounts flagged is_admin in the database"""
+    return isinstance(current_user, Hospital) and bool(current_user.is_admin)
+
 # Hospital Routes
 @app.route('/api/hospitals')
 def list_hospitals():
@@ -44,17 +56,18 @@ def register_hospital():
             password=generate_password_hash(data['password'])
         )
         
+        # Store coordinates once so stock searches never geocode hospitals
+        coords = geocode_location(data['location'])
+        if coords:
+            hospital.latitude = coords['lat']
+            hospital.longitude = coords['lon']
+        
         # Initialize inventory with all blood groups
-        initial_inventory = {
-            'A Negative': 0, 'A Positive': 0, 'B Positive': 0,
-            'A1 Positive': 0, 'A1B Positive': 0, 'A2 Negative': 0,
-            'A2B Negative': 0, 'A2B Positive': 0, 'AB Positive': 0,
-            'B Negative': 0, 'Bombay Blood Group': 0, 'O Negative': 0, 'O Positive': 0
-        }
-        hospital.set_inventory(initial_inventory)
+        hospital.set_inventory({blood_group: 0 for blood_group in BLOOD_GROUPS})
         
         db.session.add(hospital)
         db.session.commit()
+        update_hospital_distances(hospital)
         
         return jsonify({'message': 'Hospital registered successfully'}), 201
     
@@ -66,6 +79,10 @@ def login_hospital():
         data = request.get_json()
         
         hospital = Hospital.query.filter_by(username=data['username']).first()
+        # Bulk-imported without a password: never matches, the hospital has to set one first
+        if hospital and hospital.password == PASSWORD_RESET_REQUIRED:
+            return jsonify({'error': 'Password reset required - ask an administrator for a reset link',
+                            'reset_required': True}), 403
         if hospital and check_password_hash(hospital.password, data['password']):
             login_user(hospital)
             return jsonify({'message': 'Login successful', 'redirect': '/hospital_dashboard'}), 200
@@ -76,6 +93,7 @@ def login_hospital():
 
 @app.route('/update_inventory', methods=['POST'])
 @login_required
+@retry_on_inventory_conflict
 def update_inventory():
     if not isinstance(current_user, Hospital):
         return jsonify({'error': 'Unauthorized'}), 403
@@ -84,7 +102,18 @@ def update_inventory():
     blood_group = data['blood_group']
     units = data['units']
     
-    current_user.update_blood_stock(blood_group, units)
+    try:
+        collected_at = datetime.fromisoformat(data['collected_at']) if data.get('collected_at') else None
+        expires_at = datetime.fromisoformat(data['expires_at']) if data.get('expires_at') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    
+    if units > 0:
+        # New stock arrives as a lot; expiry defaults to collection date + shelf life
+        current_user.add_blood_lot(blood_group, units, collected_at=collected_at, expires_at=expires_at)
+    else:
+        # Removals (discards, corrections) come out of the earliest-expiring lots first
+        current_user.update_blood_stock(blood_group, units, reason='adjustment')
     db.session.commit()
     
     return jsonify({
@@ -100,8 +129,174 @@ def get_inventory(hospital_id):
         'inventory': hospital.get_inventory()
     })
 
+@app.route('/api/stock/search')
+def stock_search():
+    """Nearest hospitals that can fulfil `units` of a blood group"""
+    blood_group = request.args.get('blood_group')
+    if not blood_group:
+        return jsonify({'error': 'blood_group is required'}), 400
+    
+    try:
+        units = int(request.args.get('units', 1))
+        lat = float(request.args['lat']) if request.args.get('lat') else None
+        lon = float(request.args['lon']) if request.args.get('lon') else None
+        radius_km = float(request.args['radius_km']) if request.args.get('radius_km') else None
+        limit = int(request.args.get('limit', 20))
+        from_hospital_id = int(request.args['from_hospital_id']) if request.args.get('from_hospital_id') else None
+    except ValueError:
+        return jsonify({'error': 'units, lat, lon, radius_km, limit and from_hospital_id must be numbers'}), 400
+    
+    result = search_stock(
+        blood_group,
+        units=units,
+        lat=lat,
+        lon=lon,
+        radius_km=radius_km,
+        include_partial=request.args.get('include_partial') == '1',
+        limit=limit,
+        from_hospital_id=from_hospital_id
+    )
+    return jsonify({
+        'blood_group': blood_group,
+        'units': units,
+        'hospitals': result['hospitals'],
+        'regions': result['regions']
+    })
+
+@app.route('/api/stock/history/<int:hospital_id>')
+def stock_level_history(hospital_id):
+    """Hourly/daily stock levels of one blood group at a hospital, read from rollups"""
+    from stock_history import stock_history
+    
+    blood_group = request.args.get('blood_group')
+    if not blood_group:
+        return jsonify({'error': 'blood_group is required'}), 400
+    
+    try:
+        days = int(request.args.get('days', 90))
+        series = stock_history(hospital_id, blood_group, days=days, granularity=request.args.get('granularity', 'day'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'hospital_id': hospital_id,
+        'blood_group': blood_group,
+        'history': series
+    })
+
+@app.route('/api/rollups/daily')
+def daily_rollup_totals():
+    """Requests, fulfilments, donations, alerts and acceptances per day/blood group/district/hospital"""
+    from daily_rollups import daily_totals
+    
+    try:
+        days = int(request.args.get('days', 30))
+        hospital_id = int(request.args['hospital_id']) if request.args.get('hospital_id') else None
+    except ValueError:
+        return jsonify({'error': 'days and hospital_id must be numbers'}), 400
+    
+    group_by = [dim for dim in request.args.get('group_by', 'day').split(',') if dim]
+    return jsonify({
+        'days': days,
+        'group_by': group_by,
+        'totals': daily_totals(
+            days=days,
+            blood_group=request.args.get('blood_group'),
+            district=request.args.get('district'),
+            group_by=group_by,
+            hospital_id=hospital_id
+        )
+    })
+
+@app.route('/api/export/<dataset>')
+@login_required
+def export_dataset(dataset):
+    """Stream donors, requests or transfers as CSV, or send them as Parquet with ?format=parquet
+    (filters: from, to, blood_group, status). Donor names, contact details and coordinates are
+    exported to admins only."""
+    import tempfile
+    from exports import EXPORTS, pa, stream_csv, write_parquet, parse_export_filters
+    
+    if not isinstance(current_user, Hospital):
+        return jsonify({'error': 'Unauthorized'}), 403
+    if dataset not in EXPORTS:
+        return jsonify({'error': f"Unknown export, expected one of: {', '.join(EXPORTS)}"}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'parquet'):
+        return jsonify({'error': 'format must be csv or parquet'}), 400
+    if export_format == 'parquet' and pa is None:
+        return jsonify({'error': 'Parquet export is not available on this server (pyarrow is not installed)'}), 501
+    
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'from and to must be dates (YYYY-MM-DD)'}), 400
+    filters['include_private'] = current_user_is_admin()
+    
+    if export_format == 'parquet':
+        # Parquet can't be streamed row by row; it is spooled to a temp file, one row group per chunk
+        spool = tempfile.TemporaryFile()
+        write_parquet(dataset, spool, **filters)
+        spool.seek(0)
+        return send_file(spool, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                         download_name=f'{dataset}.parquet')
+    
+    return Response(
+        stream_with_context(stream_csv(dataset, **filters)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={dataset}.csv'}
+    )
+
+MAX_REPORTED_REJECTS = 500  # rejected rows returned by the hospital import API
+
+@app.route('/api/hospitals/import', methods=['POST'])
+@login_required
+def import_hospitals_csv():
+    """Bulk-register hospitals with their opening stock from an uploaded CSV (form field 'file', admins only)
+    Re-uploading a file whose import was interrupted resumes it."""
+    import os
+    import tempfile
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+    from bulk_upload_hospitals import import_hospitals
+    
+    if not current_user_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'A CSV file is required (form field "file")'}), 400
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'hospitals.csv')
+        upload.save(csv_path)
+        error_report = os.path.join(workdir, 'errors.csv')
+        try:
+            # PBKDF2 releases the GIL, so threads hash in parallel without forking the web worker
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                summary = import_hospitals(csv_path, pool, error_report=error_report, file_name=upload.filename[:255])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if summary['already_imported']:
+            return jsonify({'error': 'This file was already imported', 'summary': summary}), 409
+        rejected = []
+        if summary.pop('error_report'):
+            report = pd.read_csv(error_report, dtype=str, keep_default_na=False, nrows=MAX_REPORTED_REJECTS)
+            rejected = report.to_dict('records')
+    
+    return jsonify({'message': f"Imported {summary['inserted']} hospitals", 'summary': summary, 'rejected': rejected}), 200
+
+@app.route('/api/inventory/contention')
+@login_required
+def inventory_contention():
+    """Inventory compare-and-swap conflict and retry counters for this app process (admins only)"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(get_contention_stats())
+
 @app.route('/api/hospital/confirm-donation', methods=['POST'])
 @login_required
+@retry_on_inventory_conflict
 def confirm_donation():
     if not isinstance(current_user, Hospital):
         return jsonify({'error': 'Unauthorized'}), 403
@@ -127,9 +322,10 @@ def confirm_donation():
     acceptance.units_donated = units_donated
     acceptance.completed_at = datetime.utcnow()
     
-    # Update donor's donation count
+    # Update donor's donation count and start their waiting period (moves next_eligible)
     donor = acceptance.donor
     donor.donations_count += 1
+    donor.last_donated = date.today()
     
     # Update blood request status and remaining units
     blood_request = acceptance.request
@@ -150,16 +346,8 @@ def confirm_donation():
         # Only send to eligible donors
         matching_donors = Donor.query.filter_by(
             blood_group=blood_request.blood_group,
-            availability=True,
-            eligibility_status='eligible'
-        ).filter(Donor.id != donor.id).all()
-        
-        # Send heartwarming messages to non-eligible donors
-        non_eligible_donors = Donor.query.filter_by(
-            blood_group=blood_request.blood_group,
-            availability=True,
-            eligibility_status='not eligible'
-        ).filter(Donor.id != donor.id).all()
+            availability=True
+        ).filter(Donor.is_eligible).filter(Donor.id != donor.id).all()
         
         for other_donor in matching_donors:
             # Check if this donor already has an alert for this request
@@ -186,51 +374,6 @@ def confirm_donation():
                     message=alert_msg
                 )
                 db.session.add(alert)
-        
-        # Send heartwarming messages to non-eligible donors
-        for other_donor in non_eligible_donors:
-            # Check if this donor already has a heartwarming message for this request
-            existing_alert = DonorAlert.query.filter_by(
-                donor_id=other_donor.id,
-                request_id=blood_request.id
-            ).first()
-            
-            if not existing_alert:
-                # Calculate days until eligible
-                from datetime import date
-                today = date.today()
-                days_until_eligible = (other_donor.next_eligible - today).days if other_donor.next_eligible else 0
-                
-                if days_until_eligible > 0:
-                    heartwarming_msg = (
-                        f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}:\n\n"
-                        f"Dear {other_donor.name},\n\n"
-                        f"We know you're always ready to help save lives! 💪\n"
-                        f"Unfortunately, you're not eligible to donate right now due to the required waiting period.\n\n"
-                        f"⏰ You'll be eligible to donate again in {days_until_eligible} days (around {other_donor.next_eligible.strftime('%B %d, %Y')})\n\n"
-                        f"💖 Your past donations have already saved countless lives, and we can't wait to have you back!\n"
-                        f"Please take care of yourself and know that your commitment to helping others is truly inspiring.\n\n"
-                        f"With gratitude,\nThe ClotSync Team ❤️"
-                    )
-                else:
-                    heartwarming_msg = (
-                        f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}:\n\n"
-                        f"Dear {other_donor.name},\n\n"
-                        f"We know you're always ready to help save lives! 💪\n"
-                        f"Unfortunately, you're not eligible to donate right now due to the required waiting period.\n\n"
-                        f"⏰ You'll be eligible to donate again soon!\n\n"
-                        f"💖 Your past donations have already saved countless lives, and we can't wait to have you back!\n"
-                        f"Please take care of yourself and know that your commitment to helping others is truly inspiring.\n\n"
-                        f"With gratitude,\nThe ClotSync Team ❤️"
-                    )
-                
-                alert = DonorAlert(
-                    donor_id=other_donor.id,
-                    request_id=blood_request.id,
-                    hospital_id=current_user.id,
-                    message=heartwarming_msg
-                )
-                db.session.add(alert)
     
     db.session.commit()
     
@@ -282,21 +425,12 @@ def register_donor():
     if request.method == 'POST':
         data = request.get_json()
         
+        if Donor.query.filter_by(contact=data['contact']).first():
+            return jsonify({'error': 'A donor with this contact is already registered'}), 409
+        
         # Optional password (for login), else donor is contact-only
         hashed_pw = generate_password_hash(data['password']) if data.get('password') else None
         
-        # Calculate next_eligible date based on gender
-        next_eligible = None
-        if data.get('gender'):
-            from datetime import date, timedelta
-            today = date.today()
-            if data['gender'].lower() == 'male':
-                # Males can donate every 3 months
-                next_eligible = today + timedelta(days=90)
-            elif data['gender'].lower() == 'female':
-                # Females can donate every 4 months
-                next_eligible = today + timedelta(days=120)
-        
         donor = Donor(
             name=data['name'],
             blood_group=data['blood_group'],
@@ -307,17 +441,13 @@ def register_donor():
             availability=data.get('availability', True),
             gender=data.get('gender'),
             latitude=data.get('latitude'),
-            longitude=data.get('longitude'),
-            next_eligible=next_eligible
+            longitude=data.get('longitude')
+            # New donors have not donated yet, so next_eligible stays empty (eligible)
         )
         
         db.session.add(donor)
         db.session.commit()
         
-        # Calculate eligibility status after commit (to ensure donor has an ID)
-        donor.calculate_eligibility_status()
-        db.session.commit()
-        
         return jsonify({'message': 'Donor registered successfully'}), 201
     
     return render_template('donor_portal.html')
@@ -330,6 +460,11 @@ def login_donor():
         # allow login by phone number (contact) or email
         donor = Donor.query.filter(Donor.contact == data['identifier']).first()
         
+        # Imported without a password: never matches, the donor has to set one first
+        if donor and donor.password_reset_required:
+            return jsonify({'error': 'Password reset required - request a reset link by email',
+                            'reset_required': True, 'reset_request_url': '/api/password-reset/request'}), 403
+        
         if donor and donor.password and check_password_hash(donor.password, data['password']):
             login_user(donor)
             return jsonify({'message': 'Login successful', 'redirect': '/donor_dashboard'}), 200
@@ -337,6 +472,95 @@ def login_donor():
             return jsonify({'error': 'Invalid credentials'}), 401
     return render_template('login_donor.html')
 
+# Password reset
+# Imported accounts start with PASSWORD_RESET_REQUIRED instead of a hash; they (and anyone
+# who forgot their password) set one through a signed, time-limited reset link.
+
+def _password_reset_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt='password-reset')
+
+def _password_fingerprint(account):
+    # Tokens carry a digest of the password they replace, so a used token stops working
+    return hashlib.sha256((account.password or '').encode()).hexdigest()[:16]
+
+def make_password_reset_token(account):
+    account_type = 'hospital' if isinstance(account, Hospital) else 'donor'
+    return _password_reset_serializer().dumps(
+        {'type': account_type, 'id': account.id, 'password': _password_fingerprint(account)}
+    )
+
+def account_for_password_reset_token(token):
+    """Account a reset token was issued for, or None if it is invalid, expired or already used"""
+    try:
+        data = _password_reset_serializer().loads(token, max_age=PASSWORD_RESET_MAX_AGE_SECONDS)
+    except BadSignature:  # includes SignatureExpired
+        return None
+    model = PASSWORD_RESET_ACCOUNTS.get(data.get('type')) if isinstance(data, dict) else None
+    account = model.query.get(data.get('id')) if model else None
+    if account is None or data.get('password') != _password_fingerprint(account):
+        return None
+    return account
+
+def _password_reset_url(account):
+    return url_for('reset_password', token=make_password_reset_token(account), _external=True)
+
+@app.route('/api/password-reset/request', methods=['POST'])
+def request_password_reset():
+    """Email a reset link to a donor; the response never reveals whether the account exists"""
+    data = request.get_json() or {}
+    identifier = str(data.get('identifier') or '').strip()
+    donor = Donor.query.filter(
+        db.or_(Donor.contact == identifier, Donor.email == identifier)
+    ).first() if identifier else None
+
+    if donor and donor.email:
+        body = (
+            f"Dear {donor.name},\n\n"
+            f"Use this link to set your ClotSync password (valid for {PASSWORD_RESET_MAX_AGE_SECONDS // 3600} hours):\n"
+            f"{_password_reset_url(donor)}\n\n"
+            "If you did not ask for this, you can ignore this email.\n\nThe ClotSync Team"
+        )
+        try:
+            send_email(to_email=donor.email, subject="ClotSync password reset", body=body)
+        except Exception as e:
+            print(f"Password reset email send failed to {donor.email}: {e}")
+
+    return jsonify({'message': 'If the account has an email address, a reset link has been sent to it'}), 200
+
+@app.route('/api/admin/password-reset-link', methods=['POST'])
+@login_required
+def admin_password_reset_link():
+    """Reset link for an account without email (e.g. imported hospitals), handed over out of band"""
+    if not current_user_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    data = request.get_json() or {}
+    model = PASSWORD_RESET_ACCOUNTS.get(data.get('account_type'))
+    if model is None:
+        return jsonify({'error': f"account_type must be one of: {', '.join(PASSWORD_RESET_ACCOUNTS)}"}), 400
+    account = model.query.get(data.get('id')) if isinstance(data.get('id'), int) else None
+    if account is None:
+        return jsonify({'error': 'Account not found'}), 404
+
+    return jsonify({'reset_url': _password_reset_url(account), 'expires_in': PASSWORD_RESET_MAX_AGE_SECONDS}), 200
+
+@app.route('/reset_password', methods=['GET', 'POST'])
+def reset_password():
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        account = account_for_password_reset_token(data.get('token') or '')
+        if account is None:
+            return jsonify({'error': 'Reset link is invalid or has expired'}), 400
+        if not data.get('password'):
+            return jsonify({'error': 'Password is required'}), 400
+
+        account.password = generate_password_hash(data['password'])
+        db.session.commit()
+        redirect_to = '/login_hospital' if isinstance(account, Hospital) else '/login_donor'
+        return jsonify({'message': 'Password updated', 'redirect': redirect_to}), 200
+
+    return render_template('reset_password.html', token=request.args.get('token', ''))
+
 @app.route('/donor_dashboard')
 @login_required
 def donor_dashboard():
@@ -740,16 +964,8 @@ def request_blood():
     # Only send to eligible donors
     matching_donors = Donor.query.filter_by(
         blood_group=data['blood_group'],
-        availability=True,
-        eligibility_status='eligible'
-    ).all()
-    
-    # Send heartwarming messages to non-eligible donors
-    non_eligible_donors = Donor.query.filter_by(
-        blood_group=data['blood_group'],
-        availability=True,
-        eligibility_status='not eligible'
-    ).all()
+        availability=True
+    ).filter(Donor.is_eligible).all()
     
     for donor in matching_donors:
         alert_msg = (
@@ -778,62 +994,6 @@ def request_blood():
                 )
             except Exception as e:
                 print(f"Email send failed to {donor.email}: {e}")
-    
-    # Send heartwarming messages to non-eligible donors
-    for donor in non_eligible_donors:
-        # Check if this donor already has a heartwarming message for this request
-        existing_alert = DonorAlert.query.filter_by(
-            donor_id=donor.id,
-            request_id=blood_request.id
-        ).first()
-        
-        if not existing_alert:
-            # Calculate days until eligible
-            from datetime import date
-            today = date.today()
-            days_until_eligible = (donor.next_eligible - today).days if donor.next_eligible else 0
-            
-            if days_until_eligible > 0:
-                heartwarming_msg = (
-                    f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}:\n\n"
-                    f"Dear {donor.name},\n\n"
-                    f"We know you're always ready to help save lives! 💪\n"
-                    f"Unfortunately, you're not eligible to donate right now due to the required waiting period.\n\n"
-                    f"⏰ You'll be eligible to donate again in {days_until_eligible} days (around {donor.next_eligible.strftime('%B %d, %Y')})\n\n"
-                    f"💖 Your past donations have already saved countless lives, and we can't wait to have you back!\n"
-                    f"Please take care of yourself and know that your commitment to helping others is truly inspiring.\n\n"
-                    f"With gratitude,\nThe ClotSync Team ❤️"
-                )
-            else:
-                heartwarming_msg = (
-                    f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}:\n\n"
-                    f"Dear {donor.name},\n\n"
-                    f"We know you're always ready to help save lives! 💪\n"
-                    f"Unfortunately, you're not eligible to donate right now due to the required waiting period.\n\n"
-                    f"⏰ You'll be eligible to donate again soon!\n\n"
-                    f"💖 Your past donations have already saved countless lives, and we can't wait to have you back!\n"
-                    f"Please take care of yourself and know that your commitment to helping others is truly inspiring.\n\n"
-                    f"With gratitude,\nThe ClotSync Team ❤️"
-                )
-            
-            alert = DonorAlert(
-                donor_id=donor.id,
-                request_id=blood_request.id,
-                hospital_id=patient.hospital_id,
-                message=heartwarming_msg
-            )
-            db.session.add(alert)
-            
-            # Send heartwarming email if available
-            if donor.email:
-                try:
-                    send_email(
-                        to_email=donor.email,
-                        subject=f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}",
-                        body=heartwarming_msg
-                    )
-                except Exception as e:
-                    print(f"Heartwarming email send failed to {donor.email}: {e}")
 
     db.session.commit()
     
@@ -928,16 +1088,8 @@ def patient_request_submit():
     # Only send to eligible donors
     matching_donors = Donor.query.filter_by(
         blood_group=data['blood_group'], 
-        availability=True,
-        eligibility_status='eligible'
-    ).all()
-    
-    # Send heartwarming messages to non-eligible donors
-    non_eligible_donors = Donor.query.filter_by(
-        blood_group=data['blood_group'], 
-        availability=True,
-        eligibility_status='not eligible'
-    ).all()
+        availability=True
+    ).filter(Donor.is_eligible).all()
     
     for donor in matching_donors:
         alert_msg = (
@@ -966,62 +1118,6 @@ def patient_request_submit():
                 )
             except Exception as e:
                 print(f"Email send failed to {donor.email}: {e}")
-    
-    # Send heartwarming messages to non-eligible donors
-    for donor in non_eligible_donors:
-        # Check if this donor already has a heartwarming message for this request
-        existing_alert = DonorAlert.query.filter_by(
-            donor_id=donor.id,
-            request_id=blood_request.id
-        ).first()
-        
-        if not existing_alert:
-            # Calculate days until eligible
-            from datetime import date
-            today = date.today()
-            days_until_eligible = (donor.next_eligible - today).days if donor.next_eligible else 0
-            
-            if days_until_eligible > 0:
-                heartwarming_msg = (
-                    f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}:\n\n"
-                    f"Dear {donor.name},\n\n"
-                    f"We know you're always ready to help save lives! 💪\n"
-                    f"Unfortunately, you're not eligible to donate right now due to the required waiting period.\n\n"
-                    f"⏰ You'll be eligible to donate again in {days_until_eligible} days (around {donor.next_eligible.strftime('%B %d, %Y')})\n\n"
-                    f"💖 Your past donations have already saved countless lives, and we can't wait to have you back!\n"
-                    f"Please take care of yourself and know that your commitment to helping others is truly inspiring.\n\n"
-                    f"With gratitude,\nThe ClotSync Team ❤️"
-                )
-            else:
-                heartwarming_msg = (
-                    f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}:\n\n"
-                    f"Dear {donor.name},\n\n"
-                    f"We know you're always ready to help save lives! 💪\n"
-                    f"Unfortunately, you're not eligible to donate right now due to the required waiting period.\n\n"
-                    f"⏰ You'll be eligible to donate again soon!\n\n"
-                    f"💖 Your past donations have already saved countless lives, and we can't wait to have you back!\n"
-                    f"Please take care of yourself and know that your commitment to helping others is truly inspiring.\n\n"
-                    f"With gratitude,\nThe ClotSync Team ❤️"
-                )
-            
-            alert = DonorAlert(
-                donor_id=donor.id,
-                request_id=blood_request.id,
-                hospital_id=patient.hospital_id,
-                message=heartwarming_msg
-            )
-            db.session.add(alert)
-            
-            # Send heartwarming email if available
-            if donor.email:
-                try:
-                    send_email(
-                        to_email=donor.email,
-                        subject=f"💝 Heartwarming Reminder - Blood Request {blood_request.request_code}",
-                        body=heartwarming_msg
-                    )
-                except Exception as e:
-                    print(f"Heartwarming email send failed to {donor.email}: {e}")
 
     db.session.commit()
 
@@ -1124,13 +1220,15 @@ def get_patient_resources():
     # Prioritize eligible donors first
     eligible_donors = (
         Donor.query
-        .filter_by(blood_group=blood_group, availability=True, eligibility_status='eligible')
+        .filter_by(blood_group=blood_group, availability=True)
+        .filter(Donor.is_eligible)
         .all()
     )
     
     non_eligible_donors = (
         Donor.query
-        .filter_by(blood_group=blood_group, availability=True, eligibility_status='not eligible')
+        .filter_by(blood_group=blood_group, availability=True)
+        .filter(~Donor.is_eligible)
         .all()
     )
 
@@ -1178,29 +1276,15 @@ def get_patient_resources():
         d['distance'] if d['distance'] is not None else float('inf')
     ))
 
-    # Hospitals with stock for the requested blood group
-    hospitals = Hospital.query.all()
-    hospitals_list = []
-    for hospital in hospitals:
-        inv = hospital.get_inventory()
-        units_available = int(inv.get(blood_group, 0)) if inv else 0
-        if units_available > 0:
-            distance_km = calculate_distance(patient_location, hospital.location)
-            hospitals_list.append({
-                'id': hospital.id,
-                'name': hospital.name,
-                'location': hospital.location,
-                'contact': hospital.contact,
-                'units_available': units_available,
-                'can_fulfill': units_available >= units_needed,
-                'distance': distance_km,
-                'distance_text': f"{distance_km} km" if distance_km is not None else 'N/A'
-            })
-
-    hospitals_list.sort(key=lambda h: (
-        0 if h['can_fulfill'] else 1,
-        h['distance'] if h['distance'] is not None else float('inf')
-    ))
+    # Hospitals with stock for the requested blood group (indexed search, patient geocoded once)
+    patient_coords = geocode_location(patient_location)
+    hospitals_list = search_stock(
+        blood_group,
+        units=units_needed,
+        lat=patient_coords['lat'] if patient_coords else None,
+        lon=patient_coords['lon'] if patient_coords else None,
+        include_partial=True
+    )['hospitals']
 
     return jsonify({
         'request': {
@@ -1399,6 +1483,7 @@ def get_location_info(location):
 
 @app.route('/fulfill_request/<int:request_id>', methods=['POST'])
 @login_required
+@retry_on_inventory_conflict
 def fulfill_request(request_id):
     if not isinstance(current_user, Hospital):
         return jsonify({'error': 'Unauthorized'}), 403
@@ -1416,8 +1501,12 @@ def fulfill_request(request_id):
     if hospital_inventory.get(blood_request.blood_group, 0) < units_to_fulfill:
         return jsonify({'error': 'Insufficient blood stock'}), 400
     
-    # Update hospital inventory
-    current_user.update_blood_stock(blood_request.blood_group, -units_to_fulfill)
+    # Issue units from the earliest-expiring lots
+    allocations = current_user.allocate_blood_lots(blood_request.blood_group, units_to_fulfill)
+    if sum(taken for _, taken in allocations) < units_to_fulfill:
+        # Part of the counted stock has expired since the last expiry sweep
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient blood stock'}), 400
     
     # Update request status
     if units_to_fulfill >= blood_request.units_needed:
@@ -1444,6 +1533,7 @@ def fulfill_request(request_id):
 # Transfer Routes
 @app.route('/transfer_blood', methods=['POST'])
 @login_required
+@retry_on_inventory_conflict
 def transfer_blood():
     if not isinstance(current_user, Hospital):
         return jsonify({'error': 'Unauthorized'}), 403
@@ -1466,12 +1556,19 @@ def transfer_blood():
         units=units
     )
     
-    # Update inventories
-    current_user.update_blood_stock(blood_group, -units)
+    # Move the earliest-expiring lots; the receiving hospital keeps their original expiry dates
+    allocations = current_user.allocate_blood_lots(blood_group, units, reason='transfer_out')
+    if sum(taken for _, taken in allocations) < units:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient blood stock'}), 400
     
     to_hospital = Hospital.query.get(data['to_hospital_id'])
     if to_hospital:
-        to_hospital.update_blood_stock(blood_group, units)
+        for lot, taken in allocations:
+            to_hospital.add_blood_lot(
+                blood_group, taken,
+                collected_at=lot.collected_at, expires_at=lot.expires_at, reason='transfer_in'
+            )
     
     db.session.add(transfer)
     db.session.commit()
@@ -1481,22 +1578,224 @@ def transfer_blood():
         'transfer_id': transfer.id
     }), 201
 
+MAX_BULK_ITEMS = 200
+
+def _bulk_item_units(item):
+    """Validated positive unit count of a bulk item, or None"""
+    try:
+        units = int(item.get('units', 1))
+    except (TypeError, ValueError):
+        return None
+    return units if units > 0 else None
+
+def _bulk_item_id(item, key):
+    """Validated positive integer id (an int or a string of digits) from a bulk item, or None"""
+    value = item.get(key) if isinstance(item, dict) else None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+def _bulk_item_blood_group(item):
+    """Blood group of a bulk item if it is a known group, or None"""
+    blood_group = item.get('blood_group') if isinstance(item, dict) else None
+    return blood_group if isinstance(blood_group, str) and blood_group in BLOOD_GROUPS else None
+
+@app.route('/api/transfers/bulk', methods=['POST'])
+@login_required
+@retry_on_inventory_conflict
+def bulk_transfer_blood():
+    """Apply a list of transfers in one transaction, validated against one locked stock snapshot"""
+    if not isinstance(current_user, Hospital):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    items = (request.get_json() or {}).get('transfers') or []
+    if not isinstance(items, list) or not items or len(items) > MAX_BULK_ITEMS:
+        return jsonify({'error': f'Provide between 1 and {MAX_BULK_ITEMS} transfers'}), 400
+    
+    snapshot = lock_stock_snapshot(current_user, {_bulk_item_blood_group(item) for item in items} - {None})
+    destination_ids = {_bulk_item_id(item, 'to_hospital_id') for item in items} - {None}
+    destinations = {h.id: h for h in Hospital.query.filter(Hospital.id.in_(destination_ids)).all()} if destination_ids else {}
+    
+    results = []
+    transfer_rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'success': False, 'error': 'Each transfer must be an object'})
+            continue
+        blood_group = _bulk_item_blood_group(item)
+        units = _bulk_item_units(item)
+        to_hospital_id = _bulk_item_id(item, 'to_hospital_id')
+        to_hospital = destinations.get(to_hospital_id)
+        
+        if not blood_group or units is None:
+            results.append({'index': index, 'success': False, 'error': 'A known blood_group and positive units are required'})
+            continue
+        if to_hospital_id is None:
+            results.append({'index': index, 'success': False, 'error': 'to_hospital_id must be a positive integer'})
+            continue
+        if not to_hospital or to_hospital.id == current_user.id:
+            results.append({'index': index, 'success': False, 'error': 'Invalid destination hospital'})
+            continue
+        if sum(lot.units for lot in snapshot[blood_group]) < units:
+            results.append({'index': index, 'success': False, 'error': 'Insufficient blood stock'})
+            continue
+        
+        allocations = current_user.allocate_blood_lots(blood_group, units, reason='transfer_out', lots=snapshot[blood_group])
+        for lot, taken in allocations:
+            to_hospital.add_blood_lot(
+                blood_group, taken,
+                collected_at=lot.collected_at, expires_at=lot.expires_at, reason='transfer_in'
+            )
+        transfer_rows.append({
+            'from_hospital_id': current_user.id,
+            'to_hospital_id': to_hospital.id,
+            'blood_group': blood_group,
+            'units': units,
+            'timestamp': datetime.utcnow(),
+            'status': 'pending'
+        })
+        results.append({'index': index, 'success': True, 'to_hospital_id': to_hospital.id, 'blood_group': blood_group, 'units': units})
+    
+    db.session.bulk_insert_mappings(BloodTransfer, transfer_rows)
+    db.session.commit()
+    
+    return jsonify({
+        'message': f'{len(transfer_rows)} of {len(items)} transfers applied',
+        'results': results,
+        'inventory': current_user.get_inventory()
+    })
+
+@app.route('/api/requests/fulfill/bulk', methods=['POST'])
+@login_required
+@retry_on_inventory_conflict
+def bulk_fulfill_requests():
+    """Fulfil a list of requests in one transaction, validated against one locked stock snapshot"""
+    if not isinstance(current_user, Hospital):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    items = (request.get_json() or {}).get('fulfilments') or []
+    if not isinstance(items, list) or not items or len(items) > MAX_BULK_ITEMS:
+        return jsonify({'error': f'Provide between 1 and {MAX_BULK_ITEMS} fulfilments'}), 400
+    
+    request_ids = {_bulk_item_id(item, 'request_id') for item in items} - {None}
+    blood_requests = {
+        r.id: r for r in BloodRequest.query.filter(BloodRequest.id.in_(request_ids)).with_for_update().all()
+    } if request_ids else {}
+    snapshot = lock_stock_snapshot(current_user, {r.blood_group for r in blood_requests.values()})
+    
+    results = []
+    transfer_rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'success': False, 'error': 'Each fulfilment must be an object'})
+            continue
+        blood_request = blood_requests.get(_bulk_item_id(item, 'request_id'))
+        units = _bulk_item_units(item)
+        
+        if not blood_request:
+            results.append({'index': index, 'success': False, 'error': 'Blood request not found'})
+            continue
+        if blood_request.status != 'pending':
+            results.append({'index': index, 'request_id': blood_request.id, 'success': False, 'error': f'Request is {blood_request.status}'})
+            continue
+        if units is None:
+            results.append({'index': index, 'request_id': blood_request.id, 'success': False, 'error': 'units must be a positive number'})
+            continue
+        if sum(lot.units for lot in snapshot[blood_request.blood_group]) < units:
+            results.append({'index': index, 'request_id': blood_request.id, 'success': False, 'error': 'Insufficient blood stock'})
+            continue
+        
+        current_user.allocate_blood_lots(blood_request.blood_group, units, lots=snapshot[blood_request.blood_group])
+        if units >= blood_request.units_needed:
+            blood_request.status = 'fulfilled'
+        else:
+            blood_request.units_needed -= units
+        transfer_rows.append({
+            'from_hospital_id': current_user.id,
+            'to_hospital_id': None,  # Direct to patient
+            'blood_group': blood_request.blood_group,
+            'units': units,
+            'timestamp': datetime.utcnow(),
+            'status': 'pending'
+        })
+        results.append({
+            'index': index,
+            'request_id': blood_request.id,
+            'success': True,
+            'units': units,
+            'request_status': blood_request.status
+        })
+    
+    db.session.bulk_insert_mappings(BloodTransfer, transfer_rows)
+    db.session.commit()
+    
+    return jsonify({
+        'message': f'{len(transfer_rows)} of {len(items)} requests fulfilled',
+        'results': results,
+        'inventory': current_user.get_inventory()
+    })
+
 # AI/ML Routes
 @app.route('/predict_shortage')
 def predict_shortage():
-    # Dummy ML API - returns hardcoded predictions
-    predictions = {
-        "B Positive": "shortage in 2 days",
-        "O Negative": "adequate",
-        "A Positive": "adequate",
-        "A Negative": "shortage in 5 days",
-        "B Negative": "adequate",
-        "AB Positive": "shortage in 1 day",
-        "A2B Negative": "adequate",
-        "O Positive": "shortage in 3 days"
-    }
-    
-    return jsonify(predictions)
+    """Precomputed stockout forecasts (refreshed by forecasting.refresh_forecasts)
+    
+    Hospitals get their own forecasts; everyone else gets network-wide totals.
+    Pass ?detail=1 for rates, stock and computed_at instead of the summary strings.
+    """
+    from forecasting import describe_days_left
+    
+    query = ShortageForecast.query
+    if current_user.is_authenticated and isinstance(current_user, Hospital):
+        query = query.filter_by(hospital_id=current_user.id)
+    
+    by_group = {}
+    for f in query.all():
+        group = by_group.setdefault(f.blood_group, {'stock_units': 0, 'daily_demand': 0.0, 'daily_supply': 0.0, 'computed_at': f.computed_at})
+        group['stock_units'] += f.stock_units
+        group['daily_demand'] += f.daily_demand
+        group['daily_supply'] += f.daily_supply
+    
+    for group in by_group.values():
+        net_burn = group['daily_demand'] - group['daily_supply']
+        group['days_until_stockout'] = round(max(group['stock_units'], 0) / net_burn, 1) if net_burn > 0 else None
+    
+    if request.args.get('detail') == '1':
+        return jsonify({
+            blood_group: dict(group, computed_at=group['computed_at'].isoformat())
+            for blood_group, group in by_group.items()
+        })
+    
+    return jsonify({
+        blood_group: describe_days_left(group['days_until_stockout'])
+        for blood_group, group in by_group.items()
+    })
+
+@app.route('/api/transfers/plan')
+@login_required
+def transfer_plan():
+    """Minimum-cost inter-hospital transfers that cover forecast shortages"""
+    from transfer_planner import get_transfer_plan
+    
+    blood_group = request.args.get('blood_group') or None
+    if blood_group is not None and blood_group not in BLOOD_GROUPS:
+        return jsonify({'error': 'Unknown blood_group'}), 400
+    
+    try:
+        # Only admins may skip the cache: a refresh re-solves the whole LP
+        plan = get_transfer_plan(
+            blood_group=blood_group,
+            refresh=request.args.get('refresh') == '1' and current_user_is_admin()
+        )
+    except RuntimeError as e:
+        print(f"Transfer planning error: {e}")
+        return jsonify({'error': 'Failed to compute transfer plan'}), 500
+    
+    return jsonify(plan)
 
 @app.route('/send_alert/<int:donor_id>', methods=['POST'])
 def send_alert(donor_id):
@@ -1599,10 +1898,6 @@ def check_donor_eligibility(donor_id):
     from datetime import date
     donor = Donor.query.get_or_404(donor_id)
     
-    # Calculate current eligibility status
-    donor.calculate_eligibility_status()
-    db.session.commit()
-    
     return jsonify({
         'donor_id': donor.id,
         'name': donor.name,
@@ -1627,12 +1922,9 @@ def update_last_donation(donor_id):
         from datetime import datetime
         last_donated = datetime.strptime(data['last_donated'], '%Y-%m-%d').date()
         
-        # Update last donation date
+        # Update last donation date (moves next_eligible, which eligibility is derived from)
         donor.last_donated = last_donated
         
-        # Recalculate eligibility status
-        donor.calculate_eligibility_status()
-        
         # Update donations count
         donor.donations_count += 1
         
@@ -1692,15 +1984,19 @@ def chatbot_widget():
 # Reports route
 @app.route('/admin_reports')
 def admin_reports():
-    """Generate and display admin reports"""
+    """Display the cached admin report (?refresh=1 regenerates it first, for admins only)"""
     try:
-        # Import the reports module
-        from reports import generate_ai_report_from_db
+        from report_cache import get_admin_report
         
-        # Generate report from database
-        report = generate_ai_report_from_db()
+        # Anyone else asking for a refresh gets the cached copy
+        cached = get_admin_report(force_refresh=request.args.get('refresh') == '1' and current_user_is_admin())
         
-        return render_template('report.html', report=report)
+        return render_template(
+            'report.html',
+            report=cached['report'],
+            generated_at=cached['generated_at'],
+            stale=cached['stale']
+        )
         
     except Exception as e:
         print(f"Report generation error: {e}")
@@ -1715,11 +2011,15 @@ def admin_reports():
 # API endpoint for reports (for AJAX calls)
 @app.route('/api/admin_reports')
 def api_admin_reports():
-    """API endpoint to get report data"""
+    """API endpoint to get report data (cached; ?refresh=1 regenerates it first, for admins only)"""
     try:
-        from reports import generate_ai_report_from_db
-        report = generate_ai_report_from_db()
-        return jsonify(report)
+        from report_cache import get_admin_report
+        cached = get_admin_report(force_refresh=request.args.get('refresh') == '1' and current_user_is_admin())
+        return jsonify(dict(
+            cached['report'],
+            generated_at=cached['generated_at'].isoformat(),
+            stale=cached['stale']
+        ))
     except Exception as e:
         print(f"API report error: {e}")
         return jsonify({'error': 'Failed to generate report'}), 500
@@ -0,0 +1,222 @@
+"""
+Periodic maintenance jobs for ClotSync
+Jobs are declared in JOBS with a cron expression (minute hour day month weekday,
+local time) and the function they run. Each job has a scheduled_jobs row holding
+its next run time and a lease: a worker runs a due job only after claiming the
+lease with a conditional UPDATE, so several app instances running worker.py never
+run the same job twice, and a crashed worker's lease expires and is taken over.
+Every run is recorded in job_runs with its duration and, on failure, the traceback.
+"""
+
+import importlib
+import os
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import ScheduledJob, JobRun, DonorAlert
+
+POLL_SECONDS = 30
+DEFAULT_LEASE_SECONDS = 3600  # longer than any job should take; an expired lease means its worker died
+ALERT_RETENTION_DAYS = 90  # read alerts older than this are deleted
+ALERT_DELETE_BATCH_SIZE = 5000
+
+# Job name -> schedule, 'module:function' to call inside the app context, optional lease
+JOBS = {
+    'expire_blood_lots': {'schedule': '*/15 * * * *', 'target': 'inventory:expire_blood_lots'},
+    'stock_rollups': {'schedule': '5 * * * *', 'target': 'stock_history:rollup_stock_history'},
+    'stock_snapshot': {'schedule': '0 0 * * *', 'target': 'stock_history:snapshot_stock'},
+    'shortage_forecasts': {'schedule': '20 * * * *', 'target': 'forecasting:refresh_forecasts'},
+    'admin_report': {'schedule': '*/30 * * * *', 'target': 'report_cache:refresh_admin_report'},
+    'daily_rollups': {'schedule': '15 0 * * *', 'target': 'daily_rollups:rollup_daily'},
+    'donor_eligibility': {'schedule': '30 0 * * *', 'target': 'update_eligibility_for_all_donors:refresh_next_eligible'},
+    'expire_donor_alerts': {'schedule': '45 0 * * *', 'target': 'scheduler:expire_donor_alerts'},
+    'eligible_again_alerts': {'schedule': '0 8 * * *', 'target': 'eligibility_alerts:notify_eligible_again'}
+}
+# Not scheduled: hospital distances are updated as hospitals are added, and a full
+# rebuild (python distance_matrix.py) is a one-off backfill after migrating
+
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 6))
+
+def parse_cron(expression):
+    """Allowed values per field for a 5-field cron expression (*, */n, a-b, a-b/n, lists; weekday 0 = Sunday)"""
+    parts = expression.split()
+    if len(parts) != len(CRON_FIELDS):
+        raise ValueError(f"Cron expression '{expression}' needs {len(CRON_FIELDS)} fields")
+
+    allowed = {}
+    for part, (field, low, high) in zip(parts, CRON_FIELDS):
+        values = set()
+        for item in part.split(','):
+            spec, _, step = item.partition('/')
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(v) for v in spec.split('-', 1))
+            else:
+                start = end = int(spec)
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron {field} '{item}' is outside {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        allowed[field] = values
+    return allowed
+
+def next_run_after(expression, after):
+    """First minute strictly after `after` that matches the cron expression"""
+    allowed = parse_cron(expression)
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = moment + timedelta(days=366 * 5)
+    while moment < limit:
+        if moment.month not in allowed['month']:
+            moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+        elif moment.day not in allowed['day'] or (moment.weekday() + 1) % 7 not in allowed['weekday']:
+            moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+        elif moment.hour not in allowed['hour']:
+            moment = moment.replace(minute=0) + timedelta(hours=1)
+        elif moment.minute not in allowed['minute']:
+            moment += timedelta(minutes=1)
+        else:
+            return moment
+    raise ValueError(f"Cron expression '{expression}' never matches")
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _target(job):
+    module_name, function_name = JOBS[job]['target'].split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def sync_jobs(now=None):
+    """Create schedule rows for new jobs and reschedule jobs whose cron expression changed"""
+    now = now or datetime.now()
+    rows = {row.name: row for row in ScheduledJob.query.all()}
+    for name, job in JOBS.items():
+        row = rows.get(name)
+        if row is None:
+            db.session.add(ScheduledJob(name=name, schedule=job['schedule'],
+                                        next_run_at=next_run_after(job['schedule'], now)))
+        elif row.schedule != job['schedule']:
+            row.schedule = job['schedule']
+            row.next_run_at = next_run_after(job['schedule'], now)
+    try:
+        db.session.commit()
+    except Exception:
+        # Another worker created the same rows first
+        db.session.rollback()
+
+def claim_job(name, worker, now, force=False):
+    """Take the job's lease if it is due (or forced) and not held by a live worker; True when claimed"""
+    lease = JOBS[name].get('lease_seconds', DEFAULT_LEASE_SECONDS)
+    query = ScheduledJob.query.filter(
+        ScheduledJob.name == name,
+        db.or_(ScheduledJob.locked_until.is_(None), ScheduledJob.locked_until < now)
+    )
+    if not force:
+        query = query.filter(ScheduledJob.next_run_at <= now)
+    claimed = query.update(
+        {ScheduledJob.locked_by: worker, ScheduledJob.locked_until: now + timedelta(seconds=lease)},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return claimed == 1
+
+def run_job(name, worker=None, force=False):
+    """Run one job if this worker can claim it; returns its JobRun, or None when it was not claimed"""
+    worker = worker or worker_id()
+    started = datetime.now()
+    if not claim_job(name, worker, started, force=force):
+        return None
+
+    run = JobRun(job_name=name, worker=worker, status='running', started_at=started)
+    db.session.add(run)
+    db.session.commit()
+    run_id = run.id
+
+    clock = time.monotonic()
+    status, error = 'succeeded', None
+    try:
+        _target(name)()
+    except Exception:
+        db.session.rollback()
+        status, error = 'failed', traceback.format_exc()
+        print(f"Job {name} failed:\n{error}")
+    duration = time.monotonic() - clock
+    finished = datetime.now()
+
+    # The job may have left anything in the session; record the outcome from a clean one
+    db.session.remove()
+    run = JobRun.query.get(run_id)
+    run.status = status
+    run.error = error
+    run.finished_at = finished
+    run.duration_seconds = round(duration, 3)
+    ScheduledJob.query.filter_by(name=name, locked_by=worker).update({
+        ScheduledJob.next_run_at: next_run_after(JOBS[name]['schedule'], finished),
+        ScheduledJob.last_run_at: started,
+        ScheduledJob.locked_by: None,
+        ScheduledJob.locked_until: None
+    }, synchronize_session=False)
+    db.session.commit()
+    print(f"Job {name} {status} in {duration:.1f}s")
+    return run
+
+def run_due_jobs(worker=None, now=None):
+    """Run every job that is due; returns the names of the jobs this worker ran"""
+    worker = worker or worker_id()
+    now = now or datetime.now()
+    due = [
+        name for (name,) in
+        db.session.query(ScheduledJob.name)
+        .filter(ScheduledJob.next_run_at <= now)
+        .order_by(ScheduledJob.next_run_at)
+        .all()
+        if name in JOBS
+    ]
+    db.session.commit()
+    return [name for name in due if run_job(name, worker)]
+
+def run_forever(poll_seconds=POLL_SECONDS):
+    """Worker loop: run due jobs, then sleep until the next poll (call inside an app context)"""
+    worker = worker_id()
+    sync_jobs()
+    print(f"Scheduler worker {worker} started with {len(JOBS)} jobs")
+    while True:
+        try:
+            run_due_jobs(worker)
+        except Exception as e:
+            # Database hiccups must not kill the worker; the next poll retries
+            db.session.rollback()
+            print(f"Scheduler poll error: {e}")
+        db.session.remove()
+        time.sleep(poll_seconds)
+
+def job_history(name=None, limit=20):
+    """Most recent runs, newest first"""
+    query = JobRun.query
+    if name:
+        query = query.filter_by(job_name=name)
+    return query.order_by(JobRun.started_at.desc()).limit(limit).all()
+
+# Maintenance jobs without a module of their own
+
+def expire_donor_alerts(now=None):
+    """Delete read alerts older than ALERT_RETENTION_DAYS, in batches"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=ALERT_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        ids = [
+            alert_id for (alert_id,) in
+            db.session.query(DonorAlert.id)
+            .filter(DonorAlert.created_at < cutoff, DonorAlert.is_read.is_(True))
+            .limit(ALERT_DELETE_BATCH_SIZE)
+            .all()
+        ]
+        if not ids:
+            break
+        DonorAlert.query.filter(DonorAlert.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    print(f"Deleted {deleted} read alerts older than {ALERT_RETENTION_DAYS} days")
+    return deleted
@@ -0,0 +1,204 @@
+"""
+Stock level history for ClotSync
+Every inventory change appends a compact StockEvent (delta + resulting balance).
+rollup_stock_history() folds new events into hourly and daily StockRollup rows
+from a watermark, and snapshot_stock() records the current balance of every
+(hospital, group) so quiet periods still have a known level. Trend queries read
+rollups only: "O Negative at hospital H over 90 days" is ~90 indexed rows.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from extensions import db
+from models import Hospital, StockEvent, StockRollup, Watermark
+
+ROLLUP_WATERMARK = 'stock_rollups'
+ROLLUP_BATCH_SIZE = 50000
+# Events younger than this are left for the next run: ids are handed out at insert but
+# become visible at commit, so a newer event can commit before an older one. Must exceed
+# the longest stock-writing transaction, or the older event is skipped for good.
+ROLLUP_LAG_SECONDS = 300
+GRANULARITIES = {'hour': pd.Timedelta(hours=1), 'day': pd.Timedelta(days=1)}
+MAX_HISTORY_DAYS = 365  # every bucket in the window is materialized, so the window is capped
+
+def snapshot_stock():
+    """Append a zero-delta snapshot event with the current balance of every stocked group"""
+    events = []
+    for hospital_id, inventory in db.session.query(Hospital.id, Hospital.inventory).all():
+        for blood_group, units in json.loads(inventory or '{}').items():
+            events.append({
+                'hospital_id': hospital_id,
+                'blood_group': blood_group,
+                'delta': 0,
+                'balance': int(units or 0),
+                'reason': 'snapshot',
+                'created_at': datetime.utcnow()
+            })
+    db.session.bulk_insert_mappings(StockEvent, events)
+    db.session.commit()
+    print(f"Recorded {len(events)} stock snapshots")
+    return len(events)
+
+def _merge_buckets(frame, granularity):
+    """Fold one batch of events into rollup rows of one granularity"""
+    frame = frame.assign(bucket_start=frame['created_at'].dt.floor(GRANULARITIES[granularity]))
+    opening = frame['balance'] - frame['delta']
+    frame = frame.assign(
+        opening=opening,
+        # Levels held during an event: before it and after it
+        low=opening.where(opening < frame['balance'], frame['balance']),
+        high=opening.where(opening > frame['balance'], frame['balance']),
+        units_in=frame['delta'].clip(lower=0),
+        units_out=(-frame['delta']).clip(lower=0)
+    )
+    buckets = frame.groupby(['hospital_id', 'blood_group', 'bucket_start'], sort=False).agg(
+        opening_units=('opening', 'first'),
+        closing_units=('balance', 'last'),
+        min_units=('low', 'min'),
+        max_units=('high', 'max'),
+        units_in=('units_in', 'sum'),
+        units_out=('units_out', 'sum'),
+        events=('delta', 'size')
+    ).reset_index()
+
+    existing = {
+        (r.hospital_id, r.blood_group, r.bucket_start): r
+        for r in StockRollup.query.filter(
+            StockRollup.granularity == granularity,
+            StockRollup.bucket_start >= buckets['bucket_start'].min(),
+            StockRollup.bucket_start <= buckets['bucket_start'].max(),
+            StockRollup.hospital_id.in_(buckets['hospital_id'].unique().tolist())
+        ).all()
+    }
+
+    new_rows = []
+    for b in buckets.itertuples(index=False):
+        bucket_start = b.bucket_start.to_pydatetime()
+        row = existing.get((b.hospital_id, b.blood_group, bucket_start))
+        if row:
+            # Bucket already has earlier events: keep its opening, extend the rest
+            row.closing_units = int(b.closing_units)
+            row.min_units = min(row.min_units, int(b.min_units))
+            row.max_units = max(row.max_units, int(b.max_units))
+            row.units_in += int(b.units_in)
+            row.units_out += int(b.units_out)
+            row.events += int(b.events)
+        else:
+            new_rows.append({
+                'hospital_id': int(b.hospital_id),
+                'blood_group': b.blood_group,
+                'granularity': granularity,
+                'bucket_start': bucket_start,
+                'opening_units': int(b.opening_units),
+                'closing_units': int(b.closing_units),
+                'min_units': int(b.min_units),
+                'max_units': int(b.max_units),
+                'units_in': int(b.units_in),
+                'units_out': int(b.units_out),
+                'events': int(b.events)
+            })
+    db.session.bulk_insert_mappings(StockRollup, new_rows)
+
+def rollup_stock_history(now=None):
+    """Fold events newer than the watermark (and older than ROLLUP_LAG_SECONDS) into hourly and daily rollups"""
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=ROLLUP_LAG_SECONDS)
+    watermark = Watermark.query.get(ROLLUP_WATERMARK)
+    if not watermark:
+        watermark = Watermark(name=ROLLUP_WATERMARK, last_id=0)
+        db.session.add(watermark)
+
+    processed = 0
+    while True:
+        rows = (
+            db.session.query(
+                StockEvent.id, StockEvent.hospital_id, StockEvent.blood_group,
+                StockEvent.delta, StockEvent.balance, StockEvent.created_at
+            )
+            .filter(StockEvent.id > watermark.last_id)
+            .order_by(StockEvent.id.asc())
+            .limit(ROLLUP_BATCH_SIZE)
+            .all()
+        )
+        frame = pd.DataFrame(rows, columns=['id', 'hospital_id', 'blood_group', 'delta', 'balance', 'created_at'])
+        frame['created_at'] = pd.to_datetime(frame['created_at'])
+        # Stop at the first event inside the lag window; everything after it waits too
+        recent = (frame['created_at'] >= cutoff).to_numpy()
+        if recent.any():
+            frame = frame.iloc[:recent.argmax()]
+        if frame.empty:
+            break
+
+        for granularity in GRANULARITIES:
+            _merge_buckets(frame, granularity)
+
+        # Rollups and watermark move together, so a crash never double-counts a batch
+        watermark.last_id = int(frame['id'].iloc[-1])
+        db.session.commit()
+        processed += len(frame)
+        if recent.any():
+            break
+
+    print(f"Rolled up {processed} stock events")
+    return processed
+
+def stock_history(hospital_id, blood_group, days=90, granularity='day', now=None):
+    """Stock level series for one hospital/group, one point per bucket (gaps carried forward)"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if not 1 <= days <= MAX_HISTORY_DAYS:
+        raise ValueError(f"days must be between 1 and {MAX_HISTORY_DAYS}")
+
+    now = now or datetime.utcnow()
+    freq = GRANULARITIES[granularity]
+    start = pd.Timestamp(now - timedelta(days=days)).floor(freq).to_pydatetime()
+
+    base = StockRollup.query.filter(
+        StockRollup.hospital_id == hospital_id,
+        StockRollup.blood_group == blood_group,
+        StockRollup.granularity == granularity
+    )
+    rows = base.filter(StockRollup.bucket_start >= start).order_by(StockRollup.bucket_start.asc()).all()
+    # Level at the start of the window comes from the last bucket before it
+    previous = base.filter(StockRollup.bucket_start < start).order_by(StockRollup.bucket_start.desc()).first()
+
+    by_bucket = {r.bucket_start: r for r in rows}
+    level = previous.closing_units if previous else (rows[0].opening_units if rows else 0)
+
+    series = []
+    for bucket in pd.date_range(start, pd.Timestamp(now).floor(freq), freq=freq):
+        bucket = bucket.to_pydatetime()
+        row = by_bucket.get(bucket)
+        if row:
+            series.append({
+                'bucket_start': bucket.isoformat(),
+                'opening_units': row.opening_units,
+                'closing_units': row.closing_units,
+                'min_units': row.min_units,
+                'max_units': row.max_units,
+                'units_in': row.units_in,
+                'units_out': row.units_out
+            })
+            level = row.closing_units
+        else:
+            series.append({
+                'bucket_start': bucket.isoformat(),
+                'opening_units': level,
+                'closing_units': level,
+                'min_units': level,
+                'max_units': level,
+                'units_in': 0,
+                'units_out': 0
+            })
+    return series
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    with app.app_context():
+        if '--snapshot' in sys.argv:
+            snapshot_stock()
+        rollup_stock_history()
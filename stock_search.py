@@ -0,0 +1,191 @@
+"""
+Cross-hospital stock search for ClotSync
+Answers "who near me holds N units of group G" from the indexed blood_lots rows
+instead of parsing every hospital's inventory JSON. Per-group stock is cached
+for a few seconds, bucketed into lat/lon grid regions with running totals, so a
+radius search only looks at hospitals in the regions it overlaps. Stock writes in
+this process drop the group's cached copy, again once they commit; writes made by
+other app processes show up within STOCK_CACHE_TTL_SECONDS.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import event, func
+
+from extensions import db
+
+STOCK_CACHE_TTL_SECONDS = 30
+REGION_CELL_DEGREES = 0.5  # ~55 km grid cells
+EARTH_RADIUS_KM = 6371
+
+_cache_lock = threading.Lock()
+_group_cache = {}  # blood_group -> (loaded_at, snapshot)
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance in km from one point to arrays of points (vectorized)"""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def region_of(lat, lon):
+    """Grid cell a coordinate falls into (None for hospitals without coordinates)"""
+    if lat is None or lon is None:
+        return None
+    return (math.floor(lat / REGION_CELL_DEGREES), math.floor(lon / REGION_CELL_DEGREES))
+
+def _load_group_stock(blood_group):
+    """One grouped query: unexpired units of a blood group per hospital"""
+    from models import Hospital, BloodLot
+
+    rows = (
+        db.session.query(
+            Hospital.id, Hospital.name, Hospital.location, Hospital.contact,
+            Hospital.latitude, Hospital.longitude,
+            func.sum(BloodLot.units)
+        )
+        .join(BloodLot, BloodLot.hospital_id == Hospital.id)
+        .filter(
+            BloodLot.blood_group == blood_group,
+            BloodLot.expires_at > datetime.utcnow(),
+            BloodLot.units > 0
+        )
+        .group_by(Hospital.id, Hospital.name, Hospital.location, Hospital.contact,
+                  Hospital.latitude, Hospital.longitude)
+        .all()
+    )
+
+    regions = {}
+    for hospital_id, name, location, contact, lat, lon, units in rows:
+        cell = region_of(lat, lon)
+        region = regions.setdefault(cell, {'units': 0, 'hospitals': []})
+        region['units'] += int(units)
+        region['hospitals'].append({
+            'id': hospital_id,
+            'name': name,
+            'location': location,
+            'contact': contact,
+            'latitude': lat,
+            'longitude': lon,
+            'units_available': int(units)
+        })
+    return regions
+
+def get_group_stock(blood_group):
+    """Per-region stock snapshot for a blood group, cached for STOCK_CACHE_TTL_SECONDS"""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _group_cache.get(blood_group)
+        if cached and now - cached[0] < STOCK_CACHE_TTL_SECONDS:
+            return cached[1]
+
+    regions = _load_group_stock(blood_group)
+    with _cache_lock:
+        _group_cache[blood_group] = (now, regions)
+    return regions
+
+def invalidate_stock_cache(blood_group=None):
+    """Drop cached stock for a group (or all groups) now and again when the current transaction commits
+    The second drop covers searches that reloaded the group before the write was committed."""
+    with _cache_lock:
+        if blood_group is None:
+            _group_cache.clear()
+        else:
+            _group_cache.pop(blood_group, None)
+    db.session.info.setdefault('stock_changed', set()).add(blood_group)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed_stock(session):
+    changed = session.info.pop('stock_changed', None)
+    if not changed:
+        return
+    with _cache_lock:
+        if None in changed:
+            _group_cache.clear()
+        for blood_group in changed:
+            _group_cache.pop(blood_group, None)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_stock(session):
+    session.info.pop('stock_changed', None)
+
+def _regions_within(regions, lat, lon, radius_km):
+    """Regions whose grid cell overlaps the bounding box of the search radius"""
+    lat_span = radius_km / 111.0
+    lon_span = radius_km / max(111.0 * math.cos(math.radians(lat)), 1e-6)
+    min_cell = region_of(lat - lat_span, lon - lon_span)
+    max_cell = region_of(lat + lat_span, lon + lon_span)
+    return {
+        cell: region for cell, region in regions.items()
+        if cell is not None
+        and min_cell[0] <= cell[0] <= max_cell[0]
+        and min_cell[1] <= cell[1] <= max_cell[1]
+    }
+
+def search_stock(blood_group, units=1, lat=None, lon=None, radius_km=None, include_partial=False, limit=20,
+                 from_hospital_id=None):
+    """Nearest hospitals holding a blood group, those able to fulfil `units` first.
+
+    Without coordinates every hospital with stock is a candidate and distance is
+    None. With a radius, hospitals without coordinates are excluded. When the
+    origin is a hospital (from_hospital_id), distances come from the distance
+    matrix and that hospital itself is left out.
+    """
+    regions = get_group_stock(blood_group)
+    has_origin = from_hospital_id is not None or (lat is not None and lon is not None)
+    if lat is not None and lon is not None and radius_km is not None:
+        regions = _regions_within(regions, lat, lon, radius_km)
+
+    candidates = [h for region in regions.values() for h in region['hospitals']]
+    if from_hospital_id is not None:
+        candidates = [h for h in candidates if h['id'] != from_hospital_id]
+    if not include_partial:
+        candidates = [h for h in candidates if h['units_available'] >= units]
+
+    distances = [None] * len(candidates)
+    if from_hospital_id is not None and candidates:
+        from distance_matrix import get_distance_matrix
+        km = get_distance_matrix().distances_from(from_hospital_id, [h['id'] for h in candidates])
+        distances = [None if np.isnan(d) else round(float(d), 1) for d in km]
+    elif has_origin and candidates:
+        located = [i for i, h in enumerate(candidates) if h['latitude'] is not None and h['longitude'] is not None]
+        if located:
+            km = haversine_km(
+                lat, lon,
+                [candidates[i]['latitude'] for i in located],
+                [candidates[i]['longitude'] for i in located]
+            )
+            for i, d in zip(located, km):
+                distances[i] = round(float(d), 1)
+
+    results = []
+    for hospital, distance in zip(candidates, distances):
+        if radius_km is not None and has_origin and (distance is None or distance > radius_km):
+            continue
+        results.append(dict(
+            hospital,
+            can_fulfill=hospital['units_available'] >= units,
+            distance=distance,
+            distance_text=f"{distance} km" if distance is not None else 'N/A'
+        ))
+
+    results.sort(key=lambda h: (
+        0 if h['can_fulfill'] else 1,
+        h['distance'] if h['distance'] is not None else float('inf')
+    ))
+
+    return {
+        'hospitals': results[:limit],
+        'regions': [
+            {
+                'region': list(cell) if cell is not None else None,
+                'units': region['units'],
+                'hospitals': len(region['hospitals'])
+            }
+            for cell, region in regions.items()
+        ]
+    }
@@ -0,0 +1,55 @@
+"""
+Tests for the bulk donor import (bulk_upload_donors.py)
+"""
+
+import pandas as pd
+import pytest
+
+import bulk_upload_donors
+from bulk_upload_donors import bulk_upload_donors as upload, validate_chunk
+from models import Donor, ImportCheckpoint, PASSWORD_RESET_REQUIRED
+
+def write_donors_csv(path, count):
+    lines = ["name,blood_group,contact,Gender,donation_count,last_donated"]
+    lines += [f"Donor {i},O Positive,90000000{i:02d},{'Female' if i % 2 else 'Male'},{i},2026-0{i}-01"
+              for i in range(1, count + 1)]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+def test_resume_after_failed_chunk(app, tmp_path, monkeypatch):
+    csv_path = write_donors_csv(tmp_path / 'donors.csv', 5)
+    insert_chunk = bulk_upload_donors.insert_chunk
+    calls = []
+
+    def fail_second_chunk(mappings, checkpoint, rows_committed):
+        calls.append(rows_committed)
+        if len(calls) == 2:
+            raise RuntimeError('database went away')
+        return insert_chunk(mappings, checkpoint, rows_committed)
+
+    monkeypatch.setattr(bulk_upload_donors, 'insert_chunk', fail_second_chunk)
+    with pytest.raises(RuntimeError):
+        upload(csv_path, chunk_size=2, workers=1)
+    assert ImportCheckpoint.query.one().rows_committed == 2
+    assert Donor.query.count() == 2
+
+    monkeypatch.setattr(bulk_upload_donors, 'insert_chunk', insert_chunk)
+    upload(csv_path, chunk_size=2, workers=1)
+
+    assert Donor.query.count() == 5
+    assert ImportCheckpoint.query.one().completed_at is not None
+    donor = Donor.query.filter_by(contact='9000000001').one()
+    assert donor.password == PASSWORD_RESET_REQUIRED
+    assert str(donor.next_eligible) == '2026-04-01'  # female: 90 days after 2026-01-01
+
+def test_upsert_rejects_rows_without_contact():
+    chunk = pd.DataFrame({'name': ['Asha', 'Ravi'], 'blood_group': ['O Positive', 'A Positive'],
+                          'contact': ['9000000001', None]}, dtype=object)
+
+    donors, rejected = validate_chunk(chunk, 1)
+    assert list(donors['contact']) == ['9000000001', '99999990001']
+    assert rejected.empty
+
+    donors, rejected = validate_chunk(chunk, 1, upsert=True)
+    assert list(donors['contact']) == ['9000000001']
+    assert list(rejected['row']) == [2]
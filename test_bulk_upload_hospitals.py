@@ -0,0 +1,71 @@
+"""
+Tests for the bulk hospital import (bulk_upload_hospitals.py)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import distance_matrix
+from bulk_upload_hospitals import import_hospitals
+from extensions import db
+from models import BloodLot, Hospital, HospitalDistance, ImportCheckpoint
+
+def write_hospitals_csv(path, count):
+    lines = ["name,location,contact,username,latitude,longitude,O Positive"]
+    lines += [f"Hospital {i},Hyderabad,90000000{i:02d},hospital{i},{17.30 + i / 100},{78.40 + i / 100},{i}"
+              for i in range(1, count + 1)]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+def test_import_commits_hospitals_and_distances_per_chunk(app, tmp_path):
+    csv_path = write_hospitals_csv(tmp_path / 'hospitals.csv', 5)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        summary = import_hospitals(csv_path, pool, chunk_size=2, error_report=str(tmp_path / 'errors.csv'))
+
+    assert summary['inserted'] == 5
+    assert Hospital.query.count() == 5
+    assert HospitalDistance.query.count() == 5 * 4 // 2
+    assert BloodLot.query.count() == 5
+
+def test_resume_after_crash_mid_chunk(app, tmp_path, monkeypatch):
+    csv_path = write_hospitals_csv(tmp_path / 'hospitals.csv', 5)
+    error_report = str(tmp_path / 'errors.csv')
+    update_distances_for = distance_matrix.update_distances_for
+    calls = []
+
+    def crash_on_second_chunk(hospital_ids, commit=True):
+        calls.append(hospital_ids)
+        if len(calls) == 2:
+            raise RuntimeError('worker died')
+        return update_distances_for(hospital_ids, commit=commit)
+
+    monkeypatch.setattr(distance_matrix, 'update_distances_for', crash_on_second_chunk)
+    with ThreadPoolExecutor(max_workers=2) as pool, pytest.raises(RuntimeError):
+        import_hospitals(csv_path, pool, chunk_size=2, error_report=error_report)
+    db.session.rollback()
+
+    # The failed chunk left nothing behind and the checkpoint stayed on the first chunk
+    assert ImportCheckpoint.query.one().rows_committed == 2
+    assert Hospital.query.count() == 2
+
+    monkeypatch.setattr(distance_matrix, 'update_distances_for', update_distances_for)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        summary = import_hospitals(csv_path, pool, chunk_size=2, error_report=error_report)
+
+    assert summary['resumed_at'] == 2
+    assert summary['inserted'] == 3
+    assert Hospital.query.count() == 5
+    assert HospitalDistance.query.count() == 5 * 4 // 2
+    assert ImportCheckpoint.query.one().completed_at is not None
+
+def test_finished_file_is_not_imported_again(app, tmp_path):
+    csv_path = write_hospitals_csv(tmp_path / 'hospitals.csv', 3)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        import_hospitals(csv_path, pool, error_report=str(tmp_path / 'errors.csv'))
+        summary = import_hospitals(csv_path, pool, error_report=str(tmp_path / 'errors.csv'))
+
+    assert summary['already_imported']
+    assert Hospital.query.count() == 3
@@ -0,0 +1,119 @@
+"""
+Tests for inventory lots and the compare-and-swap retry (inventory.py, Hospital lot methods)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+import inventory
+from extensions import db
+from inventory import MAX_INVENTORY_ATTEMPTS, expire_blood_lots, get_contention_stats, retry_on_inventory_conflict
+from models import BloodLot, Hospital, StockEvent
+
+@pytest.fixture
+def contention_stats(monkeypatch):
+    """Counters reset for one test"""
+    monkeypatch.setattr(inventory, '_contention_stats', dict.fromkeys(get_contention_stats(), 0))
+
+def test_concurrent_inventory_write_raises_stale_data(app, make_hospital):
+    hospital = make_hospital('general', {'O Positive': 5})
+    # Another transaction wins the compare-and-swap first
+    db.session.execute(db.text("UPDATE hospitals SET version = version + 1 WHERE id = :id"), {'id': hospital.id})
+
+    hospital.set_inventory({'O Positive': 4})
+    with pytest.raises(StaleDataError):
+        db.session.commit()
+
+def test_conflict_is_retried(app, contention_stats):
+    attempts = []
+
+    @retry_on_inventory_conflict
+    def view():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise StaleDataError('version mismatch')
+        return 'saved'
+
+    assert view() == 'saved'
+    assert len(attempts) == 2
+    assert get_contention_stats() == {'transactions': 1, 'conflicts': 1, 'retries': 1, 'exhausted': 0}
+
+def test_conflict_gives_up_with_409(app, contention_stats):
+    @retry_on_inventory_conflict
+    def view():
+        raise StaleDataError('version mismatch')
+
+    response, status = view()
+
+    assert status == 409
+    assert 'concurrently' in response.get_json()['error']
+    assert get_contention_stats() == {
+        'transactions': 1, 'conflicts': MAX_INVENTORY_ATTEMPTS,
+        'retries': MAX_INVENTORY_ATTEMPTS - 1, 'exhausted': 1
+    }
+
+def test_route_retries_after_losing_the_version_race(app, client, make_hospital, login, contention_stats, monkeypatch):
+    hospital = make_hospital('general')
+    login('general')
+    add_blood_lot = Hospital.add_blood_lot
+    calls = []
+
+    def add_after_concurrent_write(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            db.session.execute(db.text("UPDATE hospitals SET version = version + 1 WHERE id = :id"), {'id': self.id})
+        return add_blood_lot(self, *args, **kwargs)
+
+    monkeypatch.setattr(Hospital, 'add_blood_lot', add_after_concurrent_write)
+    response = client.post('/update_inventory', json={'blood_group': 'O Positive', 'units': 3})
+
+    assert response.status_code == 200
+    assert response.get_json()['inventory'] == {'O Positive': 3}
+    assert len(calls) == 2
+    assert BloodLot.query.filter_by(hospital_id=hospital.id).count() == 1
+    assert get_contention_stats()['retries'] == 1
+
+def test_allocation_takes_earliest_expiring_lots_first(app, make_hospital):
+    hospital = make_hospital('general')
+    now = datetime.utcnow()
+    expired = hospital.add_blood_lot('O Positive', 4, expires_at=now - timedelta(days=1))
+    late = hospital.add_blood_lot('O Positive', 5, expires_at=now + timedelta(days=30))
+    soon = hospital.add_blood_lot('O Positive', 3, expires_at=now + timedelta(days=2))
+    other_group = hospital.add_blood_lot('A Positive', 6, expires_at=now + timedelta(days=1))
+    db.session.commit()
+
+    allocations = hospital.allocate_blood_lots('O Positive', 6)
+    db.session.commit()
+
+    assert [(lot.id, taken) for lot, taken in allocations] == [(soon.id, 3), (late.id, 3)]
+    assert (expired.units, soon.units, late.units, other_group.units) == (4, 0, 2, 6)
+    assert hospital.get_inventory() == {'O Positive': 12 - 6, 'A Positive': 6}
+
+def test_allocation_stops_at_unexpired_stock(app, make_hospital):
+    hospital = make_hospital('general')
+    now = datetime.utcnow()
+    hospital.add_blood_lot('O Positive', 4, expires_at=now - timedelta(days=1))
+    hospital.add_blood_lot('O Positive', 2, expires_at=now + timedelta(days=5))
+    db.session.commit()
+
+    assert hospital.update_blood_stock('O Positive', -5) == 2
+    db.session.commit()
+    assert hospital.get_inventory() == {'O Positive': 4}
+
+def test_expiry_sweep_writes_off_expired_lots(app, make_hospital):
+    first = make_hospital('first')
+    second = make_hospital('second')
+    now = datetime.utcnow()
+    first.add_blood_lot('O Positive', 4, expires_at=now - timedelta(hours=1))
+    first.add_blood_lot('O Positive', 2, expires_at=now + timedelta(days=5))
+    second.add_blood_lot('A Positive', 3, expires_at=now - timedelta(days=2))
+    db.session.commit()
+
+    assert expire_blood_lots(now) == 7
+    assert first.get_inventory() == {'O Positive': 2}
+    assert second.get_inventory() == {'A Positive': 0}
+    assert StockEvent.query.filter_by(reason='expired').count() == 2
+    # Nothing left to expire on the next run
+    assert expire_blood_lots(now) == 0
@@ -0,0 +1,65 @@
+"""
+Tests for the donor report statistics (reports.py)
+"""
+
+from datetime import date, timedelta
+
+from extensions import db
+from models import Donor
+from reports import aggregate_donors, aggregate_donors_db, load_donor_aggregates, read_donor_csv, read_donor_db
+
+def test_csv_with_blank_cells(tmp_path):
+    csv_path = tmp_path / 'donors.csv'
+    csv_path.write_text(
+        "user_id,name,blood_group,location,donation_count,last_donated\n"
+        "1,Asha,,Hyderabad,2,2026-01-01\n"
+        "2,Ravi,O Positive,,1,\n"
+        "3,Meena,O Positive,Hyderabad,,\n"
+    )
+
+    stats = load_donor_aggregates(str(csv_path))
+
+    assert stats['total_donors'] == 3
+    assert stats['total_donations'] == 3
+    assert stats['by_blood_group']['Unknown']['donors'] == 1
+    assert stats['by_blood_group']['O Positive']['donors'] == 2
+    assert stats['by_location'] == {
+        'Hyderabad': {'donors': 2, 'donations': 2},
+        'Unknown': {'donors': 1, 'donations': 1}
+    }
+
+def test_csv_chunks_add_up(tmp_path):
+    csv_path = tmp_path / 'donors.csv'
+    rows = [f"{i},Donor {i},{'A Positive' if i % 2 else ''},City {i % 3},{i % 4},2026-0{i % 9 + 1}-01" for i in range(1, 41)]
+    csv_path.write_text("user_id,name,blood_group,location,donation_count,last_donated\n" + "\n".join(rows) + "\n")
+
+    today = '2026-10-01'
+    whole = aggregate_donors(read_donor_csv(str(csv_path)), today=today)
+    chunked = aggregate_donors(read_donor_csv(str(csv_path), chunksize=7), today=today)
+
+    assert chunked == whole
+
+def test_database_aggregates_match_pandas(app):
+    """aggregate_donors_db repeats the aggregate_donors rules in SQL; both must agree"""
+    today = date.today()
+    donors = []
+    # Every persona/recency boundary on both sides, across groups, places and genders
+    for i, days_ago in enumerate([None, 0, 89, 90, 91, 119, 120, 121, 179, 180, 181, 364, 365, 366, 729, 730, 731, 2000]):
+        for donations in (0, 1, 2, 3, 5):
+            donors.append(Donor(
+                name=f'Donor {i}-{donations}',
+                blood_group=['O Positive', 'A Positive', 'B Negative'][(i + donations) % 3],
+                location=['Hyderabad', 'Warangal'][i % 2],
+                contact=f'90000{i:03d}{donations}',
+                donations_count=donations,
+                gender='female' if donations % 2 else 'male',
+                last_donated=None if days_ago is None else today - timedelta(days=days_ago)
+            ))
+    db.session.add_all(donors)
+    db.session.commit()
+
+    from_sql = aggregate_donors_db(today=today)
+    from_pandas = aggregate_donors(read_donor_db(), today=today)
+
+    assert from_sql == from_pandas
+    assert from_sql['total_donors'] == len(donors)
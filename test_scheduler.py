@@ -0,0 +1,98 @@
+"""
+Tests for the periodic job scheduler (scheduler.py)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import scheduler
+from extensions import db
+from models import JobRun, ScheduledJob
+from scheduler import claim_job, next_run_after, run_due_jobs, run_job, sync_jobs
+
+runs = []
+
+def record_run():
+    runs.append(datetime.now())
+
+def fail_run():
+    raise RuntimeError('job broke')
+
+@pytest.fixture
+def jobs(app, monkeypatch):
+    """Two test jobs in place of the real schedule, with rows created by sync_jobs"""
+    monkeypatch.setattr(scheduler, 'JOBS', {
+        'every_minute': {'schedule': '* * * * *', 'target': 'test_scheduler:record_run'},
+        'broken': {'schedule': '0 3 * * *', 'target': 'test_scheduler:fail_run', 'lease_seconds': 60}
+    })
+    runs.clear()
+    sync_jobs(datetime(2026, 1, 1, 12, 0))
+    return scheduler.JOBS
+
+def test_next_run_after():
+    assert next_run_after('*/15 * * * *', datetime(2026, 1, 1, 12, 7, 30)) == datetime(2026, 1, 1, 12, 15)
+    assert next_run_after('0 3 * * *', datetime(2026, 1, 1, 3, 0)) == datetime(2026, 1, 2, 3, 0)
+    # 2026-01-04 is a Sunday (weekday 0)
+    assert next_run_after('0 3 * * 0', datetime(2026, 1, 1)) == datetime(2026, 1, 4, 3, 0)
+    with pytest.raises(ValueError):
+        next_run_after('61 * * * *', datetime(2026, 1, 1))
+
+def test_sync_jobs_creates_and_reschedules_rows(jobs, monkeypatch):
+    rows = {row.name: row for row in ScheduledJob.query}
+    assert rows['every_minute'].next_run_at == datetime(2026, 1, 1, 12, 1)
+    assert rows['broken'].next_run_at == datetime(2026, 1, 2, 3, 0)
+
+    monkeypatch.setitem(jobs, 'broken', dict(jobs['broken'], schedule='30 * * * *'))
+    sync_jobs(datetime(2026, 1, 1, 12, 0))
+    assert db.session.get(ScheduledJob, 'broken').next_run_at == datetime(2026, 1, 1, 12, 30)
+
+def test_lease_is_held_by_one_worker(jobs):
+    now = datetime(2026, 1, 1, 12, 5)
+
+    assert claim_job('every_minute', 'worker-a', now)
+    # A second worker (or a second app instance) loses the conditional UPDATE
+    assert not claim_job('every_minute', 'worker-b', now)
+    assert not claim_job('every_minute', 'worker-b', now, force=True)
+
+    row = db.session.get(ScheduledJob, 'every_minute')
+    db.session.refresh(row)
+    assert row.locked_by == 'worker-a'
+    assert row.locked_until == now + timedelta(seconds=scheduler.DEFAULT_LEASE_SECONDS)
+
+def test_expired_lease_is_taken_over(jobs):
+    now = datetime(2026, 1, 1, 12, 5)
+    assert claim_job('broken', 'worker-a', datetime(2026, 1, 2, 3, 0))
+
+    # worker-a died; its 60 s lease runs out and another worker takes the job
+    assert not claim_job('broken', 'worker-b', datetime(2026, 1, 2, 3, 0, 59))
+    assert claim_job('broken', 'worker-b', datetime(2026, 1, 2, 3, 1, 1))
+    assert not claim_job('every_minute', 'worker-b', now - timedelta(minutes=10))  # not due yet
+
+def test_run_job_records_the_run_and_releases_the_lease(jobs):
+    run = run_job('every_minute', worker='worker-a', force=True)
+
+    assert run.status == 'succeeded'
+    assert len(runs) == 1
+    row = db.session.get(ScheduledJob, 'every_minute')
+    assert row.locked_by is None and row.locked_until is None
+    assert row.last_run_at is not None and row.next_run_at > row.last_run_at
+
+def test_failed_run_keeps_the_traceback(jobs):
+    run = run_job('broken', worker='worker-a', force=True)
+
+    assert run.status == 'failed'
+    assert 'job broke' in run.error
+    assert db.session.get(ScheduledJob, 'broken').locked_by is None
+
+def test_run_due_jobs_skips_jobs_held_elsewhere(jobs):
+    now = datetime.now()
+    ScheduledJob.query.update({ScheduledJob.next_run_at: now - timedelta(minutes=1)})
+    # Rows for jobs that were removed from JOBS are ignored
+    db.session.add(ScheduledJob(name='retired', schedule='* * * * *', next_run_at=now - timedelta(days=1)))
+    db.session.commit()
+    assert claim_job('broken', 'worker-b', now, force=True)
+
+    assert run_due_jobs(worker='worker-a', now=now) == ['every_minute']
+    assert JobRun.query.filter_by(job_name='broken').count() == 0
+    assert JobRun.query.filter_by(job_name='retired').count() == 0
@@ -0,0 +1,161 @@
+"""
+Inter-hospital redistribution planner for ClotSync
+Turns shortage forecasts into a minimum-cost set of transfers. For each blood
+group, hospitals with projected surplus supply hospitals with projected deficit;
+this is a transportation problem (min-cost flow on a bipartite graph), solved
+as a sparse LP with HiGHS. Each deficit hospital is only linked to its nearest
+surplus hospitals, which keeps the problem small for thousands of hospitals.
+Distances come from the precomputed hospital distance matrix.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix
+
+from distance_matrix import get_distance_matrix
+from models import ShortageForecast
+
+PLANNING_HORIZON_DAYS = 7    # cover projected net demand for this long...
+SAFETY_STOCK_DAYS = 3        # ...plus this buffer before a hospital counts as short
+NEAREST_SUPPLIERS = 10       # candidate suppliers per deficit hospital
+MAX_TRANSFER_KM = 500
+UNMET_PENALTY = 1e6          # cost of leaving one unit of deficit uncovered (>> any distance)
+PLAN_CACHE_SECONDS = 300
+
+_plan_lock = threading.Lock()
+_plan_cache = {}  # blood_group or None -> (computed_at monotonic, plan)
+
+def _balances(forecasts):
+    """Split forecast rows into surplus (+) and deficit (-) units per hospital"""
+    cover_days = PLANNING_HORIZON_DAYS + SAFETY_STOCK_DAYS
+    balances = {}
+    for f in forecasts:
+        need = math.ceil(max(f.daily_demand - f.daily_supply, 0) * cover_days)
+        balance = f.stock_units - need
+        if balance:
+            balances[f.hospital_id] = balance
+    return balances
+
+def _candidate_edges(consumers, suppliers, matrix):
+    """(consumer index, supplier index, km) for each consumer's nearest suppliers"""
+    # Consumer x supplier block of the distance matrix; unknown pairs are never candidates
+    km = matrix.km[np.ix_(matrix.indices(consumers), matrix.indices(suppliers))].astype(float)
+    km[np.isnan(km)] = np.inf
+    k = min(NEAREST_SUPPLIERS, len(suppliers))
+    if k < len(suppliers):
+        nearest = np.argpartition(km, k - 1, axis=1)[:, :k]
+    else:
+        nearest = np.broadcast_to(np.arange(len(suppliers)), km.shape)
+
+    rows = np.repeat(np.arange(len(consumers)), nearest.shape[1])
+    cols = nearest.ravel()
+    costs = km[rows, cols]
+    within = costs <= MAX_TRANSFER_KM
+    return rows[within], cols[within], costs[within]
+
+def _solve_group(blood_group, balances, matrix):
+    suppliers = [h for h, b in balances.items() if b > 0 and h in matrix]
+    consumers = [h for h, b in balances.items() if b < 0 and h in matrix]
+    unlocated = [h for h, b in balances.items() if b < 0 and h not in matrix]
+    unmet = [{'hospital_id': h, 'blood_group': blood_group, 'units': -balances[h]} for h in unlocated]
+    if not consumers:
+        return [], unmet
+    if not suppliers:
+        return [], unmet + [{'hospital_id': h, 'blood_group': blood_group, 'units': -balances[h]} for h in consumers]
+
+    edge_consumer, edge_supplier, edge_km = _candidate_edges(consumers, suppliers, matrix)
+    n_edges, n_consumers, n_suppliers = len(edge_km), len(consumers), len(suppliers)
+
+    # Variables: units shipped on each edge, then unmet units per consumer
+    cost = np.concatenate([edge_km, np.full(n_consumers, UNMET_PENALTY)])
+    # Each consumer's deficit is covered exactly (shipped + unmet)
+    a_eq = coo_matrix(
+        (np.ones(n_edges + n_consumers),
+         (np.concatenate([edge_consumer, np.arange(n_consumers)]),
+          np.arange(n_edges + n_consumers))),
+        shape=(n_consumers, n_edges + n_consumers)
+    )
+    b_eq = np.array([-balances[h] for h in consumers], dtype=float)
+    # Each supplier ships at most its surplus
+    a_ub = coo_matrix(
+        (np.ones(n_edges), (edge_supplier, np.arange(n_edges))),
+        shape=(n_suppliers, n_edges + n_consumers)
+    )
+    b_ub = np.array([balances[h] for h in suppliers], dtype=float)
+
+    result = linprog(cost, A_ub=a_ub.tocsr(), b_ub=b_ub, A_eq=a_eq.tocsr(), b_eq=b_eq,
+                     bounds=(0, None), method='highs')
+    if result.status != 0:
+        raise RuntimeError(f"Transfer planning failed for {blood_group}: {result.message}")
+
+    # Transportation problems have integral optimal vertices; rounding only removes float noise
+    shipped = np.rint(result.x[:n_edges]).astype(int)
+    transfers = [
+        {
+            'from_hospital_id': suppliers[edge_supplier[e]],
+            'to_hospital_id': consumers[edge_consumer[e]],
+            'blood_group': blood_group,
+            'units': int(shipped[e]),
+            'distance_km': round(float(edge_km[e]), 1)
+        }
+        for e in np.nonzero(shipped > 0)[0]
+    ]
+    leftover = np.rint(result.x[n_edges:]).astype(int)
+    unmet += [
+        {'hospital_id': consumers[i], 'blood_group': blood_group, 'units': int(leftover[i])}
+        for i in np.nonzero(leftover > 0)[0]
+    ]
+    return transfers, unmet
+
+def plan_transfers(blood_group=None):
+    """Minimum-distance transfers that cover forecast shortages, per blood group"""
+    query = ShortageForecast.query
+    if blood_group:
+        query = query.filter_by(blood_group=blood_group)
+
+    by_group = {}
+    for f in query.all():
+        by_group.setdefault(f.blood_group, []).append(f)
+
+    matrix = get_distance_matrix()
+    transfers, unmet = [], []
+    for group, forecasts in by_group.items():
+        group_transfers, group_unmet = _solve_group(group, _balances(forecasts), matrix)
+        transfers.extend(group_transfers)
+        unmet.extend(group_unmet)
+
+    transfers.sort(key=lambda t: (t['blood_group'], t['to_hospital_id'], t['distance_km']))
+    return {
+        'generated_at': datetime.utcnow().isoformat(),
+        'horizon_days': PLANNING_HORIZON_DAYS,
+        'transfers': transfers,
+        'total_units': sum(t['units'] for t in transfers),
+        'total_unit_km': round(sum(t['units'] * t['distance_km'] for t in transfers), 1),
+        'unmet': unmet
+    }
+
+def get_transfer_plan(blood_group=None, refresh=False):
+    """Cached plan; recomputed at most every PLAN_CACHE_SECONDS unless refresh=True"""
+    now = time.monotonic()
+    with _plan_lock:
+        cached = _plan_cache.get(blood_group)
+        if cached and not refresh and now - cached[0] < PLAN_CACHE_SECONDS:
+            return cached[1]
+
+    plan = plan_transfers(blood_group)
+    with _plan_lock:
+        _plan_cache[blood_group] = (now, plan)
+    return plan
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from app import app
+
+    with app.app_context():
+        print(json.dumps(plan_transfers(sys.argv[1] if len(sys.argv) > 1 else None), indent=2))
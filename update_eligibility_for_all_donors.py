@@ -1,53 +1,70 @@
 #!/usr/bin/env python3
 """
-Utility script to update eligibility status for all existing donors
-Run this after adding the eligibility_status column to update existing records
+Utility script to backfill next_eligible for all existing donors
+Eligibility is derived from next_eligible (see Donor.is_eligible), which is kept
+in step with last_donated on every ORM write. This script repairs rows written
+around the ORM (SQL migrations, older imports) with set-based UPDATEs, one
+primary-key range at a time.
 """
 
+from sqlalchemy import func, literal_column, or_, case
+
 from app import app, db
-from models import Donor
-from datetime import date
+from models import Donor, DONATION_GAP_DAYS, FEMALE_DONATION_GAP_DAYS
+
+ELIGIBILITY_BATCH_SIZE = 20000  # donor ids per UPDATE
+
+def _add_days(column, days):
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column, f'+{days} days')
+    return func.date_add(column, literal_column(f'INTERVAL {days} DAY'))
+
+def next_eligible_sql():
+    """SQL for last_donated + the donor's gap (the rule in Donor._track_next_eligible)"""
+    return case(
+        (func.lower(Donor.gender) == 'female', _add_days(Donor.last_donated, FEMALE_DONATION_GAP_DAYS)),
+        else_=_add_days(Donor.last_donated, DONATION_GAP_DAYS)
+    )
+
+def refresh_next_eligible(*filters, batch_size=ELIGIBILITY_BATCH_SIZE):
+    """Set next_eligible from last_donated wherever it differs; returns the number of rows changed"""
+    first_id, last_id = db.session.query(func.min(Donor.id), func.max(Donor.id)).one()
+    if first_id is None:
+        return 0
+    
+    next_eligible = next_eligible_sql()
+    changed = 0
+    for start in range(first_id, last_id + 1, batch_size):
+        changed += Donor.query.filter(
+            Donor.id >= start, Donor.id < start + batch_size, *filters,
+            Donor.last_donated.isnot(None),
+            or_(Donor.next_eligible.is_(None), Donor.next_eligible != next_eligible)
+        ).update({Donor.next_eligible: next_eligible}, synchronize_session=False)
+        db.session.commit()
+        print(f"Processed donor ids {start}-{min(start + batch_size, last_id + 1) - 1} ({changed} changed so far)")
+    return changed
 
 def update_all_donor_eligibility():
-    """Update eligibility status for all existing donors"""
+    """Backfill next_eligible for all existing donors"""
     with app.app_context():
-        print("Starting eligibility status update for all donors...")
-        
-        # Get all donors
-        donors = Donor.query.all()
-        print(f"Found {len(donors)} donors to update")
-        
-        updated_count = 0
-        for donor in donors:
-            try:
-                # Calculate eligibility status
-                donor.calculate_eligibility_status()
-                updated_count += 1
-                
-                if updated_count % 50 == 0:
-                    print(f"Processed {updated_count}/{len(donors)} donors...")
-                    
-            except Exception as e:
-                print(f"Error updating donor {donor.id} ({donor.name}): {e}")
-                continue
+        print("Starting next_eligible backfill for all donors...")
         
-        # Commit all changes
         try:
-            db.session.commit()
+            changed = refresh_next_eligible()
             print(f"\nEligibility update completed successfully!")
-            print(f"Updated {updated_count} donors")
+            print(f"Updated {changed} donors")
             
             # Show summary
-            eligible_count = Donor.query.filter_by(eligibility_status='eligible').count()
-            not_eligible_count = Donor.query.filter_by(eligibility_status='not eligible').count()
+            eligible_count = Donor.query.filter(Donor.is_eligible).count()
+            not_eligible_count = Donor.query.filter(~Donor.is_eligible).count()
             
             print(f"\nEligibility Summary:")
             print(f"  Eligible: {eligible_count}")
             print(f"  Not Eligible: {not_eligible_count}")
-            print(f"  Total: {len(donors)}")
+            print(f"  Total: {eligible_count + not_eligible_count}")
             
         except Exception as e:
-            print(f"Error committing changes: {e}")
+            print(f"Error updating eligibility: {e}")
             db.session.rollback()
 
 if __name__ == '__main__':
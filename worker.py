@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+ClotSync - Background worker
+Runs the periodic maintenance jobs from scheduler.py. Start one next to each app
+instance (or just one); the database leases keep every job to a single runner.
+
+Usage: python worker.py                 run forever
+       python worker.py --once          run the jobs that are due now and exit
+       python worker.py --run JOB       run one job now, whether or not it is due
+       python worker.py --list          show the schedule
+       python worker.py --history [JOB] show recent runs
+"""
+
+import argparse
+import sys
+
+from app import app
+from extensions import db
+from models import ScheduledJob
+from scheduler import JOBS, POLL_SECONDS, job_history, run_due_jobs, run_forever, run_job, sync_jobs
+
+def print_schedule():
+    rows = {row.name: row for row in ScheduledJob.query.all()}
+    for name, job in JOBS.items():
+        row = rows.get(name)
+        next_run = row.next_run_at.strftime('%Y-%m-%d %H:%M') if row else '-'
+        last_run = row.last_run_at.strftime('%Y-%m-%d %H:%M') if row and row.last_run_at else 'never'
+        running = f" (running on {row.locked_by})" if row and row.locked_by else ''
+        print(f"{name:<22} {job['schedule']:<14} next {next_run}  last {last_run}{running}")
+
+def print_history(name):
+    for run in job_history(name):
+        duration = f"{run.duration_seconds:.1f}s" if run.duration_seconds is not None else '-'
+        print(f"{run.started_at.strftime('%Y-%m-%d %H:%M:%S')}  {run.job_name:<22} {run.status:<10} {duration:>8}  {run.worker}")
+        if run.error:
+            print(f"    {run.error.strip().splitlines()[-1]}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run ClotSync periodic maintenance jobs')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--once', action='store_true', help='Run the jobs that are due now and exit')
+    group.add_argument('--run', choices=list(JOBS), help='Run one job now, whether or not it is due')
+    group.add_argument('--list', action='store_true', help='Show each job\'s schedule')
+    group.add_argument('--history', nargs='?', const='', metavar='JOB', help='Show recent runs')
+    parser.add_argument('--poll', type=int, default=POLL_SECONDS, help=f'Seconds between polls (default: {POLL_SECONDS})')
+    args = parser.parse_args()
+
+    with app.app_context():
+        sync_jobs()
+        if args.list:
+            print_schedule()
+        elif args.history is not None:
+            print_history(args.history or None)
+        elif args.run:
+            run = run_job(args.run, force=True)
+            if run is None:
+                print(f"Job {args.run} is already running on another worker")
+            elif run.status == 'failed':
+                sys.exit(1)
+        elif args.once:
+            ran = run_due_jobs()
+            print(f"Ran {len(ran)} due jobs" + (f": {', '.join(ran)}" if ran else ''))
+        else:
+            try:
+                run_forever(args.poll)
+            except KeyboardInterrupt:
+                print("\nWorker stopped")
+            finally:
+                db.session.remove()
+
+if __name__ == '__main__':
+    main()